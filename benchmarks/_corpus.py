@@ -0,0 +1,38 @@
+# BME Document Navigator - Benchmark Corpus
+# The synthetic service-manual corpus and the empty index database shared by the
+# benchmark scripts in this folder (not a benchmark itself).
+import os
+import sys
+import random
+from contextlib import redirect_stdout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bme_indexer import init_db, connect_index
+
+VOCABULARY = ("pump valve sensor calibration alarm pressure flow battery display error code "
+              "replace inspect torque firmware module board connector cable tubing filter "
+              "ventilator infusion monitor defibrillator oxygen patient circuit test procedure").split()
+
+
+def make_corpus(docs, pages, words_per_page, seed=42):
+    """Builds [(doc_id, [(page_number, text), ...]), ...] from a fixed vocabulary."""
+    rng = random.Random(seed)
+    corpus = []
+    for doc_id in range(1, docs + 1):
+        doc_pages = []
+        for page_number in range(pages):
+            words = rng.choices(VOCABULARY, k=words_per_page)
+            words.append(f"E{rng.randint(100, 999)}") # Error-code-like tokens
+            doc_pages.append((page_number, " ".join(words)))
+        corpus.append((doc_id, doc_pages))
+    return corpus
+
+
+def create_database(db_path, corpus):
+    """Initializes a fresh database (schema from init_db) holding a documents row per corpus document, without text."""
+    with redirect_stdout(None): # Silence init_db's status line
+        init_db(db_path)
+    conn = connect_index(db_path)
+    conn.executemany("INSERT INTO documents (id, filename, filepath, last_modified) VALUES (?, ?, ?, 0)",
+                     [(doc_id, f"doc{doc_id}.pdf", f"/library/m{doc_id % 50}/doc{doc_id}.pdf") for doc_id, pages in corpus])
+    conn.commit()
+    conn.close()
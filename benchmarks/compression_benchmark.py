@@ -0,0 +1,82 @@
+# BME Document Navigator - Page Text Compression Benchmark
+# Builds the same synthetic corpus with page text stored plain and zlib-compressed
+# (bme_indexer.set_page_compression) and reports database size, page write
+# throughput and search_content_snippets latency for each, plus the time the
+# 'compress' migration takes on the plain database.
+#   python benchmarks/compression_benchmark.py --docs 20 --pages 800 --levels 0 1 6 9
+import os
+import sys
+import time
+import argparse
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bme_indexer import connect_index, set_page_compression, write_extraction_result, flush_fts_pages, search_content_snippets
+from _corpus import make_corpus, create_database
+
+QUERIES = ["calibration", "pump AND alarm", "\"pressure sensor\"", "E417", "firmware OR torque", "defib*"]
+
+
+def build_database(db_path, corpus, level):
+    """Writes the corpus into a fresh database storing page text at level. Returns write seconds."""
+    create_database(db_path, corpus)
+    set_page_compression(db_path, level)
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+    start_time = time.perf_counter()
+    page_buffer = []
+    for doc_id, pages in corpus:
+        write_extraction_result(cursor, {'doc_id': doc_id, 'pages': pages}, True, page_buffer)
+    flush_fts_pages(cursor, page_buffer)
+    conn.commit()
+    elapsed = time.perf_counter() - start_time
+    conn.close()
+    return elapsed
+
+
+def snippet_latency(db_path, repeat):
+    """Best-of-repeat seconds per search_content_snippets query, averaged over QUERIES."""
+    total = 0
+    for query in QUERIES:
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            search_content_snippets(query, db_path)
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        total += best
+    return total / len(QUERIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compressed page text storage.")
+    parser.add_argument('--docs', type=int, default=20, help="Synthetic documents (default: 20)")
+    parser.add_argument('--pages', type=int, default=800, help="Pages per document (default: 800)")
+    parser.add_argument('--words-per-page', type=int, default=300, help="Words per page (default: 300)")
+    parser.add_argument('--levels', type=int, nargs='+', default=[0, 6], help="zlib levels to try; 0 = plain (default: 0 6)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per snippet query; the best is used (default: 3)")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.docs, args.pages, args.words_per_page)
+    total_rows = args.docs * args.pages
+    print(f"Corpus: {args.docs} docs x {args.pages} pages x {args.words_per_page} words = {total_rows} page rows")
+    baseline = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for level in args.levels:
+            db_path = os.path.join(temp_dir, f'bench{level}.db')
+            write_seconds = build_database(db_path, corpus, level)
+            size_mb = os.path.getsize(db_path) / (1024 * 1024)
+            baseline = baseline or size_mb
+            latency_ms = snippet_latency(db_path, args.repeat) * 1000
+            label = f"level {level}" if level else "plain (before)"
+            print(f"{label:<16} {size_mb:8.1f} MB  x{size_mb / baseline:.2f}  {total_rows / write_seconds:10.0f} pages/s"
+                  f"  {latency_ms:8.1f} ms/snippet query")
+
+        level = max(args.levels)
+        if level and 0 in args.levels:
+            stats = set_page_compression(os.path.join(temp_dir, 'bench0.db'), level)
+            print(f"Migrating the plain database to level {level}: {stats['converted']} pages in {stats['duration']:.2f}s, "
+                  f"{stats['bytes_before'] / (1024 * 1024):.1f} MB -> {stats['bytes_after'] / (1024 * 1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
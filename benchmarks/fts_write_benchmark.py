@@ -0,0 +1,72 @@
+# BME Document Navigator - FTS Write Benchmark
+# Compares page insert throughput (rows/sec; pages + the documents_fts index) of the old per-page INSERT
+# loop against buffered executemany() batches (bme_indexer.write_extraction_result)
+# on a synthetic corpus of service-manual-sized documents.
+#   python benchmarks/fts_write_benchmark.py --docs 40 --pages 800 --batch-sizes 100 500 2000
+import os
+import sys
+import time
+import argparse
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bme_indexer import connect_index, write_extraction_result, flush_fts_pages
+from _corpus import make_corpus, create_database
+
+
+def write_per_row(cursor, corpus):
+    """Before: one INSERT per page (the original scan loop)."""
+    for doc_id, pages in corpus:
+        for page_number, text in pages:
+            cursor.execute("INSERT INTO pages (doc_id, page_number, text) VALUES (?, ?, ?)",
+                           (doc_id, page_number, text))
+
+
+def write_batched(cursor, corpus, batch_rows):
+    """After: pages buffered across documents and flushed with executemany()."""
+    page_buffer = []
+    for doc_id, pages in corpus:
+        write_extraction_result(cursor, {'doc_id': doc_id, 'pages': pages}, True, page_buffer, batch_rows)
+    flush_fts_pages(cursor, page_buffer)
+
+
+def run_case(corpus, writer):
+    """Times one write strategy into a fresh database (schema from init_db). Returns seconds."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'bench.db')
+        create_database(db_path, corpus)
+        conn = connect_index(db_path)
+        cursor = conn.cursor()
+        start_time = time.perf_counter()
+        writer(cursor)
+        conn.commit()
+        elapsed = time.perf_counter() - start_time
+        conn.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark page text write strategies.")
+    parser.add_argument('--docs', type=int, default=20, help="Synthetic documents (default: 20)")
+    parser.add_argument('--pages', type=int, default=800, help="Pages per document (default: 800)")
+    parser.add_argument('--words-per-page', type=int, default=300, help="Words per page (default: 300)")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[50, 500, 2000], help="executemany batch sizes to try")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case; the best is reported (default: 3)")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.docs, args.pages, args.words_per_page)
+    total_rows = args.docs * args.pages
+    print(f"Corpus: {args.docs} docs x {args.pages} pages x {args.words_per_page} words = {total_rows} page rows")
+    cases = [("per-row INSERT (before)", lambda cursor: write_per_row(cursor, corpus))]
+    for batch_rows in args.batch_sizes:
+        cases.append((f"executemany, batch {batch_rows}", lambda cursor, b=batch_rows: write_batched(cursor, corpus, b)))
+
+    baseline = None
+    for label, writer in cases:
+        best = min(run_case(corpus, writer) for _ in range(args.repeat))
+        rows_per_second = total_rows / best
+        baseline = baseline or rows_per_second
+        print(f"{label:<28} {best:8.2f}s {rows_per_second:12.0f} rows/s  x{rows_per_second / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# BME Document Navigator - Removal Benchmark
+# Compares removing a folder's worth of documents with per-row
+# executemany('DELETE FROM documents WHERE id = ?') (the delete trigger's statements
+# for every document) against the set-based bme_indexer.remove_documents.
+#   python benchmarks/removal_benchmark.py --docs 5000 --pages 10 --remove 500
+import os
+import sys
+import time
+import argparse
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bme_indexer import connect_index, remove_documents
+from _corpus import make_corpus, create_database
+
+
+def build_database(db_path, docs, pages, words_per_page):
+    """Fills a fresh database with docs documents that each own their text."""
+    corpus = make_corpus(docs, pages, words_per_page)
+    create_database(db_path, corpus)
+    conn = connect_index(db_path)
+    conn.execute("UPDATE documents SET text_doc_id = id")
+    conn.executemany("INSERT INTO pages (doc_id, page_number, text) VALUES (?, ?, ?)",
+                     [(doc_id, page_number, text) for doc_id, pages in corpus for page_number, text in pages])
+    conn.commit()
+    conn.close()
+
+
+def remove_per_row(cursor, doc_ids):
+    """Before: one DELETE per document (the original removal loop)."""
+    cursor.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in doc_ids])
+
+
+def run_case(args, remover):
+    """Times one removal strategy on a freshly built database. Returns seconds."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'bench.db')
+        build_database(db_path, args.docs, args.pages, args.words_per_page)
+        conn = connect_index(db_path)
+        cursor = conn.cursor()
+        doc_ids = range(1, args.remove + 1)
+        start_time = time.perf_counter()
+        remover(cursor, doc_ids)
+        conn.commit()
+        elapsed = time.perf_counter() - start_time
+        left = cursor.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        conn.close()
+    if left != (args.docs - args.remove) * args.pages: print(f"!!! {left} pages left, expected {(args.docs - args.remove) * args.pages}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark removing documents and their FTS rows.")
+    parser.add_argument('--docs', type=int, default=5000, help="Indexed documents (default: 5000)")
+    parser.add_argument('--pages', type=int, default=10, help="Pages per document (default: 10)")
+    parser.add_argument('--words-per-page', type=int, default=50, help="Words per page (default: 50)")
+    parser.add_argument('--remove', type=int, default=500, help="Documents removed (default: 500)")
+    args = parser.parse_args()
+    args.remove = min(args.remove, args.docs)
+
+    print(f"Index: {args.docs} docs x {args.pages} pages = {args.docs * args.pages} page rows; removing {args.remove} docs")
+    baseline = None
+    for label, remover in [("per-row DELETE (before)", remove_per_row), ("remove_documents", remove_documents)]:
+        elapsed = run_case(args, remover)
+        baseline = baseline or elapsed
+        print(f"{label:<26} {elapsed:8.2f}s {args.remove / elapsed:10.0f} docs/s  x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
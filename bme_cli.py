@@ -0,0 +1,333 @@
+# BME Document Navigator - Headless Command Line
+# Index, search, inspect and maintain the document database without a display, e.g. from cron:
+#   python bme_cli.py index            (or: python bme_navigator.py index)
+#   python bme_cli.py search "error 42" --limit 20
+#   python bme_cli.py stats --json
+# Imports no tkinter. Results go to stdout; engine logging goes to stderr.
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import configparser
+import multiprocessing
+from contextlib import redirect_stdout
+with redirect_stdout(sys.stderr): # Keep import-time warnings out of script output
+    from bme_indexer import (DATABASE_FILE, CONFIG_FILE, DEFAULT_EXTRACT_WORKERS,
+                             DEFAULT_CHECKPOINT_FILES, DEFAULT_CHECKPOINT_SECONDS, FTS_BATCH_ROWS, FTS_MERGE_PAGES,
+                             EXTRACT_FILE_TIMEOUT, EXTRACT_PAGE_TIMEOUT, THUMBNAILS_FIRST_PAGE, THUMBNAILS_ALL_PAGES, THUMBNAIL_CACHE_MB,
+                             init_db, get_scan_paths, get_folder_manufacturers, search_documents, scan_and_index, optimize_fts, count_fts_segments,
+                             rebuild_fts, get_text_cache_path, format_cache_hits, generate_thumbnails, get_thumbnail_cache_path,
+                             format_worker_stats, format_stage_stats, set_page_compression, get_page_compression, PAGE_TEXT_COMPRESSION,
+                             set_code_index, has_page_code_index, TRIGRAM_ENABLED)
+
+# --- Exit Codes ---
+EXIT_OK = 0
+EXIT_NO_MATCHES = 1 # search: nothing found (like grep)
+EXIT_USAGE = 2 # Bad arguments (argparse uses 2 as well) or no scan paths configured
+EXIT_PARTIAL = 3 # index: finished, but some files could not be extracted
+EXIT_ERROR = 4 # Database or unexpected error
+
+
+def read_scan_settings(config_file):
+    """Reads the [Scan] settings shared with the GUI; missing/invalid values use the defaults."""
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    settings = {}
+    for option, default in [('extract_workers', DEFAULT_EXTRACT_WORKERS), ('checkpoint_files', DEFAULT_CHECKPOINT_FILES),
+                            ('checkpoint_seconds', DEFAULT_CHECKPOINT_SECONDS), ('skip_unchanged_dirs', 0),
+                            ('fts_batch_rows', FTS_BATCH_ROWS), ('bulk_build', 1), ('fts_merge_pages', FTS_MERGE_PAGES),
+                            ('extract_file_timeout', EXTRACT_FILE_TIMEOUT), ('extract_page_timeout', EXTRACT_PAGE_TIMEOUT),
+                            ('text_cache', 1), ('thumbnails', 0), ('thumbnail_cache_mb', THUMBNAIL_CACHE_MB)]:
+        try:
+            settings[option] = config.getint('Scan', option, fallback=default)
+        except ValueError:
+            print(f"Invalid '{option}' in {config_file}, using default.", file=sys.stderr)
+            settings[option] = default
+    return settings
+
+
+def database_missing(db_path):
+    """Reports a missing index database; every command but 'index' must not create an empty one by connecting."""
+    if os.path.exists(db_path):
+        return False
+    print(f"No index database at {os.path.abspath(db_path)}; create it with: index --add-path DIR", file=sys.stderr)
+    return True
+
+
+def cmd_index(args, out):
+    """Scans all configured paths (after adding any --add-path) and updates the index."""
+    init_db(args.db)
+    if args.add_path:
+        conn = sqlite3.connect(args.db)
+        conn.executemany("INSERT OR IGNORE INTO scan_paths (path) VALUES (?)",
+                         [(os.path.abspath(path),) for path in args.add_path])
+        conn.commit(); conn.close()
+    scan_paths = get_scan_paths(args.db)
+    if not scan_paths:
+        print("No scan paths configured. Add one with: index --add-path DIR", file=sys.stderr)
+        return EXIT_USAGE
+
+    settings = read_scan_settings(args.config)
+    workers = args.workers if args.workers is not None else settings['extract_workers']
+    stats = scan_and_index(scan_paths, folder_manufacturers=get_folder_manufacturers(args.db), workers=workers, db_path=args.db,
+                           checkpoint_files=settings['checkpoint_files'],
+                           checkpoint_seconds=settings['checkpoint_seconds'],
+                           use_dir_cache=bool(settings['skip_unchanged_dirs']) and not args.full,
+                           fts_batch_rows=settings['fts_batch_rows'],
+                           bulk_build=True if args.bulk else (None if settings['bulk_build'] else False),
+                           fts_merge_pages=settings['fts_merge_pages'],
+                           extract_file_timeout=settings['extract_file_timeout'],
+                           extract_page_timeout=settings['extract_page_timeout'],
+                           text_cache=bool(settings['text_cache']),
+                           thumbnails=settings['thumbnails'], thumbnail_cache_mb=settings['thumbnail_cache_mb'])
+    duration = stats['duration'] or 1e-9
+    changed = stats['added'] + stats['updated']
+    if args.json:
+        stats['workers'] = {str(pid): worker for pid, worker in stats['workers'].items()}
+        json.dump(stats, out, indent=2); out.write("\n")
+    else:
+        print(f"Indexed {len(scan_paths)} scan path(s) in {stats['duration']:.1f}s"
+              f"{' (resumed interrupted scan)' if stats['resumed'] else ''}"
+              f"{' (bulk build)' if stats['bulk_build'] else ''}", file=out)
+        print(f"  added {stats['added']}, updated {stats['updated']}, touched {stats['touched']}, "
+              f"removed {stats['removed']}, re-indexed {stats['reindexed']}, errors {stats['errors']}", file=out)
+        if stats['duplicates']: print(f"  identical copies sharing indexed text: {stats['duplicates']}", file=out)
+        if stats['quarantined'] or stats['quarantine_skipped']:
+            print(f"  quarantined {stats['quarantined']}, skipped as quarantined {stats['quarantine_skipped']}", file=out)
+        print(f"  folders listed {stats['dirs_listed']}, unchanged folders skipped {stats['dirs_skipped']}", file=out)
+        if stats['text_cache_lookups']: print(f"  text cache: {format_cache_hits(stats)}", file=out)
+        if stats['thumbnails']:
+            print(f"  thumbnails: {stats['thumbnails']['rendered']} rendered after the scan, {stats['thumbnails']['evicted']} evicted", file=out)
+        print(f"  throughput: {changed / duration:.1f} docs/s, {stats['pages'] / duration:.1f} pages/s written", file=out)
+        if stats['fts_segments'] is not None:
+            print(f"  index segments: {stats['fts_segments']} (maintenance {stats['fts_maintenance_seconds']:.1f}s)", file=out)
+        for line in format_stage_stats(stats['stages']): print(f"  stage {line}", file=out)
+        for line in format_worker_stats(stats['workers']): print(f"  {line}", file=out)
+    return EXIT_PARTIAL if stats['errors'] else EXIT_OK
+
+
+def cmd_search(args, out):
+    """Runs the GUI's metadata + full-text search and prints ranked matches."""
+    if database_missing(args.db): return EXIT_ERROR
+    start_time = time.time()
+    results = search_documents(args.query, db_path=args.db, raise_errors=True)
+    elapsed_ms = (time.time() - start_time) * 1000
+    if args.limit: results = results[:args.limit]
+    if args.json:
+        keys = ('id', 'filename', 'filepath', 'manufacturer', 'device_model', 'document_type', 'locations')
+        json.dump([dict(zip(keys, row)) for row in results], out, indent=2); out.write("\n")
+    else:
+        for doc_id, filename, filepath, manufacturer, device_model, document_type, locations in results:
+            print("\t".join(str(value or '') for value in (doc_id, filename, manufacturer, device_model, document_type, filepath, locations)), file=out)
+    print(f"{len(results)} result(s) in {elapsed_ms:.0f} ms", file=sys.stderr)
+    return EXIT_OK if results else EXIT_NO_MATCHES
+
+
+def cmd_stats(args, out):
+    """Prints index size and the state of the last scan."""
+    if database_missing(args.db): return EXIT_ERROR
+    init_db(args.db)
+    conn = sqlite3.connect(args.db)
+    cursor = conn.cursor()
+    try:
+        stats = {
+            'database': os.path.abspath(args.db),
+            'database_bytes': os.path.getsize(args.db),
+            'scan_paths': get_scan_paths(args.db),
+            'documents': cursor.execute("SELECT COUNT(*) FROM documents").fetchone()[0],
+            'documents_with_text': cursor.execute("SELECT COUNT(*) FROM documents WHERE text_doc_id IS NOT NULL").fetchone()[0],
+            'shared_text_copies': cursor.execute("SELECT COUNT(*) FROM documents WHERE text_doc_id != id").fetchone()[0],
+            'fts_pages': cursor.execute("SELECT COUNT(*) FROM pages").fetchone()[0],
+            'compressed_pages': cursor.execute("SELECT COUNT(*) FROM pages WHERE typeof(text) = 'blob'").fetchone()[0],
+            'page_compression': get_page_compression(cursor),
+            'metadata_code_index': cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_code_fts'").fetchone() is not None,
+            'page_code_index': has_page_code_index(cursor),
+            'fts_segments': count_fts_segments(cursor),
+            'text_cache_bytes': os.path.getsize(get_text_cache_path(args.db)) if os.path.exists(get_text_cache_path(args.db)) else 0,
+            'thumbnail_cache_bytes': os.path.getsize(get_thumbnail_cache_path(args.db)) if os.path.exists(get_thumbnail_cache_path(args.db)) else 0,
+            'cached_folders': cursor.execute("SELECT COUNT(*) FROM dir_cache").fetchone()[0],
+            'quarantine': [dict(zip(('filepath', 'reason', 'duration', 'quarantined'), row)) for row in
+                           cursor.execute("SELECT filepath, reason, duration, quarantined FROM quarantine ORDER BY filepath")],
+        }
+        last_scan = cursor.execute("SELECT started, finished, status, files_committed FROM scan_journal ORDER BY scan_id DESC LIMIT 1").fetchone()
+        stats['last_scan'] = dict(zip(('started', 'finished', 'status', 'files_committed'), last_scan)) if last_scan else None
+    finally:
+        conn.close()
+    if args.json:
+        json.dump(stats, out, indent=2); out.write("\n")
+        return EXIT_OK
+    print(f"Database:       {stats['database']} ({stats['database_bytes'] / 1024 / 1024:.1f} MB)", file=out)
+    print(f"Scan paths:     {len(stats['scan_paths'])}", file=out)
+    for path in stats['scan_paths']: print(f"  {path}", file=out)
+    print(f"Documents:      {stats['documents']} ({stats['documents_with_text']} with indexed text, {stats['fts_pages']} pages; "
+          f"{stats['shared_text_copies']} identical copies share it)", file=out)
+    storage = f"zlib level {stats['page_compression']}" if stats['page_compression'] else "uncompressed"
+    print(f"Page text:      {storage}, {stats['compressed_pages']} of {stats['fts_pages']} pages compressed", file=out)
+    code_indexes = [name for name, built in [('metadata', stats['metadata_code_index']), ('page text', stats['page_code_index'])] if built]
+    print(f"Part numbers:   {' and '.join(code_indexes) + ' substring index' if code_indexes else 'no substring index (LIKE scans)'}", file=out)
+    print(f"Index segments: {stats['fts_segments']} ('optimize' merges them into one)", file=out)
+    print(f"Cached folders: {stats['cached_folders']}", file=out)
+    print(f"Text cache:     {stats['text_cache_bytes'] / 1024 / 1024:.1f} MB", file=out)
+    print(f"Thumbnails:     {stats['thumbnail_cache_bytes'] / 1024 / 1024:.1f} MB", file=out)
+    print(f"Quarantined:    {len(stats['quarantine'])} (indexed without text until changed)", file=out)
+    for entry in stats['quarantine']: print(f"  {entry['filepath']}: {entry['reason']}", file=out)
+    if last_scan:
+        started, finished, status, files_committed = last_scan
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(finished or started))
+        print(f"Last scan:      {status} {when}, {files_committed} changed files committed", file=out)
+    else:
+        print("Last scan:      never", file=out)
+    return EXIT_OK
+
+
+def cmd_optimize(args, out):
+    """Full FTS optimize (scans only merge incrementally); suitable for a weekly cron job."""
+    if database_missing(args.db): return EXIT_ERROR
+    init_db(args.db)
+    result = optimize_fts(args.db)
+    if args.json:
+        json.dump(result, out, indent=2); out.write("\n")
+    else:
+        print(f"Optimized in {result['duration']:.1f}s: {result['segments_before']} -> {result['segments_after']} index segments", file=out)
+    return EXIT_OK
+
+
+def cmd_rebuild_fts(args, out):
+    """Rebuilds the full-text index from the text cache, extracting only uncached files."""
+    if database_missing(args.db): return EXIT_ERROR
+    init_db(args.db)
+    stats = rebuild_fts(args.db)
+    if args.json:
+        json.dump(stats, out, indent=2); out.write("\n")
+    else:
+        print(f"Rebuilt the full-text index in {stats['duration']:.1f}s: {stats['documents']} documents, {stats['pages']} pages", file=out)
+        print(f"  from text cache {stats['cache_hits']}, extracted {stats['extracted']}, identical copies {stats['duplicates']}, "
+              f"errors {stats['errors']}", file=out)
+    return EXIT_PARTIAL if stats['errors'] else EXIT_OK
+
+
+def cmd_thumbnails(args, out):
+    """Renders missing PDF thumbnails into the thumbnail cache and trims it to its size limit."""
+    if database_missing(args.db): return EXIT_ERROR
+    init_db(args.db)
+    settings = read_scan_settings(args.config)
+    stats = generate_thumbnails(args.db, THUMBNAILS_ALL_PAGES if args.all_pages else THUMBNAILS_FIRST_PAGE,
+                                args.max_mb if args.max_mb is not None else settings['thumbnail_cache_mb'],
+                                workers=settings['extract_workers'], file_timeout=settings['extract_file_timeout'],
+                                page_timeout=settings['extract_page_timeout'])
+    if args.json:
+        json.dump(stats, out, indent=2); out.write("\n")
+    else:
+        print(f"Thumbnails updated in {stats['duration']:.1f}s: {stats['rendered']} rendered, {stats['errors']} errors", file=out)
+        print(f"  evicted {stats['evicted']}, unused removed {stats['pruned']}, cache {stats['bytes'] / 1024 / 1024:.1f} MB", file=out)
+    return EXIT_PARTIAL if stats['errors'] else EXIT_OK
+
+
+def cmd_compress(args, out):
+    """Turns page text compression on or off and converts the pages already stored."""
+    if database_missing(args.db): return EXIT_ERROR
+    init_db(args.db)
+    stats = set_page_compression(args.db, 0 if args.off else args.level)
+    if args.json:
+        json.dump(stats, out, indent=2); out.write("\n")
+    else:
+        action = "decompressed" if args.off else f"compressed (zlib level {args.level})"
+        print(f"Page text {action} in {stats['duration']:.1f}s: "
+              f"{stats['converted']} of {stats['pages']} pages converted", file=out)
+        print(f"  database {stats['bytes_before'] / 1024 / 1024:.1f} MB -> {stats['bytes_after'] / 1024 / 1024:.1f} MB", file=out)
+    return EXIT_OK
+
+
+def cmd_code_index(args, out):
+    """Builds or drops the trigram index that finds part numbers inside words of the page text."""
+    if database_missing(args.db): return EXIT_ERROR
+    if not args.off and not TRIGRAM_ENABLED:
+        print("SQLite 3.34 or later is needed for the part number index.", file=sys.stderr)
+        return EXIT_ERROR
+    init_db(args.db)
+    stats = set_code_index(args.db, not args.off)
+    if args.json:
+        json.dump(stats, out, indent=2); out.write("\n")
+    else:
+        action = "dropped" if args.off else f"built over {stats['pages']} pages"
+        print(f"Part number index {action} in {stats['duration']:.1f}s", file=out)
+        print(f"  database {stats['bytes_before'] / 1024 / 1024:.1f} MB -> {stats['bytes_after'] / 1024 / 1024:.1f} MB", file=out)
+    return EXIT_OK
+
+
+def build_parser():
+    """Builds the argparse parser for the index/search/stats commands."""
+    parser = argparse.ArgumentParser(description="BME Document Navigator - headless indexer and search.")
+    parser.add_argument('--db', default=DATABASE_FILE, help=f"SQLite database (default: {DATABASE_FILE})")
+    parser.add_argument('--config', default=CONFIG_FILE, help=f"Settings file for [Scan] options (default: {CONFIG_FILE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subparsers.add_parser('index', help="Scan the configured paths and update the index")
+    index_parser.add_argument('--add-path', action='append', default=[], metavar='DIR', help="Add a scan path first (repeatable)")
+    index_parser.add_argument('--workers', type=int, help="Extraction processes (0 = in-process); overrides the config")
+    index_parser.add_argument('--full', action='store_true', help="List every folder even if skip_unchanged_dirs is on")
+    index_parser.add_argument('--bulk', action='store_true', help="Bulk build even if the index is not empty (deferred indexes, relaxed durability)")
+    index_parser.add_argument('--json', action='store_true', help="Print the scan statistics as JSON")
+    index_parser.set_defaults(handler=cmd_index)
+
+    search_parser = subparsers.add_parser('search', help="Search metadata and document text")
+    search_parser.add_argument('query', help="Search terms (FTS5 query syntax)")
+    search_parser.add_argument('--limit', type=int, default=0, help="Maximum number of results (0 = all)")
+    search_parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    search_parser.set_defaults(handler=cmd_search)
+
+    stats_parser = subparsers.add_parser('stats', help="Show index statistics")
+    stats_parser.add_argument('--json', action='store_true', help="Print statistics as JSON")
+    stats_parser.set_defaults(handler=cmd_stats)
+
+    optimize_parser = subparsers.add_parser('optimize', help="Merge the full-text index into one segment (slow on large indexes)")
+    optimize_parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    optimize_parser.set_defaults(handler=cmd_optimize)
+
+    rebuild_parser = subparsers.add_parser('rebuild-fts', help="Rebuild the full-text index, reading text from the text cache")
+    rebuild_parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    rebuild_parser.set_defaults(handler=cmd_rebuild_fts)
+
+    thumbnails_parser = subparsers.add_parser('thumbnails', help="Render missing PDF thumbnails and trim the thumbnail cache")
+    thumbnails_parser.add_argument('--all-pages', action='store_true', help="Render every page, not just the first")
+    thumbnails_parser.add_argument('--max-mb', type=int, help="Cache size limit in MB; overrides the config")
+    thumbnails_parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    thumbnails_parser.set_defaults(handler=cmd_thumbnails)
+
+    compress_parser = subparsers.add_parser('compress', help="Store page text zlib-compressed (or uncompressed with --off) and shrink the database")
+    compress_parser.add_argument('--level', type=int, default=PAGE_TEXT_COMPRESSION, choices=range(1, 10), metavar='1-9',
+                                 help=f"zlib level (default: {PAGE_TEXT_COMPRESSION})")
+    compress_parser.add_argument('--off', action='store_true', help="Turn compression off and decompress all pages")
+    compress_parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    compress_parser.set_defaults(handler=cmd_compress)
+
+    code_index_parser = subparsers.add_parser('code-index', help="Index page text for part number substrings, e.g. '0227' in 'PN-A0227-03' (or drop it with --off)")
+    code_index_parser.add_argument('--off', action='store_true', help="Drop the index and shrink the database")
+    code_index_parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    code_index_parser.set_defaults(handler=cmd_code_index)
+    return parser
+
+
+def main(argv=None):
+    """CLI entry point. Returns the process exit code."""
+    multiprocessing.freeze_support()
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+    try:
+        with redirect_stdout(sys.stderr): # Engine progress prints are logging, not output
+            return args.handler(args, out)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    except KeyboardInterrupt:
+        print("Interrupted; the next 'index' resumes from the last checkpoint.", file=sys.stderr)
+        return EXIT_ERROR
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3500 @@
+# BME Document Navigator - Indexing Engine
+# Schema, scanning, text extraction and FTS writing, shared by the GUI
+# (bme_navigator.py) and the headless CLI (bme_cli.py).
+# Keep this module free of tkinter: its extraction functions are pickled by
+# reference into worker processes, and it must stay importable without a display.
+import os
+import sys
+import re
+import time
+import sqlite3
+import hashlib
+import zlib
+import json
+import io
+import csv
+import codecs
+import posixpath
+import html.parser
+import gzip
+import tarfile
+import types
+import zipfile
+import multiprocessing
+import multiprocessing.connection
+import threading
+import queue
+import concurrent.futures
+import select
+import struct
+import itertools
+import ctypes
+import ctypes.util
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from collections import deque
+try:
+    import fitz  # PyMuPDF
+    FITZ_ENABLED = True
+except ImportError:
+    print("WARNING: PyMuPDF not found. PDF indexing will be disabled.")
+    FITZ_ENABLED = False
+try:
+    import fcntl # Cross-process scan lock (POSIX)
+except ImportError:
+    fcntl = None
+    import msvcrt # ...and on Windows
+# FTS5 trigram tokenizer (SQLite 3.34+): substring search for part numbers and codes
+TRIGRAM_ENABLED = sqlite3.sqlite_version_info >= (3, 34, 0)
+if not TRIGRAM_ENABLED:
+    print(f"WARNING: SQLite {sqlite3.sqlite_version} has no trigram tokenizer. Part number search will scan metadata with LIKE.")
+
+# --- Configuration ---
+DATABASE_FILE = 'bme_doc_index.db'
+CONFIG_FILE = 'bme_navigator.ini' # GUI state and the [Scan]/[Watch] settings
+
+# --- Constants ---
+SUPPORTED_EXTENSIONS = (
+    # Documents
+    '.pdf', '.docx', '.doc', '.txt', '.rtf',
+    '.html', '.htm',
+    # Spreadsheets
+    '.xlsx', '.xls', '.csv',
+    # Presentations
+    '.pptx', '.ppt',
+    # Images (Common raster formats)
+    '.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff',
+    # Compressed Formats
+    '.zip', '.7z', '.rar', '.gz', '.tar',
+    '.exe',
+)
+TEXT_ENCODINGS = ['utf-8', 'cp1252', 'latin-1']
+TEXT_PAGE_CHARS = 64 * 1024 # TXT files are indexed in pseudo-pages of about this many characters
+TXT_STREAM_BYTES = 8 * 1024 * 1024 # Larger TXT files skip the pool and text cache: the writer reads them page batch by page batch
+TEXT_SNIFF_BYTES = 64 * 1024 # Bytes sampled to pick a text file's encoding
+CSV_SNIFF_CHARS = 4096 # Characters of a CSV file sampled to guess its delimiter and quoting
+# HTML extraction: elements whose content is not text, section headings, and elements that end a line
+HTML_SKIP_TAGS = {'script', 'style', 'template', 'svg', 'math'}
+HTML_SECTION_TAGS = {'h1', 'h2', 'h3'}
+HTML_BLOCK_TAGS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'tr', 'table', 'h4', 'h5', 'h6', 'pre',
+                   'blockquote', 'section', 'article', 'header', 'footer', 'nav', 'aside', 'main', 'title', 'hr', 'form'}
+HTML_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([A-Za-z0-9_-]+)', re.I)
+
+# --- Archive Settings ---
+# Members of these archives are indexed as virtual documents, 'pack.zip!docs/manual.pdf'
+# (.7z/.rar need third-party readers and are only indexed by name)
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.gz')
+ARCHIVE_MEMBER_SEPARATOR = '!'
+ARCHIVE_PATH_PATTERN = re.compile(r'^(.*?\.(?:zip|tar|gz))!(.+)$', re.IGNORECASE)
+MAX_ARCHIVE_MEMBER_BYTES = 256 * 1024 * 1024 # Larger members are skipped (also guards against zip bombs)
+
+# --- Change Detection ---
+HASH_BLOCK_SIZE = 1024 * 1024 # Bytes read per block while hashing a file
+HASH_THREADS = 4 # Files the scan's stat stage hashes at once (file reads and hashlib release the GIL)
+CONTENT_HASH_VERSION = 'blake2b-full' # index_settings 'content_hash'; see apply_content_hash_upgrade
+# Extraction changes that need already-indexed files re-read: (version, extensions).
+# init_db marks matching documents as changed once (PRAGMA user_version records the
+# last version applied), so the next scan extracts them even though they are unchanged.
+EXTRACTION_UPGRADES = [
+    (1, ('.zip', '.tar', '.gz', '.pptx', '.xlsx', '.csv', '.rtf')), # Archive members; slides, sheets, CSV, RTF
+    (2, ('.docx', '.zip', '.tar', '.gz')), # DOCX split at page breaks and headings, with outline
+    (3, ('.txt', '.zip', '.tar', '.gz')), # TXT in pseudo-pages of TEXT_PAGE_CHARS
+    (4, ('.html', '.htm', '.zip', '.tar', '.gz')), # HTML through html.parser, split at <h1>-<h3>
+]
+# document_properties columns filled from result['properties'] (PDF document info)
+DOCUMENT_PROPERTY_FIELDS = ('page_count', 'title', 'author', 'producer', 'created')
+
+# --- Parallel Extraction Settings ---
+DEFAULT_EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Leave one core for the writer/GUI
+MAX_PENDING_PER_WORKER = 4 # Files queued for extraction per worker
+EXTRACT_FILE_TIMEOUT = 300 # Seconds one file may take before its worker is killed and the file quarantined
+EXTRACT_PAGE_TIMEOUT = 60 # Seconds one page may take (no page finished) before the same happens
+EXTRACT_CRASH_ATTEMPTS = 2 # Workers a file may crash (each a fresh one) before it is quarantined
+EXTRACT_START_FAILURES = 3 # Workers in a row that die before they are ready fail the scan
+FTS_BATCH_ROWS = 500 # Extracted pages buffered per executemany() into pages (and so documents_fts)
+SNIPPET_BATCH_SIZE = 500 # Result pages per snippet query (stays under SQLite's bound-parameter limit)
+
+# --- FTS Maintenance Settings ---
+FTS_MERGE_PAGES = 2000 # Leaf pages of incremental segment merging after each scan (0 = none)
+FTS_MERGE_STEP = 200 # ...done in 'merge' steps of this many pages
+
+# --- Page Text Storage Settings ---
+# Page text in the pages table can be stored zlib-compressed (off by default; see
+# set_page_compression). documents_fts reads it through the page_text() SQL function,
+# so connections that search or write text are opened with connect_index().
+PAGE_TEXT_COMPRESSION = 6 # zlib level used when compression is turned on
+PAGE_CONVERT_BATCH = 1000 # Pages converted per batch by set_page_compression
+
+# --- Code Search Settings ---
+# The word index (unicode61) finds 'A0227' in 'PN-A0227-03' but not '0227' or 'A0227-0'.
+# Queries that look like part numbers or codes are routed to trigram indexes, which
+# match any substring of 3+ characters: documents_code_fts over the metadata columns
+# (built whenever the tokenizer is available) and, optionally, pages_code_fts over the
+# page text (it about doubles the database; see set_code_index).
+CODE_QUERY_PATTERN = re.compile(r'[\w.\-/#]+') # One token, no FTS query syntax
+CODE_QUERY_MIN_LENGTH = 3 # Trigram indexes cannot match shorter strings
+CODE_SNIPPET_TOKENS = 64 # Trigram snippets count characters, not words
+
+# --- Text Cache Settings ---
+# Extracted page text, zlib-compressed and keyed by content hash, in a separate
+# SQLite file next to the index (bme_doc_index.db -> bme_doc_index_text.db)
+TEXT_CACHE_SUFFIX = '_text.db'
+TEXT_CACHE_COMPRESSION = 6 # zlib level
+TEXT_CACHE_COMMIT_FILES = 100 # Cached files per commit while scanning
+
+# --- Thumbnail Cache Settings ---
+# Small PNG renders of PDF pages, keyed by content hash, in another SQLite file
+# next to the index (bme_doc_index.db -> bme_doc_index_thumbs.db). Once it holds more
+# than its size limit, the least recently viewed thumbnails are dropped first.
+THUMBNAIL_CACHE_SUFFIX = '_thumbs.db'
+THUMBNAILS_OFF, THUMBNAILS_FIRST_PAGE, THUMBNAILS_ALL_PAGES = 0, 1, 2 # [Scan] thumbnails setting
+THUMBNAIL_WIDTH = 160 # Pixels; pages are rendered at the zoom that gives this width
+THUMBNAIL_CACHE_MB = 256 # Size limit of the thumbnail images
+
+# --- Watch Mode Settings ---
+WATCH_DEBOUNCE_SECONDS = 3 # A path must be quiet this long before it is reindexed (copies in progress)
+WATCH_POLL_INTERVAL = 10 # Seconds between directory snapshots when inotify is not available
+WATCH_RETRY_SECONDS = 5 # First wait before a path that could not be indexed is tried again (doubled each time)
+WATCH_RETRY_ATTEMPTS = 6 # ...and the attempts before it is left to the next scan
+
+# --- Bulk Build Settings ---
+# Secondary indexes (name, table, column). Those on documents, and the trigram index
+# documents_code_fts, are dropped during a bulk build and created once at the end (see scan_and_index).
+SECONDARY_INDEXES = [
+    ('idx_doc_filepath', 'documents', 'filepath'),
+    ('idx_doc_filename', 'documents', 'filename'),
+    ('idx_doc_manufacturer', 'documents', 'manufacturer'),
+    ('idx_doc_model', 'documents', 'device_model'),
+    ('idx_doc_type', 'documents', 'document_type'),
+    ('idx_doc_revision', 'documents', 'revision_number'),
+    ('idx_doc_status', 'documents', 'status'),
+    ('idx_link_source', 'links', 'source_doc_id'),
+    ('idx_link_target', 'links', 'target_doc_id'),
+    ('idx_note_doc', 'notes', 'doc_id'),
+    ('idx_fav_name', 'favorites', 'name'),
+    ('idx_fav_doc', 'favorites', 'doc_id'),
+]
+# Relaxed while bulk building. The rollback journal is kept (TRUNCATE, not OFF/MEMORY)
+# so a killed scan still leaves a consistent, resumable database; only an OS crash or
+# power loss during the build can lose committed checkpoints.
+BULK_BUILD_PRAGMAS = [('synchronous', 'OFF'), ('journal_mode', 'TRUNCATE'),
+                      ('cache_size', '-65536'), ('temp_store', 'MEMORY')] # cache_size: 64 MB
+
+# --- Checkpoint Settings ---
+DEFAULT_CHECKPOINT_FILES = 500 # Commit after this many changed files...
+DEFAULT_CHECKPOINT_SECONDS = 60 # ...or after this many seconds, whichever comes first
+
+
+def is_supported_file(filename):
+    """True if the filename has a supported extension and is not an Office lock file."""
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS) and not filename.startswith('~$')
+
+
+def extract_metadata_from_path(filepath):
+    """ BASIC heuristic metadata extraction from the path/filename. """
+    metadata = {'manufacturer': None, 'device_model': None, 'document_type': None}
+    path_lower = filepath.lower()
+    filename_lower = os.path.basename(path_lower)
+    known_manufacturers = ['siemens', 'ge', 'philips', 'draeger', 'medtronic'] # Fallback list
+    known_doc_types = ['manual', 'sop', 'datasheet', 'service', 'user', 'quick guide', 'pm', 'calibration', 'protocol']
+    for manuf in known_manufacturers:
+        if manuf in path_lower:
+            metadata['manufacturer'] = manuf.title()
+            break
+    for dtype in known_doc_types:
+        if re.search(r'\b' + re.escape(dtype) + r'\b', path_lower):
+            metadata['document_type'] = dtype.title()
+            match_model = re.search(r'([a-zA-Z0-9]+(?:[-_][a-zA-Z0-9]+)*)_{0}|{0}_([a-zA-Z0-9]+(?:[-_][a-zA-Z0-9]+)*)'.format(dtype), filename_lower)
+            if match_model:
+                 potential_model = match_model.group(1) or match_model.group(2)
+                 if potential_model and len(potential_model) > 2: metadata['device_model'] = potential_model.upper()
+            break
+    if not metadata['device_model']:
+         match_generic_model = re.search(r'\b([a-zA-Z]{2,6}[-_][a-zA-Z0-9]{2,8})\b', filename_lower)
+         if match_generic_model: metadata['device_model'] = match_generic_model.group(1).upper()
+    return metadata
+
+
+def compute_content_hash(filepath):
+    """
+    Content fingerprint: BLAKE2b of the whole file. Tells a touched/copied file (same
+    content, new mtime) from a real edit, keys the text and thumbnail caches and decides
+    which copies share indexed text, so it must cover every byte. Only files that are
+    new or whose mtime changed are hashed.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def compute_data_hash(data):
+    """compute_content_hash() of in-memory bytes (archive members): same value as for the same file on disk."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# --- Archives ---
+def is_archive(filepath):
+    """True for archives whose members are indexed (zip, tar and gzip)."""
+    return filepath.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def split_archive_path(path):
+    """'/a/pack.zip!docs/m.pdf' -> ('/a/pack.zip', 'docs/m.pdf'); a real file path -> (path, None)."""
+    match = ARCHIVE_PATH_PATTERN.match(path)
+    return (match.group(1), match.group(2)) if match else (path, None)
+
+def document_dir(path):
+    """Folder a document lives in on disk (for archive members: the archive's folder)."""
+    return os.path.dirname(split_archive_path(path)[0])
+
+def archive_member_bounds(archive_path):
+    """(low, high) such that low <= filepath < high selects the members of an archive."""
+    return archive_path + ARCHIVE_MEMBER_SEPARATOR, archive_path + chr(ord(ARCHIVE_MEMBER_SEPARATOR) + 1)
+
+def can_extract(path):
+    """True if text can be extracted from the file (or the archive's members)."""
+    archive_path, member = split_archive_path(path)
+    if member: return get_extractor(os.path.splitext(member)[1].lower()) is not None
+    return is_archive(path) or get_extractor(os.path.splitext(path)[1].lower()) is not None
+
+def iter_archive_members(archive_path):
+    """
+    Streams the extractable members of a zip/tar(.gz)/gz archive without unpacking
+    to disk. Yields (member_name, size, mtime, data); oversized members are skipped.
+    """
+    def wanted(name, size):
+        if get_extractor(os.path.splitext(name)[1].lower()) is None: return False
+        if size > MAX_ARCHIVE_MEMBER_BYTES:
+            print(f"Skipping oversized archive member {archive_path}!{name} ({size} bytes)")
+            return False
+        return True
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not wanted(info.filename, info.file_size): continue
+                with archive.open(info) as member:
+                    yield info.filename, info.file_size, time.mktime(info.date_time + (0, 0, -1)), member.read(MAX_ARCHIVE_MEMBER_BYTES)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path, 'r|*') as archive: # Stream mode: one sequential pass
+            for info in archive:
+                if not info.isfile() or not wanted(info.name, info.size): continue
+                yield info.name, info.size, float(info.mtime), archive.extractfile(info).read()
+    elif archive_path.lower().endswith('.gz'): # Single gzip-compressed file, e.g. manual.pdf.gz
+        name = os.path.basename(archive_path)[:-3]
+        if get_extractor(os.path.splitext(name)[1].lower()) is None: return
+        with gzip.open(archive_path) as member:
+            data = member.read(MAX_ARCHIVE_MEMBER_BYTES + 1)
+        if wanted(name, len(data)):
+            yield name, len(data), os.path.getmtime(archive_path), data
+
+def read_archive_member(archive_path, member_name):
+    """Returns the bytes of one archive member. Raises KeyError if it is not in the archive."""
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive: return archive.read(member_name)
+    if tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path, 'r:*') as archive:
+            member = archive.extractfile(member_name)
+            if member is None: raise KeyError(member_name)
+            return member.read()
+    with gzip.open(archive_path) as member: return member.read()
+
+
+# --- Text Extractors ---
+# Each extractor takes a filepath (or the bytes of an archive member), an optional
+# progress(page_num) callback and an optional outline list, which extractors that know
+# the document's headings fill with (level, title, page_number). They return a list of
+# (page_number, text) tuples and run inside pool worker processes, so they must be
+# module-level functions.
+def extract_pdf_pages(source, progress=None, outline=None, properties=None):
+    """
+    Extracts text page by page from a PDF (path or bytes); progress(page_num) is called after each page.
+    Bookmarks go to outline as (level, title, page_number), page_number -1 if a bookmark
+    has no target page; page count and document info go to properties.
+    """
+    pages = []
+    with (fitz.open(stream=source, filetype='pdf') if isinstance(source, bytes) else fitz.open(source)) as doc:
+        if outline is not None:
+            outline.extend((level, title, page - 1) for level, title, page, *_ in doc.get_toc(simple=False))
+        if properties is not None:
+            info = doc.metadata or {}
+            properties.update({'page_count': len(doc), 'title': info.get('title') or None, 'author': info.get('author') or None,
+                               'producer': info.get('producer') or None, 'created': parse_pdf_date(info.get('creationDate'))})
+        for page_num, page in enumerate(doc):
+            page_text = page.get_text("text", sort=True)
+            if page_text and page_text.strip():
+                pages.append((page_num, page_text))
+            if progress: progress(page_num)
+    return pages
+
+def parse_pdf_date(value):
+    """Formats a PDF date string ("D:20230115103000+01'00'") as 'YYYY-MM-DD HH:MM:SS'. Unparseable values are returned as is."""
+    match = re.match(r"(?:D:)?(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?", value or '')
+    if not match: return value or None
+    year, month, day, hour, minute, second = (part or default for part, default in zip(match.groups(), ('', '01', '01', '00', '00', '00')))
+    return f"{year}-{month}-{day} {hour}:{minute}:{second}"
+
+def extract_docx_pages(source, progress=None, outline=None, properties=None):
+    """
+    Streams the body of a DOCX (path or bytes) from word/document.xml. A new page starts
+    at every explicit or rendered page break, section break and heading, so for DOCX
+    page_number is the index of that part rather than a printed page number. Headings
+    go to outline as (level, title, page_number).
+    """
+    pages, lines, runs = [], [], []
+    paragraph = {}
+
+    def new_page():
+        if runs: lines.append(''.join(runs))
+        runs.clear()
+        text = "\n".join(line for line in lines if line.strip())
+        lines.clear()
+        if text:
+            pages.append((len(pages), text))
+            if progress: progress(len(pages) - 1)
+
+    with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as package:
+        heading_levels = docx_heading_levels(package)
+        properties_depth = 0 # Inside w:pPr (> 1: the old properties of a tracked change)
+        with package.open('word/document.xml') as document:
+            for event, elem in ET.iterparse(document, events=('start', 'end')):
+                tag = ooxml_local_name(elem.tag)
+                if event == 'start':
+                    if tag == 'p':
+                        if runs: lines.append(''.join(runs)); runs.clear() # Paragraph nested in a text box
+                        paragraph = {'level': None, 'break_before': False, 'break_after': False}
+                    elif tag == 'pPr': properties_depth += 1
+                    continue
+                if properties_depth:
+                    if tag == 'pPr':
+                        properties_depth -= 1
+                        if properties_depth: continue
+                        if paragraph['level'] or paragraph['break_before']: new_page()
+                        paragraph['page'] = len(pages)
+                    elif properties_depth > 1: continue
+                    elif tag == 'pStyle': paragraph['level'] = heading_levels.get(ooxml_attr(elem, 'val'))
+                    elif tag == 'outlineLvl' and ooxml_attr(elem, 'val', '9').isdigit() and int(ooxml_attr(elem, 'val')) < 9:
+                        paragraph['level'] = int(ooxml_attr(elem, 'val')) + 1
+                    elif tag == 'pageBreakBefore': paragraph['break_before'] = ooxml_attr(elem, 'val', 'true') not in ('0', 'false')
+                    elif tag == 'type': paragraph['continuous_section'] = ooxml_attr(elem, 'val') == 'continuous'
+                    elif tag == 'sectPr': paragraph['break_after'] = not paragraph.get('continuous_section') # Section break
+                elif tag == 't':
+                    if elem.text: runs.append(elem.text)
+                elif tag == 'tab': runs.append("\t")
+                elif tag in ('br', 'cr'):
+                    if ooxml_attr(elem, 'type') == 'page': new_page()
+                    elif ooxml_attr(elem, 'type') != 'column': runs.append("\n")
+                elif tag == 'lastRenderedPageBreak': new_page()
+                elif tag == 'noBreakHyphen': runs.append('-')
+                elif tag == 'p':
+                    line = ''.join(runs)
+                    runs.clear()
+                    lines.append(line)
+                    if paragraph.get('level') and line.strip() and outline is not None:
+                        outline.append((paragraph['level'], line.strip(), paragraph.get('page', len(pages))))
+                    if paragraph.get('break_after'): new_page()
+                    paragraph = {}
+                    elem.clear()
+        new_page()
+    return pages
+
+def docx_heading_levels(package):
+    """{style id: heading level} from word/styles.xml: 'heading N'/'Title' styles, outline levels and styles based on them."""
+    levels, based_on = {}, {}
+    if 'word/styles.xml' not in package.NameToInfo: return levels
+    with package.open('word/styles.xml') as styles:
+        for event, elem in ET.iterparse(styles):
+            if ooxml_local_name(elem.tag) != 'style': continue
+            style_id = ooxml_attr(elem, 'styleId')
+            for child in elem:
+                tag, value = ooxml_local_name(child.tag), ooxml_attr(child, 'val', '')
+                if tag == 'name':
+                    if re.fullmatch(r'heading [1-9]', value.lower()): levels.setdefault(style_id, int(value[-1]))
+                    elif value.lower() == 'title': levels.setdefault(style_id, 1)
+                elif tag == 'basedOn': based_on[style_id] = value
+                elif tag == 'pPr':
+                    for grandchild in child:
+                        outline_level = ooxml_attr(grandchild, 'val', '9')
+                        if ooxml_local_name(grandchild.tag) == 'outlineLvl' and outline_level.isdigit() and int(outline_level) < 9:
+                            levels[style_id] = int(outline_level) + 1
+            elem.clear()
+    for style_id in based_on:
+        parent, seen = based_on[style_id], {style_id}
+        while style_id not in levels and parent and parent not in seen:
+            if parent in levels: levels[style_id] = levels[parent]
+            seen.add(parent)
+            parent = based_on.get(parent)
+    return levels
+
+def sniff_text_encoding(sample):
+    """
+    Picks the encoding of a text file from its first bytes: a BOM, UTF-16 without BOM
+    (NUL bytes), else the first of TEXT_ENCODINGS that decodes the sample.
+    """
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if sample.startswith(bom): return encoding
+    if sample and sample.count(0) > len(sample) // 4: # Mostly ASCII text stored as UTF-16
+        return 'utf-16-le' if sample[1::2].count(0) > sample[0::2].count(0) else 'utf-16-be'
+    for encoding in TEXT_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False) # A character cut off at the end is fine
+            return encoding
+        except UnicodeDecodeError: continue
+    return TEXT_ENCODINGS[-1]
+
+def iter_txt_pages(source, progress=None):
+    """
+    Yields the (page_number, text) pseudo-pages of a plain text file (path or bytes):
+    about TEXT_PAGE_CHARS characters each, ending at a line break, so a multi-hundred-MB
+    log is never held as one string or one FTS row. The encoding is sniffed from the
+    first bytes; bytes that do not decode later on are replaced.
+    """
+    with open_text_stream(source) as text_file:
+        for page_num in itertools.count():
+            chunk = text_file.read(TEXT_PAGE_CHARS)
+            if not chunk: break
+            chunk += text_file.readline(TEXT_PAGE_CHARS) # Finish the line (very long lines are cut)
+            if chunk.strip(): yield page_num, chunk
+            if progress: progress(page_num)
+
+def open_text_stream(source):
+    """
+    Opens a text file (path or bytes) as a text stream in its sniffed encoding, with
+    bytes that do not decode replaced and line endings left as they are (as csv wants).
+    """
+    raw = io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+    try:
+        encoding = sniff_text_encoding(raw.read(TEXT_SNIFF_BYTES))
+        raw.seek(0)
+    except Exception:
+        raw.close()
+        raise
+    return io.TextIOWrapper(raw, encoding=encoding, errors='replace', newline='')
+
+def extract_txt_pages(source, progress=None, outline=None, properties=None):
+    """All pages of a plain text file as a list (see iter_txt_pages; large files are streamed_text_result instead)."""
+    return list(iter_txt_pages(source, progress))
+
+def extract_html_pages(source, progress=None, outline=None, properties=None):
+    """
+    Streams the visible text of an HTML file (path or bytes) through html.parser:
+    entities are decoded, script/style/template content is dropped and block elements
+    end lines. A new page starts at every <h1>-<h3> (headings go to outline) and once a
+    page passes TEXT_PAGE_CHARS, so for HTML page_number is the section index.
+    """
+    pages, lines, parts = [], [], []
+    state = {'skip_depth': 0, 'heading': None, 'heading_parts': [], 'size': 0}
+
+    def end_line():
+        line = ' '.join(''.join(parts).split())
+        parts.clear()
+        if line:
+            lines.append(line)
+            state['size'] += len(line)
+
+    def new_page():
+        end_line()
+        if lines:
+            pages.append((len(pages), "\n".join(lines)))
+            if progress: progress(len(pages) - 1)
+        lines.clear()
+        state['size'] = 0
+
+    def start_tag(tag, attrs):
+        if tag in HTML_SKIP_TAGS: state['skip_depth'] += 1
+        elif tag in HTML_SECTION_TAGS and not state['skip_depth']:
+            new_page()
+            state['heading'], state['heading_parts'] = (int(tag[1]), len(pages)), []
+        elif tag in HTML_BLOCK_TAGS:
+            end_line()
+            if state['size'] >= TEXT_PAGE_CHARS: new_page()
+        elif tag in ('td', 'th'): parts.append(' ')
+
+    def end_tag(tag):
+        if tag in HTML_SKIP_TAGS: state['skip_depth'] = max(0, state['skip_depth'] - 1)
+        elif tag in HTML_SECTION_TAGS and state['heading']:
+            title = ' '.join(''.join(state['heading_parts']).split())
+            if title and outline is not None: outline.append((state['heading'][0], title, state['heading'][1]))
+            state['heading'] = None
+            end_line()
+        elif tag in HTML_BLOCK_TAGS: end_line()
+
+    def data(text):
+        if state['skip_depth']: return
+        parts.append(text)
+        if state['heading']: state['heading_parts'].append(text)
+
+    parser = html.parser.HTMLParser(convert_charrefs=True) # Callbacks set on the instance, no subclass needed
+    parser.handle_starttag, parser.handle_endtag, parser.handle_data = start_tag, end_tag, data
+    parser.handle_startendtag = lambda tag, attrs: start_tag(tag, attrs) if tag not in HTML_SKIP_TAGS else None
+    with (io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')) as raw:
+        sample = raw.read(TEXT_SNIFF_BYTES)
+        raw.seek(0)
+        with io.TextIOWrapper(raw, encoding=sniff_html_encoding(sample), errors='replace') as text_file:
+            for chunk in iter(lambda: text_file.read(TEXT_PAGE_CHARS), ''):
+                parser.feed(chunk)
+    parser.close()
+    new_page()
+    return pages
+
+def sniff_html_encoding(sample):
+    """Encoding of an HTML file: a BOM, else its <meta charset>, else sniff_text_encoding()."""
+    if sample.startswith((codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)): return sniff_text_encoding(sample)
+    match = HTML_CHARSET_PATTERN.search(sample)
+    if match:
+        try: return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError: pass
+    return sniff_text_encoding(sample)
+
+def ooxml_local_name(tag):
+    """'{http://...}sheet' -> 'sheet'."""
+    return tag.rsplit('}', 1)[-1]
+
+def ooxml_attr(elem, name, default=None):
+    """Value of the attribute with local name name ('w:val' -> 'val'), preferring a namespaced one."""
+    plain = default
+    for key, value in elem.attrib.items():
+        if ooxml_local_name(key) == name:
+            if key.startswith('{'): return value
+            plain = value
+    return plain
+
+def ooxml_part_order(package, main_part, part_tag):
+    """
+    Part names of the slides (or sheets) of an OOXML package in document order, with
+    their names: [(part_name, name), ...] from main_part (e.g. 'ppt/presentation.xml')
+    and its relationships. Parts that are not in the package are left out.
+    """
+    part_dir, part_file = posixpath.split(main_part)
+    targets = {}
+    with package.open(posixpath.join(part_dir, '_rels', part_file + '.rels')) as rels:
+        for event, elem in ET.iterparse(rels):
+            if ooxml_local_name(elem.tag) == 'Relationship':
+                target = elem.get('Target', '')
+                targets[elem.get('Id')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(part_dir, target))
+    parts = []
+    with package.open(main_part) as main:
+        for event, elem in ET.iterparse(main):
+            if ooxml_local_name(elem.tag) == part_tag:
+                rel_id = ooxml_attr(elem, 'id')
+                if targets.get(rel_id) in package.NameToInfo: parts.append((targets[rel_id], elem.get('name')))
+    return parts
+
+def extract_pptx_pages(source, progress=None, outline=None, properties=None):
+    """Extracts the text of each PPTX slide (path or bytes), streamed from the slide XML; page_number = slide index."""
+    pages = []
+    with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as package:
+        for slide_num, (part_name, name) in enumerate(ooxml_part_order(package, 'ppt/presentation.xml', 'sldId')):
+            paragraphs, runs = [], []
+            with package.open(part_name) as slide:
+                for event, elem in ET.iterparse(slide):
+                    tag = ooxml_local_name(elem.tag)
+                    if tag == 't' and elem.text: runs.append(elem.text)
+                    elif tag == 'p':
+                        if runs: paragraphs.append(''.join(runs))
+                        runs = []
+                        elem.clear()
+            slide_text = "\n".join(paragraphs)
+            if slide_text.strip(): pages.append((slide_num, slide_text))
+            if progress: progress(slide_num)
+    return pages
+
+def extract_xlsx_pages(source, progress=None, outline=None, properties=None):
+    """
+    Extracts each XLSX worksheet (path or bytes) as one page (page_number = sheet index):
+    the sheet name, then one tab-separated line per row. Rows are streamed from the
+    sheet XML and discarded as they are read; only the shared strings are held.
+    """
+    pages = []
+    with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as package:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in package.NameToInfo:
+            with package.open('xl/sharedStrings.xml') as strings:
+                texts = []
+                for event, elem in ET.iterparse(strings):
+                    tag = ooxml_local_name(elem.tag)
+                    if tag == 't': texts.append(elem.text or '')
+                    elif tag == 'si':
+                        shared_strings.append(''.join(texts))
+                        texts = []
+                        elem.clear()
+        for sheet_num, (part_name, name) in enumerate(ooxml_part_order(package, 'xl/workbook.xml', 'sheet')):
+            lines = [name or f"Sheet{sheet_num + 1}"]
+            with package.open(part_name) as sheet:
+                cells, value = [], None
+                for event, elem in ET.iterparse(sheet):
+                    tag = ooxml_local_name(elem.tag)
+                    if tag in ('v', 't'): value = elem.text
+                    elif tag == 'c':
+                        if value is not None:
+                            if elem.get('t') == 's':
+                                try: value = shared_strings[int(value)]
+                                except (ValueError, IndexError): pass
+                            cells.append(value)
+                        value = None
+                        elem.clear()
+                    elif tag == 'row':
+                        if cells: lines.append("\t".join(cells))
+                        cells = []
+                        elem.clear()
+            if len(lines) > 1: pages.append((sheet_num, "\n".join(lines)))
+            if progress: progress(sheet_num)
+    return pages
+
+def extract_csv_pages(source, progress=None, outline=None, properties=None):
+    """
+    Streams a CSV file (path or bytes) through csv.reader, one tab-separated line per
+    row, in pages of about TEXT_PAGE_CHARS characters that end at a row; a longer row
+    is cut into pieces of that size. The dialect is sniffed from the first rows.
+    """
+    pages, lines, state = [], [], {'size': 0}
+
+    def new_page():
+        if lines:
+            pages.append((len(pages), "\n".join(lines)))
+            if progress: progress(len(pages) - 1)
+        lines.clear()
+        state['size'] = 0
+
+    with open_text_stream(source) as text_file:
+        sample = text_file.read(CSV_SNIFF_CHARS)
+        if len(sample) == CSV_SNIFF_CHARS: sample = sample[:max(sample.rfind("\n"), 0)] # Drop the cut-off last row
+        try: dialect = csv.Sniffer().sniff("\n".join(line for line in sample.splitlines() if line.strip()), delimiters=',;\t|')
+        except csv.Error: dialect = csv.excel
+        text_file.seek(0)
+        for row in csv.reader(text_file, dialect):
+            line = "\t".join(cell.strip() for cell in row)
+            if not line.strip(): continue
+            for start in range(0, len(line), TEXT_PAGE_CHARS):
+                lines.append(line[start:start + TEXT_PAGE_CHARS])
+                state['size'] += len(lines[-1])
+                if state['size'] >= TEXT_PAGE_CHARS: new_page()
+    new_page()
+    return pages
+
+# RTF tokens: control word (+ numeric argument), hex escape, control symbol, brace, line break, text
+RTF_TOKEN_PATTERN = re.compile(r"\\([a-z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-f]{2})|\\([^a-z])|([{}])|[\r\n]+|([^\\{}\r\n]+)", re.I)
+# Destinations (groups) that carry no document text
+RTF_SKIP_DESTINATIONS = {'fonttbl', 'colortbl', 'stylesheet', 'listtable', 'listoverridetable', 'info', 'pict',
+                         'object', 'header', 'headerl', 'headerr', 'headerf', 'footer', 'footerl', 'footerr', 'footerf',
+                         'fldinst', 'themedata', 'colorschememapping', 'datastore', 'latentstyles', 'rsidtbl', 'xmlnstbl', 'generator'}
+# The longest prefix of an RTF chunk that ends just before an unescaped brace or line break: no token is cut there
+RTF_CHUNK_END_PATTERN = re.compile(r"(?s).*[^\\](?=[{}\r\n])")
+
+def iter_rtf_chunks(text_file):
+    """Yields an RTF text stream in pieces of about TEXT_PAGE_CHARS, each cut before a brace or line break."""
+    pending = ''
+    for chunk in iter(lambda: text_file.read(TEXT_PAGE_CHARS), ''):
+        pending += chunk
+        match = RTF_CHUNK_END_PATTERN.match(pending)
+        if match:
+            yield pending[:match.end()]
+            pending = pending[match.end():]
+        elif len(pending) > 4 * TEXT_PAGE_CHARS: # No brace or line break at all: cut anywhere
+            yield pending
+            pending = ''
+    if pending: yield pending
+
+def extract_rtf_pages(source, progress=None, outline=None, properties=None):
+    """
+    Extracts the text of an RTF file (path or bytes), tokenizing it chunk by chunk
+    (see iter_rtf_chunks); each \\page break starts a new page.
+    """
+    pages, out, group_stack = [], [], []
+    ignorable, unicode_skip, skip, codepage = False, 1, 0, 'cp1252'
+    with open_text_stream(source) as text_file:
+        for chunk in iter_rtf_chunks(text_file):
+            for match in RTF_TOKEN_PATTERN.finditer(chunk):
+                word, arg, hex_code, symbol, brace, text = match.groups()
+                if brace:
+                    skip = 0
+                    if brace == '{': group_stack.append((unicode_skip, ignorable))
+                    elif group_stack: unicode_skip, ignorable = group_stack.pop()
+                elif symbol:
+                    skip = 0
+                    if symbol == '*': ignorable = True
+                    elif not ignorable:
+                        if symbol in '\\{}': out.append(symbol)
+                        elif symbol == '~': out.append(' ')
+                        elif symbol == '_': out.append('-')
+                elif word:
+                    skip = 0
+                    if word == 'ansicpg' and arg:
+                        try: codepage = codecs.lookup(f"cp{arg}").name
+                        except LookupError: pass
+                    elif word in RTF_SKIP_DESTINATIONS: ignorable = True
+                    elif ignorable: continue
+                    elif word in ('par', 'line', 'row', 'sect'): out.append("\n")
+                    elif word in ('tab', 'cell'): out.append("\t")
+                    elif word == 'uc' and arg: unicode_skip = int(arg)
+                    elif word == 'u' and arg:
+                        out.append(chr(int(arg) % 65536))
+                        skip = unicode_skip # The fallback characters that follow
+                    elif word == 'page':
+                        pages.append((len(pages), ''.join(out)))
+                        if progress: progress(len(pages) - 1)
+                        out = []
+                elif hex_code:
+                    if skip: skip -= 1
+                    elif not ignorable: out.append(bytes([int(hex_code, 16)]).decode(codepage, errors='replace'))
+                elif text:
+                    if skip:
+                        dropped = min(skip, len(text))
+                        text, skip = text[dropped:], skip - dropped
+                    if not ignorable: out.append(text)
+    pages.append((len(pages), ''.join(out)))
+    return [(page_num, text.strip()) for page_num, text in pages if text.strip()]
+
+def get_extractor(file_ext):
+    """Returns the text extractor for an extension, or None if it is not indexable here."""
+    if file_ext == '.pdf' and FITZ_ENABLED: return extract_pdf_pages
+    if file_ext == '.docx': return extract_docx_pages
+    if file_ext == '.txt': return extract_txt_pages
+    if file_ext in ('.html', '.htm'): return extract_html_pages
+    if file_ext == '.pptx': return extract_pptx_pages
+    if file_ext == '.xlsx': return extract_xlsx_pages
+    if file_ext == '.csv': return extract_csv_pages
+    if file_ext == '.rtf': return extract_rtf_pages
+    return None
+
+def is_streamed_text(filepath, file_size=None):
+    """True for a TXT file over TXT_STREAM_BYTES (not an archive member): it is written with streamed_text_result."""
+    if not filepath.lower().endswith('.txt') or split_archive_path(filepath)[1]: return False
+    try:
+        return (os.path.getsize(filepath) if file_size is None else file_size) > TXT_STREAM_BYTES
+    except OSError:
+        return False
+
+def streamed_text_result(doc_id, filepath):
+    """
+    An extract_document_text() result for a large TXT file whose 'pages' is an
+    iter_txt_pages() generator: write_extraction_result reads the file while it writes,
+    so at most a batch of pages is in memory and nothing is sent between processes.
+    """
+    return {'doc_id': doc_id, 'filepath': filepath, 'pages': iter_txt_pages(filepath), 'outline': [], 'properties': {},
+            'error': None, 'worker': None, 'duration': 0.0, 'quarantine': False}
+
+def render_pdf_thumbnails(source, all_pages=False, progress=None):
+    """PNG thumbnails THUMBNAIL_WIDTH pixels wide of the first (or every) page of a PDF (path or bytes): [(page_number, png), ...]."""
+    thumbnails = []
+    with (fitz.open(stream=source, filetype='pdf') if isinstance(source, bytes) else fitz.open(source)) as doc:
+        for page_num in range(len(doc) if all_pages else min(1, len(doc))):
+            page = doc[page_num]
+            zoom = THUMBNAIL_WIDTH / max(page.rect.width, 1)
+            thumbnails.append((page_num, page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes('png')))
+            if progress: progress(page_num)
+    return thumbnails
+
+def extract_document_text(doc_id, filepath, progress=None, file_timeout=None, page_timeout=None, thumbnails=THUMBNAILS_OFF, text=True):
+    """
+    Extraction job run in a pool worker (or in-process when the pool is disabled).
+    Never raises: errors are returned in the result so the writer can count them.
+    progress(page_num) is called after each page. With file_timeout/page_timeout the
+    budgets are checked between pages (a page that hangs can only be stopped by killing
+    the worker, see collect_extractions); an overrun sets result['quarantine'].
+
+    An archive gets result['members'] instead of pages: one dict per extractable member
+    ('member', 'file_size', 'last_modified', 'content_hash', 'pages', 'outline', 'properties', 'error'). Each
+    member has its own file budget and is announced with progress(None, member_name).
+    A virtual 'archive!member' path is read from its archive.
+
+    With thumbnails (THUMBNAILS_FIRST_PAGE / THUMBNAILS_ALL_PAGES) a PDF (or PDF member)
+    also gets 'thumbnails' (see render_pdf_thumbnails); a failed render only logs.
+    Without text only the thumbnails of a PDF (or PDF member) are rendered; 'pages' stays empty.
+    """
+    start_time = time.time()
+    result = {'doc_id': doc_id, 'filepath': filepath, 'pages': [], 'outline': [], 'properties': {}, 'error': None,
+              'worker': os.getpid(), 'duration': 0.0, 'quarantine': False}
+    budget_start = {'file': start_time, 'page': start_time}
+
+    def on_page(page_num):
+        now = time.time()
+        if page_timeout and now - budget_start['page'] > page_timeout:
+            raise TimeoutError(f"page {page_num + 1} took {now - budget_start['page']:.0f}s (limit {page_timeout}s)")
+        if file_timeout and now - budget_start['file'] > file_timeout:
+            raise TimeoutError(f"extraction took over {file_timeout}s")
+        budget_start['page'] = now
+        if progress: progress(page_num)
+
+    def thumbnails_of(name, source):
+        if not thumbnails or not FITZ_ENABLED or os.path.splitext(name)[1].lower() != '.pdf': return []
+        try:
+            return render_pdf_thumbnails(source, thumbnails == THUMBNAILS_ALL_PAGES, on_page)
+        except TimeoutError: raise
+        except Exception as e:
+            print(f"[Worker] Thumbnail error for {name}: {e}")
+            return []
+    try:
+        archive_path, member_name = split_archive_path(filepath)
+        if member_name:
+            extractor = get_extractor(os.path.splitext(member_name)[1].lower())
+            if extractor:
+                data = read_archive_member(archive_path, member_name)
+                if text: result['pages'] = extractor(data, on_page, result['outline'], result['properties'])
+                result['thumbnails'] = thumbnails_of(member_name, data)
+        elif is_archive(filepath):
+            result['members'] = []
+            for member_name, member_size, member_mtime, data in iter_archive_members(filepath):
+                budget_start['file'] = budget_start['page'] = time.time()
+                if progress: progress(None, member_name)
+                member = {'member': member_name, 'file_size': member_size, 'last_modified': member_mtime,
+                          'content_hash': compute_data_hash(data), 'pages': [], 'outline': [], 'properties': {}, 'error': None}
+                result['members'].append(member)
+                try:
+                    member['pages'] = get_extractor(os.path.splitext(member_name)[1].lower())(data, on_page, member['outline'], member['properties'])
+                    member['thumbnails'] = thumbnails_of(member_name, data)
+                except TimeoutError as e:
+                    raise TimeoutError(f"{member_name}: {e}")
+                except Exception as e:
+                    member['error'] = str(e)
+        else:
+            extractor = get_extractor(os.path.splitext(filepath)[1].lower())
+            if extractor:
+                if text: result['pages'] = extractor(filepath, on_page, result['outline'], result['properties'])
+                result['thumbnails'] = thumbnails_of(filepath, filepath)
+    except TimeoutError as e:
+        result['error'], result['quarantine'] = str(e), True
+    except Exception as e:
+        result['error'] = str(e)
+    result['duration'] = time.time() - start_time
+    return result
+
+
+# --- Extraction Pool ---
+# One process per worker, each fed one file at a time over its own pipe, so a worker
+# stuck in a pathological document can be killed and replaced without losing the
+# files the other workers are extracting. A worker reports ('ready', pid) once it has
+# started, which tells a file that crashes its worker apart from workers that cannot
+# start at all (spawn/import failure): only the first is the file's fault.
+def extraction_worker_main(job_conn):
+    """Worker process loop: receives (doc_id, filepath, thumbnails, text) jobs, sends ('page', n) / ('member', name) progress and ('done', result)."""
+    progress = lambda page_num, member=None: job_conn.send(('page', page_num) if member is None else ('member', member))
+    try:
+        job_conn.send(('ready', os.getpid()))
+    except OSError: return # Parent went away
+    while True:
+        try:
+            job = job_conn.recv()
+        except (EOFError, OSError): break # Parent went away
+        if job is None: break
+        job_conn.send(('done', extract_document_text(job[0], job[1], progress, thumbnails=job[2], text=job[3])))
+
+def start_extraction_worker(context):
+    """Starts one extraction worker process. Returns its state dict."""
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=extraction_worker_main, args=(child_conn,), daemon=True)
+    process.start()
+    child_conn.close()
+    return {'process': process, 'conn': parent_conn, 'job': None, 'thumbnails': THUMBNAILS_OFF, 'ready': False,
+            'started': 0.0, 'last_progress': 0.0, 'page': None, 'member': None}
+
+def create_extraction_pool(workers):
+    """
+    An extraction pool of workers processes, or None for in-process extraction (workers <= 0).
+    The processes (an interpreter and its imports each) are only started by the first
+    submit_extraction, so scans with nothing to extract never start them.
+    """
+    if workers <= 0: return None
+    # 'spawn' everywhere: forking a process that runs Tk/SQLite threads is not safe
+    return {'context': multiprocessing.get_context('spawn'), 'size': workers, 'workers': [], 'start_failures': 0}
+
+def send_extraction_job(pool, worker, item, thumbnails):
+    """Gives item to an idle worker (only thumbnails if item['text'] is False); a worker whose pipe is broken is replaced and the job goes to the new one."""
+    while True:
+        worker['job'], worker['thumbnails'] = item, thumbnails
+        worker['started'] = worker['last_progress'] = time.time()
+        worker['page'] = worker['member'] = None
+        try:
+            worker['conn'].send((None, item['filepath'], thumbnails, item.get('text', True)))
+            return worker
+        except OSError:
+            worker = replace_extraction_worker(pool, worker, "extraction worker went away")
+
+def submit_extraction(pool, item, thumbnails=THUMBNAILS_OFF):
+    """Hands item['filepath'] to an idle worker, starting the workers first if needed. Returns False if all are busy."""
+    if not pool['workers']:
+        print(f"[Worker] Starting {pool['size']} extraction workers...")
+        pool['workers'] = [start_extraction_worker(pool['context']) for _ in range(pool['size'])]
+    for worker in pool['workers']:
+        if worker['job'] is None:
+            send_extraction_job(pool, worker, item, thumbnails)
+            return True
+    return False
+
+def replace_extraction_worker(pool, worker, reason):
+    """
+    Kills a worker and starts a new one in its place; returns the new one. Raises
+    RuntimeError when EXTRACT_START_FAILURES workers in a row died before they were ready.
+    """
+    worker['process'].kill()
+    worker['process'].join()
+    worker['conn'].close()
+    if not worker['ready']:
+        pool['start_failures'] += 1
+        if pool['start_failures'] >= EXTRACT_START_FAILURES:
+            raise RuntimeError(f"Extraction workers keep failing to start ({reason})")
+    new_worker = start_extraction_worker(pool['context'])
+    pool['workers'][pool['workers'].index(worker)] = new_worker
+    return new_worker
+
+def kill_extraction_worker(pool, worker, reason):
+    """Kills a worker and replaces it. Returns its item, with a quarantine result for reason."""
+    item = worker['job']
+    if worker['member']: reason = f"{worker['member']}: {reason}"
+    replace_extraction_worker(pool, worker, reason)
+    item['result'] = {'doc_id': None, 'filepath': item['filepath'], 'pages': [], 'outline': [], 'properties': {}, 'error': reason,
+                      'worker': worker['process'].pid, 'duration': time.time() - worker['started'], 'quarantine': True}
+    print(f"[Worker] Killed extraction of {item['filepath']}: {reason}")
+    return item
+
+def collect_extractions(pool, wait_seconds, file_timeout=EXTRACT_FILE_TIMEOUT, page_timeout=EXTRACT_PAGE_TIMEOUT):
+    """
+    Waits up to wait_seconds for worker messages. Returns the items whose extraction
+    finished, with item['result'] set. Workers over their file or page budget are killed
+    and replaced; their items get an error result with 'quarantine' set. A worker that
+    dies (a crash in a PDF library, but also an OOM kill) is replaced and its file is
+    given to the new worker; only a file that crashes EXTRACT_CRASH_ATTEMPTS workers is
+    quarantined. Workers that die before they are ready are not held against the file,
+    and raise RuntimeError once EXTRACT_START_FAILURES fail in a row.
+    """
+    finished = []
+    busy = {worker['conn']: worker for worker in pool['workers'] if worker['job'] is not None}
+    if not busy: return finished
+    for conn in multiprocessing.connection.wait(list(busy), timeout=wait_seconds):
+        worker = busy[conn]
+        try:
+            while worker['job'] is not None and conn.poll():
+                kind, value = conn.recv()
+                if kind == 'ready':
+                    worker['ready'], pool['start_failures'] = True, 0
+                elif kind == 'page':
+                    worker['page'], worker['last_progress'] = value, time.time()
+                elif kind == 'member': # Next archive member: fresh file and page budgets
+                    worker['member'], worker['page'] = value, None
+                    worker['started'] = worker['last_progress'] = time.time()
+                else:
+                    worker['job']['result'] = value
+                    finished.append(worker['job'])
+                    worker['job'] = None
+        except (EOFError, OSError):
+            worker['process'].join(1)
+            reason = f"extraction worker crashed (exit code {worker['process'].exitcode})"
+            item = worker['job']
+            if worker['ready']: item['crashes'] = item.get('crashes', 0) + 1
+            if item.get('crashes', 0) >= EXTRACT_CRASH_ATTEMPTS:
+                finished.append(kill_extraction_worker(pool, worker, reason))
+            else:
+                print(f"[Worker] {reason} on {item['filepath']}; retrying it on a new worker.")
+                send_extraction_job(pool, replace_extraction_worker(pool, worker, reason), item, worker['thumbnails'])
+    now = time.time()
+    for worker in list(pool['workers']):
+        if worker['job'] is None: continue
+        if not worker['ready'] and now - worker['started'] > min(file_timeout, page_timeout): # Never started
+            send_extraction_job(pool, replace_extraction_worker(pool, worker, f"no worker ready after {now - worker['started']:.0f}s"),
+                                worker['job'], worker['thumbnails'])
+        elif now - worker['started'] > file_timeout:
+            finished.append(kill_extraction_worker(pool, worker, f"extraction took over {file_timeout}s"))
+        elif now - worker['last_progress'] > page_timeout:
+            hung_page = 1 if worker['page'] is None else worker['page'] + 2
+            finished.append(kill_extraction_worker(pool, worker, f"page {hung_page} took over {page_timeout}s"))
+    return finished
+
+def extract_in_worker(pool, doc_id, filepath, file_timeout=EXTRACT_FILE_TIMEOUT, page_timeout=EXTRACT_PAGE_TIMEOUT, stop_event=None):
+    """
+    extract_document_text() of one file in an idle pool worker, waiting for the result:
+    a worker over budget is killed as in collect_extractions (result['quarantine']).
+    Raises InterruptedError if stop_event is set first (the worker is left busy for
+    shutdown_extraction_pool to kill).
+    """
+    item = {'filepath': filepath}
+    submit_extraction(pool, item)
+    while 'result' not in item:
+        if stop_event is not None and stop_event.is_set(): raise InterruptedError(f"Stopped while extracting {filepath}")
+        collect_extractions(pool, 0.5, file_timeout, page_timeout)
+    item['result']['doc_id'] = doc_id
+    return item['result']
+
+def shutdown_extraction_pool(pool):
+    """Stops idle workers and kills busy ones (their files are extracted again next scan)."""
+    for worker in pool['workers']:
+        try:
+            if worker['job'] is None: worker['conn'].send(None)
+            else: worker['process'].kill()
+        except OSError: worker['process'].kill()
+    for worker in pool['workers']:
+        worker['process'].join(5)
+        if worker['process'].is_alive(): worker['process'].kill(); worker['process'].join()
+        worker['conn'].close()
+
+def record_worker_stats(worker_stats, result):
+    """Accumulates per-worker throughput counters from one extraction result."""
+    stats = worker_stats.setdefault(result['worker'], {'files': 0, 'pages': 0, 'busy': 0.0})
+    stats['files'] += 1
+    stats['pages'] += len(result['pages'])
+    stats['busy'] += result['duration']
+
+def format_worker_stats(worker_stats):
+    """Formats per-worker throughput as printable lines."""
+    lines = []
+    for worker, stats in sorted(worker_stats.items()):
+        busy = stats['busy'] or 1e-9
+        lines.append(f"worker {worker}: {stats['files']} files, {stats['pages']} pages, "
+                     f"{stats['files'] / busy:.1f} files/s, {stats['pages'] / busy:.1f} pages/s")
+    return lines
+
+
+# --- Page Text Storage ---
+def compress_page_text(text, level):
+    """Value stored in pages.text: with level > 0 the zlib-compressed UTF-8 if that is smaller, else the text."""
+    if level <= 0: return text
+    data = text.encode('utf-8', 'surrogatepass')
+    blob = zlib.compress(data, level)
+    return blob if len(blob) < len(data) else text
+
+def decompress_page_text(value):
+    """pages.text as a string (see compress_page_text); the page_text() SQL function."""
+    return zlib.decompress(value).decode('utf-8', 'surrogatepass') if isinstance(value, bytes) else value
+
+def connect_index(db_path=None, timeout=5.0):
+    """sqlite3.connect to the index with page_text() registered (needed to search or write page text)."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE, timeout=timeout)
+    conn.create_function('page_text', 1, decompress_page_text, deterministic=True)
+    return conn
+
+def get_page_compression(cursor):
+    """zlib level new page text is stored with, 0 = uncompressed (see set_page_compression)."""
+    row = cursor.execute("SELECT value FROM index_settings WHERE name = 'page_compression'").fetchone()
+    return int(row[0]) if row else 0
+
+def has_page_code_index(cursor):
+    """True if the optional trigram index over page text (pages_code_fts) is built (see set_code_index)."""
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'pages_code_fts'").fetchone() is not None
+
+
+# --- Database Schema ---
+def init_db(db_path=None):
+    """Initializes the SQLite database and tables if they don't exist."""
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+
+    # --- Scan Paths Table ---
+    # Replace placeholder with correct definition
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_paths (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL UNIQUE,
+            manufacturer TEXT -- Default manufacturer of the files below it, as last assigned when scanning
+        )
+    ''')
+    if 'manufacturer' not in {row[1] for row in cursor.execute("PRAGMA table_info(scan_paths)")}:
+        cursor.execute("ALTER TABLE scan_paths ADD COLUMN manufacturer TEXT")
+
+    # --- Documents Table ---
+    # Ensure this is the FULL definition with BME enhancements
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            filepath TEXT NOT NULL UNIQUE,
+            manufacturer TEXT,
+            device_model TEXT,
+            document_type TEXT,
+            keywords TEXT,
+            last_modified REAL NOT NULL,
+            revision_number TEXT,
+            revision_date TEXT,
+            status TEXT,
+            applicable_models TEXT,
+            associated_test_equipment TEXT,
+            file_size INTEGER,
+            content_hash TEXT, -- Hash of the whole file, see compute_content_hash
+            text_doc_id INTEGER -- Document whose FTS/outline/properties rows hold this text (itself, or
+                                -- an identical copy); NULL if it has no extracted text
+        )
+    ''')
+    # Columns added after the first release: bring older databases up to date
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(documents)")}
+    for column_name, column_type in [('file_size', 'INTEGER'), ('content_hash', 'TEXT'), ('text_doc_id', 'INTEGER')]:
+        if column_name not in existing_columns:
+            print(f"Migrating documents table: adding column '{column_name}'")
+            cursor.execute(f"ALTER TABLE documents ADD COLUMN {column_name} {column_type}")
+    # Used by every write of extracted text (duplicate lookup), so not dropped during bulk builds
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_content_hash ON documents (content_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_text_doc ON documents (text_doc_id)")
+
+    # --- Scan Journal Table ---
+    # One row per scan run; lets an interrupted scan resume (see bme_indexer.scan_and_index)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_journal (
+            scan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started REAL NOT NULL,
+            last_checkpoint REAL,
+            finished REAL,
+            status TEXT NOT NULL, -- 'running', 'interrupted' or 'completed'
+            resume_dir TEXT, -- Last directory fully committed, in sorted walk order
+            files_committed INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # --- Directory Cache Table ---
+    # Listed directories' mtimes, so unchanged folders are skipped on rescans
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dir_cache (
+            path TEXT PRIMARY KEY,
+            mtime REAL, -- NULL = not trusted, list again next scan
+            child_count INTEGER,
+            subdirs TEXT -- Newline-separated subdirectory names
+        )
+    ''')
+
+    # --- Quarantine Table ---
+    # Files whose extraction timed out or crashed a worker; skipped until their content changes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS quarantine (
+            filepath TEXT PRIMARY KEY,
+            content_hash TEXT, -- Content hash when quarantined; a different hash is extracted again
+            file_size INTEGER,
+            reason TEXT NOT NULL,
+            duration REAL, -- Seconds spent before the extraction was stopped
+            quarantined REAL NOT NULL
+        )
+    ''')
+
+    # --- Index Settings Table ---
+    # Properties of the database itself, e.g. 'page_compression' (see set_page_compression)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS index_settings (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # --- Pages Table and FTS5 Index for Full-Text Search ---
+    # Page text lives in pages; documents_fts is an external-content index over it
+    # (rowid = pages.id), kept in sync by the pages triggers. doc_id and page_number are
+    # read from pages, so moving or deleting a document's pages is an indexed operation.
+    # The index reads the text through page_contents, which decompresses it (page_text()).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pages (
+            id INTEGER PRIMARY KEY, -- documents_fts rowid
+            doc_id INTEGER NOT NULL,
+            page_number INTEGER NOT NULL,
+            text TEXT NOT NULL -- Or a zlib-compressed UTF-8 BLOB, see compress_page_text
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pages_doc ON pages (doc_id, page_number)")
+    cursor.execute("CREATE VIEW IF NOT EXISTS page_contents AS SELECT id, doc_id, page_number, page_text(text) AS text FROM pages")
+    fts_sql = cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'documents_fts'").fetchone()
+    if fts_sql and 'content=' not in fts_sql[0]: # Databases from before the pages table: text stored in the FTS table
+        print("Migrating full-text index: moving page text into the pages table...")
+        cursor.execute("INSERT INTO pages (doc_id, page_number, text) SELECT doc_id, page_number, content FROM documents_fts ORDER BY rowid")
+    if fts_sql and "content='page_contents'" not in fts_sql[0]: # ...or indexed pages directly (no compression)
+        cursor.execute("DROP TABLE documents_fts")
+        for trigger_name in ('pages_ai_trigger', 'pages_ad_trigger', 'pages_au_trigger'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+        fts_sql = None
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            doc_id UNINDEXED,
+            page_number UNINDEXED,
+            text,
+            content='page_contents', content_rowid='id'
+            -- Optionally add tokenize='porter'
+        )
+    ''')
+    create_pages_triggers(cursor)
+    if fts_sql is None and cursor.execute("SELECT 1 FROM pages LIMIT 1").fetchone(): # Just migrated
+        print("Migrating full-text index: rebuilding it over the pages table...")
+        cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+
+    # --- Document Outline Table ---
+    # Headings found during extraction (DOCX heading styles, HTML <h1>-<h3>), in document order
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_outline (
+            doc_id INTEGER NOT NULL,
+            position INTEGER NOT NULL, -- Order in the document
+            level INTEGER NOT NULL, -- 1 = top-level heading
+            title TEXT NOT NULL,
+            page_number INTEGER NOT NULL, -- pages.page_number the heading starts
+            PRIMARY KEY (doc_id, position)
+        ) WITHOUT ROWID
+    ''')
+
+    # --- Document Properties Table ---
+    # PDF page count and document info, so the details panel does not have to open the file
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_properties (
+            doc_id INTEGER PRIMARY KEY,
+            page_count INTEGER,
+            title TEXT,
+            author TEXT,
+            producer TEXT,
+            created TEXT -- 'YYYY-MM-DD HH:MM:SS' from the PDF creation date
+        )
+    ''')
+
+    # --- Delete Trigger ---
+    # Keeps the text tables in sync when a document is deleted. Text shared by identical
+    # copies (text_doc_id) is handed to the lowest remaining copy instead of dropped.
+    # Replaces the separate per-table triggers of older databases.
+    if 'text_doc_id' not in existing_columns: # Databases from before shared text: record which documents have text
+        cursor.execute("UPDATE documents SET text_doc_id = id WHERE id IN (SELECT DISTINCT doc_id FROM pages)")
+        merged = share_duplicate_text(cursor)
+        if merged: print(f"Migrating documents table: {merged} identical copies now share one indexed text.")
+    for trigger_name in ('documents_ad_trigger', 'documents_ad_outline_trigger', 'documents_ad_properties_trigger'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+    cursor.execute('''
+        CREATE TRIGGER documents_ad_trigger AFTER DELETE ON documents BEGIN
+            UPDATE pages SET doc_id = (SELECT MIN(id) FROM documents WHERE text_doc_id = old.id)
+                WHERE doc_id = old.id AND EXISTS (SELECT 1 FROM documents WHERE text_doc_id = old.id);
+            UPDATE document_outline SET doc_id = (SELECT MIN(id) FROM documents WHERE text_doc_id = old.id)
+                WHERE doc_id = old.id AND EXISTS (SELECT 1 FROM documents WHERE text_doc_id = old.id);
+            UPDATE document_properties SET doc_id = (SELECT MIN(id) FROM documents WHERE text_doc_id = old.id)
+                WHERE doc_id = old.id AND EXISTS (SELECT 1 FROM documents WHERE text_doc_id = old.id);
+            UPDATE documents SET text_doc_id = (SELECT MIN(id) FROM documents WHERE text_doc_id = old.id) WHERE text_doc_id = old.id;
+            DELETE FROM pages WHERE doc_id=old.id;
+            DELETE FROM document_outline WHERE doc_id=old.id;
+            DELETE FROM document_properties WHERE doc_id=old.id;
+        END;
+    ''')
+
+    # --- Code Search Index (Metadata) ---
+    # Trigram index over the columns search_documents matches as substrings, replacing
+    # LIKE '%q%' scans of the whole table (see create_documents_code_index)
+    if TRIGRAM_ENABLED and create_documents_code_index(cursor):
+        print("Built the part number index over document metadata.")
+
+    # --- Links Table ---
+    # Ensure this is the correct definition with description
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS links (
+            link_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_doc_id INTEGER NOT NULL,
+            target_doc_id INTEGER NOT NULL,
+            description TEXT, -- Added description
+            FOREIGN KEY (source_doc_id) REFERENCES documents (id) ON DELETE CASCADE,
+            FOREIGN KEY (target_doc_id) REFERENCES documents (id) ON DELETE CASCADE,
+            UNIQUE (source_doc_id, target_doc_id)
+        )
+    ''')
+
+    # --- Notes Table ---
+    # Ensure this is the correct definition with page_number
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notes (
+            note_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id INTEGER NOT NULL,
+            page_number INTEGER,  -- Added page context
+            note_text TEXT NOT NULL,
+            created_timestamp REAL NOT NULL,
+            FOREIGN KEY (doc_id) REFERENCES documents (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # --- Favorites Table ---
+    # Ensure this is the correct definition
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            fav_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            doc_id INTEGER NOT NULL,
+            page_number INTEGER NOT NULL,
+            FOREIGN KEY (doc_id) REFERENCES documents (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # --- Indexes ---
+    # Ensure all necessary indexes are created
+    create_secondary_indexes(cursor)
+
+    apply_extraction_upgrades(cursor, db_path)
+    apply_content_hash_upgrade(cursor, db_path)
+
+    conn.commit()
+    conn.close()
+    print("Database initialized/verified (All Tables).") # Updated print message
+
+
+def apply_extraction_upgrades(cursor, db_path=None):
+    """
+    Marks documents of the types in EXTRACTION_UPGRADES newer than the database as
+    changed (and their folders as not trusted in dir_cache), so the next scan extracts
+    them again, and drops their text from the text cache. Runs once per upgrade; a new
+    database only records the version.
+    """
+    current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    latest_version = max(version for version, extensions in EXTRACTION_UPGRADES)
+    if current_version >= latest_version: return
+    extensions = {ext for version, exts in EXTRACTION_UPGRADES if version > current_version for ext in exts}
+    stale = [(doc_id, filepath, content_hash) for doc_id, filepath, content_hash in cursor.execute("SELECT id, filepath, content_hash FROM documents")
+             if filepath.lower().endswith(tuple(extensions))]
+    if stale:
+        print(f"Extraction upgrade: {len(stale)} documents ({', '.join(sorted(extensions))}) will be reindexed on the next scan.")
+        cursor.executemany("UPDATE documents SET last_modified = 0, content_hash = NULL WHERE id = ?", [(doc_id,) for doc_id, filepath, content_hash in stale])
+        cursor.executemany("UPDATE dir_cache SET mtime = NULL WHERE path = ?", {(document_dir(filepath),) for doc_id, filepath, content_hash in stale})
+        if os.path.exists(get_text_cache_path(db_path)):
+            cache_conn = open_text_cache(db_path)
+            try:
+                stale_hashes = [(content_hash,) for doc_id, filepath, content_hash in stale if content_hash]
+                cache_conn.executemany("DELETE FROM cached_pages WHERE content_hash = ?", stale_hashes)
+                cache_conn.executemany("DELETE FROM cached_files WHERE content_hash = ?", stale_hashes)
+                cache_conn.commit()
+            finally:
+                cache_conn.close()
+    cursor.execute(f"PRAGMA user_version = {latest_version}")
+
+
+def apply_content_hash_upgrade(cursor, db_path=None):
+    """
+    Databases from before CONTENT_HASH_VERSION hashed only the size and the first and
+    last 64 KB of each file, which different files can share. Drops those hashes, so the
+    next scan stores full ones without extracting again ('backfill'), and empties the
+    text and thumbnail caches keyed by them. Copies that shared another document's text
+    by the old hash are extracted again (for archive members: their archive), so text is
+    only shared again between files whose whole content matches. Runs once; a new
+    database only records the version.
+    """
+    if cursor.execute("SELECT 1 FROM index_settings WHERE name = 'content_hash'").fetchone(): return
+    if cursor.execute("SELECT 1 FROM documents WHERE content_hash IS NOT NULL LIMIT 1").fetchone():
+        print("Content hash upgrade: the next scan reads each file once to store a hash of its whole content.")
+        copies = cursor.execute("SELECT id, filepath FROM documents WHERE text_doc_id != id").fetchall()
+        if copies:
+            print(f"Content hash upgrade: {len(copies)} copies sharing indexed text will be extracted again.")
+            cursor.execute("UPDATE documents SET text_doc_id = NULL, last_modified = 0 WHERE text_doc_id != id")
+            cursor.executemany("UPDATE documents SET last_modified = 0 WHERE filepath = ?",
+                               {(split_archive_path(filepath)[0],) for doc_id, filepath in copies if split_archive_path(filepath)[1]})
+        cursor.execute("UPDATE documents SET content_hash = NULL")
+        cursor.execute("UPDATE dir_cache SET mtime = NULL") # Unchanged folders must be listed to backfill
+        for cache_path, open_cache, tables in [(get_text_cache_path(db_path), open_text_cache, ('cached_pages', 'cached_files')),
+                                               (get_thumbnail_cache_path(db_path), open_thumbnail_cache, ('thumbnails',))]:
+            if not os.path.exists(cache_path): continue
+            cache_conn = open_cache(db_path)
+            try:
+                for table in tables: cache_conn.execute(f"DELETE FROM {table}")
+                cache_conn.commit()
+            finally:
+                cache_conn.close()
+    cursor.execute("INSERT INTO index_settings (name, value) VALUES ('content_hash', ?)", (CONTENT_HASH_VERSION,))
+
+
+# --- Bulk Build ---
+def create_secondary_indexes(cursor, table=None):
+    """Creates the secondary indexes (only those on table, if given) that don't exist yet."""
+    for index_name, index_table, column in SECONDARY_INDEXES:
+        if table in (None, index_table):
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {index_table} ({column})')
+
+def drop_secondary_indexes(cursor, table):
+    """Drops the secondary indexes on table (recreate with create_secondary_indexes)."""
+    for index_name, index_table, column in SECONDARY_INDEXES:
+        if index_table == table:
+            cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+def set_bulk_build_pragmas(cursor):
+    """Applies BULK_BUILD_PRAGMAS; returns the previous values for restore_pragmas(). Call outside a transaction."""
+    previous = {name: cursor.execute(f"PRAGMA {name}").fetchone()[0] for name, value in BULK_BUILD_PRAGMAS}
+    for name, value in BULK_BUILD_PRAGMAS:
+        cursor.execute(f"PRAGMA {name}={value}")
+    return previous
+
+def restore_pragmas(cursor, previous):
+    """Restores pragma values saved by set_bulk_build_pragmas(). Call outside a transaction."""
+    for name, value in previous.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+
+
+# --- FTS Maintenance ---
+def create_pages_triggers(cursor):
+    """Triggers that keep the external-content documents_fts index (and pages_code_fts, if built) in sync with pages."""
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pages_ai_trigger AFTER INSERT ON pages BEGIN
+            INSERT INTO documents_fts (rowid, text) VALUES (new.id, page_text(new.text));
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pages_ad_trigger AFTER DELETE ON pages BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, text) VALUES ('delete', old.id, page_text(old.text));
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pages_au_trigger AFTER UPDATE OF text ON pages BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, text) VALUES ('delete', old.id, page_text(old.text));
+            INSERT INTO documents_fts (rowid, text) VALUES (new.id, page_text(new.text));
+        END;
+    ''')
+    if not has_page_code_index(cursor): return
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pages_code_ai_trigger AFTER INSERT ON pages BEGIN
+            INSERT INTO pages_code_fts (rowid, text) VALUES (new.id, page_text(new.text));
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pages_code_ad_trigger AFTER DELETE ON pages BEGIN
+            INSERT INTO pages_code_fts (pages_code_fts, rowid, text) VALUES ('delete', old.id, page_text(old.text));
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS pages_code_au_trigger AFTER UPDATE OF text ON pages BEGIN
+            INSERT INTO pages_code_fts (pages_code_fts, rowid, text) VALUES ('delete', old.id, page_text(old.text));
+            INSERT INTO pages_code_fts (rowid, text) VALUES (new.id, page_text(new.text));
+        END;
+    ''')
+
+def create_documents_code_index(cursor):
+    """
+    Creates the trigram index over document metadata (documents_code_fts, external
+    content over documents) and its triggers if missing. Returns True if it was just
+    built over existing documents.
+    """
+    code_fts_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_code_fts'").fetchone()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_code_fts USING fts5(
+            filename, filepath, manufacturer, device_model, document_type, keywords,
+            content='documents', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_code_ai_trigger AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_code_fts (rowid, filename, filepath, manufacturer, device_model, document_type, keywords)
+            VALUES (new.id, new.filename, new.filepath, new.manufacturer, new.device_model, new.document_type, new.keywords);
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_code_ad_trigger AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_code_fts (documents_code_fts, rowid, filename, filepath, manufacturer, device_model, document_type, keywords)
+            VALUES ('delete', old.id, old.filename, old.filepath, old.manufacturer, old.device_model, old.document_type, old.keywords);
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS documents_code_au_trigger
+        AFTER UPDATE OF filename, filepath, manufacturer, device_model, document_type, keywords ON documents BEGIN
+            INSERT INTO documents_code_fts (documents_code_fts, rowid, filename, filepath, manufacturer, device_model, document_type, keywords)
+            VALUES ('delete', old.id, old.filename, old.filepath, old.manufacturer, old.device_model, old.document_type, old.keywords);
+            INSERT INTO documents_code_fts (rowid, filename, filepath, manufacturer, device_model, document_type, keywords)
+            VALUES (new.id, new.filename, new.filepath, new.manufacturer, new.device_model, new.document_type, new.keywords);
+        END;
+    ''')
+    if code_fts_exists or not cursor.execute("SELECT 1 FROM documents LIMIT 1").fetchone(): return False
+    cursor.execute("INSERT INTO documents_code_fts (documents_code_fts) VALUES ('rebuild')")
+    return True
+
+def drop_documents_code_index(cursor):
+    """Drops documents_code_fts and its triggers (bulk builds recreate it once at the end)."""
+    for trigger_name in ('documents_code_ai_trigger', 'documents_code_ad_trigger', 'documents_code_au_trigger'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+    cursor.execute("DROP TABLE IF EXISTS documents_code_fts")
+
+def count_fts_segments(cursor):
+    """Number of segments in the FTS index (each one is searched per query term)."""
+    # Skip-scan over the segment ids: one index seek per segment instead of reading every row
+    return cursor.execute('''
+        WITH RECURSIVE seg(id) AS (
+            SELECT MIN(segid) FROM documents_fts_idx
+            UNION ALL
+            SELECT (SELECT MIN(segid) FROM documents_fts_idx WHERE segid > id) FROM seg WHERE id IS NOT NULL
+        ) SELECT COUNT(id) FROM seg''').fetchone()[0]
+
+def merge_fts_segments(conn, budget_pages=FTS_MERGE_PAGES):
+    """
+    Incrementally merges FTS segments with at most about budget_pages pages of work,
+    then commits. Unlike 'optimize', the cost is bounded by the budget rather than by
+    the size of the index. Returns the number of merge steps run.
+    """
+    cursor = conn.cursor()
+    pages_left = budget_pages
+    steps = 0
+    while pages_left > 0:
+        steps += 1
+        changes_before = conn.total_changes
+        cursor.execute("INSERT INTO documents_fts(documents_fts, rank) VALUES('merge', ?)", (min(FTS_MERGE_STEP, pages_left),))
+        pages_left -= FTS_MERGE_STEP
+        if conn.total_changes - changes_before < 2: break # Nothing left to merge
+    conn.commit()
+    return steps
+
+def optimize_fts_tables(cursor):
+    """Runs 'optimize' on documents_fts and on the trigram indexes that exist."""
+    cursor.execute("INSERT INTO documents_fts(documents_fts) VALUES('optimize')")
+    if has_page_code_index(cursor): cursor.execute("INSERT INTO pages_code_fts(pages_code_fts) VALUES('optimize')")
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_code_fts'").fetchone():
+        cursor.execute("INSERT INTO documents_code_fts(documents_code_fts) VALUES('optimize')")
+
+def optimize_fts(db_path=None):
+    """
+    Full FTS optimize: merges the whole index (and the trigram indexes) into one segment. Takes time proportional
+    to the index size, so it is a maintenance action (menu / 'bme_cli.py optimize'),
+    not part of every scan. Returns {'segments_before', 'segments_after', 'duration'}.
+    """
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        cursor = conn.cursor()
+        segments_before = count_fts_segments(cursor)
+        start_time = time.time()
+        optimize_fts_tables(cursor)
+        conn.commit()
+        return {'segments_before': segments_before, 'segments_after': count_fts_segments(cursor),
+                'duration': time.time() - start_time}
+    finally:
+        conn.close()
+
+
+# --- Text Cache ---
+def get_text_cache_path(db_path=None):
+    """Path of the text cache belonging to an index database."""
+    return os.path.splitext(db_path or DATABASE_FILE)[0] + TEXT_CACHE_SUFFIX
+
+def open_text_cache(db_path=None):
+    """Opens the text cache of an index database, creating it if needed. Returns the connection."""
+    conn = sqlite3.connect(get_text_cache_path(db_path), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cached_files (
+            content_hash TEXT PRIMARY KEY,
+            page_count INTEGER NOT NULL,
+            cached REAL NOT NULL,
+            outline TEXT, -- JSON [[level, title, page_number], ...], NULL if none
+            properties TEXT -- JSON {'page_count': ..., 'title': ...} (PDF), NULL if none
+        )
+    ''')
+    cached_columns = {row[1] for row in conn.execute("PRAGMA table_info(cached_files)")}
+    for column in ('outline', 'properties'):
+        if column not in cached_columns: conn.execute(f"ALTER TABLE cached_files ADD COLUMN {column} TEXT")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cached_pages (
+            content_hash TEXT NOT NULL,
+            page_number INTEGER NOT NULL,
+            text BLOB NOT NULL, -- zlib-compressed UTF-8
+            PRIMARY KEY (content_hash, page_number)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+    return conn
+
+def read_cached_pages(cache_conn, content_hash):
+    """Returns the cached [(page_number, text), ...] for a content hash, or None if not cached."""
+    if not content_hash or cache_conn.execute("SELECT 1 FROM cached_files WHERE content_hash = ?", (content_hash,)).fetchone() is None:
+        return None
+    return [(page_number, zlib.decompress(blob).decode('utf-8', 'surrogatepass')) for page_number, blob in
+            cache_conn.execute("SELECT page_number, text FROM cached_pages WHERE content_hash = ? ORDER BY page_number", (content_hash,))]
+
+def read_cached_result(cache_conn, content_hash, doc_id, filepath):
+    """An extract_document_text() result built from the text cache (with 'cached' set), or None if not cached."""
+    pages = read_cached_pages(cache_conn, content_hash)
+    if pages is None: return None
+    outline_json, properties_json = cache_conn.execute("SELECT outline, properties FROM cached_files WHERE content_hash = ?", (content_hash,)).fetchone()
+    return {'doc_id': doc_id, 'filepath': filepath, 'pages': pages, 'outline': [tuple(entry) for entry in json.loads(outline_json or '[]')],
+            'properties': json.loads(properties_json or '{}'),
+            'error': None, 'worker': None, 'duration': 0.0, 'quarantine': False, 'cached': True}
+
+def store_cached_pages(cache_conn, content_hash, pages, outline=None, properties=None):
+    """Caches the extracted pages (with outline and properties) of a content hash (the caller commits)."""
+    if not content_hash: return
+    cache_conn.execute("DELETE FROM cached_pages WHERE content_hash = ?", (content_hash,))
+    cache_conn.executemany("INSERT INTO cached_pages (content_hash, page_number, text) VALUES (?, ?, ?)",
+                           [(content_hash, page_number, zlib.compress(text.encode('utf-8', 'surrogatepass'), TEXT_CACHE_COMPRESSION))
+                            for page_number, text in pages])
+    cache_conn.execute("INSERT OR REPLACE INTO cached_files (content_hash, page_count, cached, outline, properties) VALUES (?, ?, ?, ?, ?)",
+                       (content_hash, len(pages), time.time(), json.dumps(outline) if outline else None,
+                        json.dumps(properties) if properties else None))
+
+def extract_cached(cache_conn, content_hash, doc_id, filepath, file_timeout=EXTRACT_FILE_TIMEOUT, page_timeout=EXTRACT_PAGE_TIMEOUT,
+                   extract=None):
+    """
+    extract_document_text() that reads from / fills the text cache (cache_conn may be None);
+    large TXT files are streamed. Extracts in-process, or with extract(doc_id, filepath)
+    if given (watch mode: extract_in_worker).
+    """
+    if is_streamed_text(filepath): return streamed_text_result(doc_id, filepath)
+    result = read_cached_result(cache_conn, content_hash, doc_id, filepath) if cache_conn else None
+    if result is not None: return result
+    result = extract(doc_id, filepath) if extract else extract_document_text(doc_id, filepath, None, file_timeout, page_timeout)
+    if cache_conn and not result['error']: store_cached_pages(cache_conn, content_hash, result['pages'], result['outline'], result['properties'])
+    return result
+
+def prune_text_cache(db_path=None):
+    """Drops cached text whose content hash no document has any more. Returns the number of files dropped."""
+    cache_conn = open_text_cache(db_path)
+    try:
+        cache_conn.execute("ATTACH DATABASE ? AS idx", (db_path or DATABASE_FILE,))
+        live = "SELECT content_hash FROM idx.documents WHERE content_hash IS NOT NULL"
+        cache_conn.execute(f"DELETE FROM cached_pages WHERE content_hash NOT IN ({live})")
+        removed = cache_conn.execute(f"DELETE FROM cached_files WHERE content_hash NOT IN ({live})").rowcount
+        cache_conn.commit()
+        return removed
+    finally:
+        cache_conn.close()
+
+# --- Thumbnail Cache ---
+def get_thumbnail_cache_path(db_path=None):
+    """Path of the thumbnail cache belonging to an index database."""
+    return os.path.splitext(db_path or DATABASE_FILE)[0] + THUMBNAIL_CACHE_SUFFIX
+
+def open_thumbnail_cache(db_path=None):
+    """Opens the thumbnail cache of an index database, creating it if needed. Returns the connection."""
+    conn = sqlite3.connect(get_thumbnail_cache_path(db_path), timeout=30)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL") # Only takes effect on a new file; lets evictions shrink it
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS thumbnails (
+            content_hash TEXT NOT NULL,
+            page_number INTEGER NOT NULL,
+            image BLOB NOT NULL, -- PNG
+            last_used REAL NOT NULL, -- Stored or last shown; oldest are evicted first
+            PRIMARY KEY (content_hash, page_number)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_thumbnails_last_used ON thumbnails (last_used)")
+    conn.commit()
+    return conn
+
+def store_thumbnails(cache_conn, content_hash, thumbnails):
+    """Caches the [(page_number, png), ...] thumbnails of a content hash (the caller commits)."""
+    if not content_hash or not thumbnails: return
+    cache_conn.execute("DELETE FROM thumbnails WHERE content_hash = ?", (content_hash,))
+    now = time.time()
+    cache_conn.executemany("INSERT INTO thumbnails (content_hash, page_number, image, last_used) VALUES (?, ?, ?, ?)",
+                           [(content_hash, page_number, image, now) for page_number, image in thumbnails])
+
+def has_thumbnails(cache_conn, content_hash):
+    """True if any thumbnail of a content hash is cached."""
+    return cache_conn.execute("SELECT 1 FROM thumbnails WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone() is not None
+
+def thumbnail_cache_bytes(cache_conn):
+    """Total size of the cached images."""
+    return cache_conn.execute("SELECT COALESCE(SUM(length(image)), 0) FROM thumbnails").fetchone()[0]
+
+def evict_thumbnails(cache_conn, max_bytes):
+    """Drops least recently used thumbnails until the images fit in max_bytes, and commits. Returns the number dropped."""
+    total = thumbnail_cache_bytes(cache_conn)
+    victims = []
+    if total > max_bytes:
+        for content_hash, page_number, size in cache_conn.execute(
+                "SELECT content_hash, page_number, length(image) FROM thumbnails ORDER BY last_used"):
+            if total <= max_bytes: break
+            victims.append((content_hash, page_number))
+            total -= size
+        cache_conn.executemany("DELETE FROM thumbnails WHERE content_hash = ? AND page_number = ?", victims)
+    cache_conn.commit()
+    if victims: cache_conn.execute("PRAGMA incremental_vacuum").fetchall()
+    return len(victims)
+
+def get_thumbnail(doc_id, page_number=0, db_path=None):
+    """Cached PNG thumbnail of a document page, or None. Marks it as recently used."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        row = conn.execute("SELECT content_hash FROM documents WHERE id = ?", (doc_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0] or not os.path.exists(get_thumbnail_cache_path(db_path)): return None
+    cache_conn = open_thumbnail_cache(db_path)
+    image = None
+    try:
+        image = cache_conn.execute("SELECT image FROM thumbnails WHERE content_hash = ? AND page_number = ?", (row[0], page_number)).fetchone()
+        if image is None: return None
+        cache_conn.execute("UPDATE thumbnails SET last_used = ? WHERE content_hash = ? AND page_number = ?", (time.time(), row[0], page_number))
+        cache_conn.commit()
+        return image[0]
+    except sqlite3.Error as e: # E.g. locked by a scan: showing the preview matters more than its LRU position
+        print(f"Thumbnail cache error for doc {doc_id}: {e}")
+        return image[0] if image else None
+    finally:
+        cache_conn.close()
+
+def generate_thumbnails(db_path=None, mode=THUMBNAILS_FIRST_PAGE, max_mb=THUMBNAIL_CACHE_MB, status_callback=None,
+                        workers=0, pool=None, file_timeout=EXTRACT_FILE_TIMEOUT, page_timeout=EXTRACT_PAGE_TIMEOUT, skip_hashes=()):
+    """
+    Brings the thumbnail cache up to date: drops thumbnails no document uses any more,
+    renders the PDFs that have none while the cache is below max_mb, then evicts least
+    recently used thumbnails down to max_mb. Filling stops at the limit instead of
+    evicting, so a library larger than the cache is not re-rendered on every scan.
+
+    Rendering runs in pool (e.g. the scan's) or else in a pool of workers processes
+    (workers <= 0: in-process, budgets only checked between pages), so a PDF over
+    file_timeout or page_timeout has its worker killed and counts as an error.
+    Quarantined files and content hashes in skip_hashes (tried already, e.g. by the
+    scan's workers) are not rendered. Returns {'rendered', 'errors', 'evicted', 'pruned', 'bytes', 'duration'}.
+    """
+    report = status_callback or (lambda message: None)
+    start_time = time.time()
+    stats = {'rendered': 0, 'errors': 0, 'evicted': 0, 'pruned': 0, 'bytes': 0, 'duration': 0}
+    max_bytes = max_mb * 1024 * 1024
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        documents = conn.execute("SELECT id, filepath, content_hash FROM documents WHERE content_hash IS NOT NULL "
+                                 "AND lower(filepath) LIKE '%.pdf' AND filepath NOT IN (SELECT filepath FROM quarantine) "
+                                 "AND content_hash NOT IN (SELECT content_hash FROM quarantine WHERE content_hash IS NOT NULL) "
+                                 "ORDER BY filepath").fetchall()
+    finally:
+        conn.close()
+    cache_conn = open_thumbnail_cache(db_path)
+    own_pool = None
+    try:
+        cache_conn.execute("ATTACH DATABASE ? AS idx", (db_path or DATABASE_FILE,))
+        stats['pruned'] = cache_conn.execute("DELETE FROM thumbnails WHERE content_hash NOT IN "
+                                             "(SELECT content_hash FROM idx.documents WHERE content_hash IS NOT NULL)").rowcount
+        cache_conn.commit()
+        cache_conn.execute("DETACH DATABASE idx")
+        total = thumbnail_cache_bytes(cache_conn)
+        tried = set(skip_hashes)
+        pending = deque()
+        for doc_id, filepath, content_hash in documents:
+            if content_hash in tried or has_thumbnails(cache_conn, content_hash): continue
+            tried.add(content_hash) # Copies share the thumbnails of their content
+            pending.append({'filepath': filepath, 'hash': content_hash, 'text': False})
+
+        def finish(item):
+            nonlocal total
+            thumbnails = item['result'].get('thumbnails')
+            if item['result']['error'] or not thumbnails:
+                print(f"[Thumbnails] Could not render {item['filepath']}: {item['result']['error'] or 'no thumbnails'}")
+                stats['errors'] += 1
+                return
+            store_thumbnails(cache_conn, item['hash'], thumbnails)
+            total += sum(len(image) for page_number, image in thumbnails)
+            stats['rendered'] += 1
+            if stats['rendered'] % 100 == 0:
+                report({'type': 'progress', 'count': stats['rendered']})
+                cache_conn.commit()
+
+        if FITZ_ENABLED and mode and pending:
+            if pool is None: pool = own_pool = create_extraction_pool(workers)
+            if pool is None:
+                while pending and total < max_bytes:
+                    item = pending.popleft()
+                    item['result'] = extract_document_text(None, item['filepath'], None, file_timeout, page_timeout, mode, text=False)
+                    finish(item)
+            else:
+                while True:
+                    while pending and total < max_bytes and submit_extraction(pool, pending[0], mode): pending.popleft()
+                    if all(worker['job'] is None for worker in pool['workers']): break
+                    for item in collect_extractions(pool, 0.2, file_timeout, page_timeout): finish(item)
+        stats['evicted'] = evict_thumbnails(cache_conn, max_bytes)
+        stats['bytes'] = thumbnail_cache_bytes(cache_conn)
+    finally:
+        if own_pool is not None: shutdown_extraction_pool(own_pool)
+        cache_conn.close()
+    stats['duration'] = time.time() - start_time
+    return stats
+
+def get_document_pages(doc_id, db_path=None):
+    """Cached [(page_number, text), ...] of a document, or None if its text is not cached."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        row = conn.execute("SELECT content_hash FROM documents WHERE id = ?", (doc_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0] or not os.path.exists(get_text_cache_path(db_path)): return None
+    cache_conn = open_text_cache(db_path)
+    try:
+        return read_cached_pages(cache_conn, row[0])
+    finally:
+        cache_conn.close()
+
+def get_document_properties(doc_id, db_path=None):
+    """Properties recorded for a document at extraction ({'page_count', 'title', 'author', 'producer', 'created'}), or None."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        row = conn.execute(f"SELECT {', '.join(DOCUMENT_PROPERTY_FIELDS)} FROM document_properties "
+                           f"WHERE doc_id = (SELECT COALESCE(text_doc_id, id) FROM documents WHERE id = ?)", (doc_id,)).fetchone()
+        return dict(zip(DOCUMENT_PROPERTY_FIELDS, row)) if row else None
+    except sqlite3.Error as e:
+        print(f"Database error getting properties for doc {doc_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_document_locations(doc_id, db_path=None):
+    """Paths of all indexed copies of a document's content (same content hash), the document itself included."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT d.filepath FROM documents d JOIN documents self ON d.content_hash = self.content_hash WHERE self.id = ? ORDER BY d.filepath",
+            (doc_id,))] or [row[0] for row in conn.execute("SELECT filepath FROM documents WHERE id = ?", (doc_id,))]
+    except sqlite3.Error as e:
+        print(f"Database error getting locations for doc {doc_id}: {e}")
+        return []
+    finally:
+        conn.close()
+
+def get_document_outline(doc_id, db_path=None):
+    """Headings recorded for a document at extraction: [(level, title, page_number), ...] in document order."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        return conn.execute("SELECT level, title, page_number FROM document_outline "
+                            "WHERE doc_id = (SELECT COALESCE(text_doc_id, id) FROM documents WHERE id = ?) ORDER BY position", (doc_id,)).fetchall()
+    except sqlite3.Error as e:
+        print(f"Database error getting outline for doc {doc_id}: {e}")
+        return []
+    finally:
+        conn.close()
+
+def format_cache_hits(stats):
+    """Formats the text cache hit rate of scan stats, e.g. '120 of 150 files from cache (80%)'."""
+    hits, lookups = stats['text_cache_hits'], stats['text_cache_lookups']
+    return f"{hits} of {lookups} files from cache ({hits / lookups:.0%})" if lookups else "no lookups"
+
+def rebuild_fts(db_path=None, status_callback=None):
+    """
+    Rebuilds the page text and documents_fts from scratch (e.g. after a tokenizer change or corruption),
+    reading text from the text cache and extracting (in-process) only files that are
+    not cached; identical copies share one text. Returns {'documents', 'pages', 'cache_hits',
+    'extracted', 'errors', 'duplicates', 'duration'}.
+    """
+    report = status_callback or (lambda message: None)
+    start_time = time.time()
+    stats = {'documents': 0, 'pages': 0, 'cache_hits': 0, 'extracted': 0, 'errors': 0, 'duplicates': 0, 'duration': 0}
+    conn = connect_index(db_path)
+    cache_conn = open_text_cache(db_path)
+    cursor = conn.cursor()
+    page_buffer = []
+    try:
+        documents = cursor.execute("SELECT id, filepath, content_hash FROM documents ORDER BY id").fetchall()
+        quarantined_hashes = {row[0] for row in cursor.execute("SELECT content_hash FROM quarantine WHERE content_hash IS NOT NULL")}
+        # Empty the index in one step (it may be the broken part), then the pages without per-row deletes
+        cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('delete-all')")
+        cursor.execute("DROP TRIGGER IF EXISTS pages_ad_trigger")
+        if has_page_code_index(cursor):
+            cursor.execute("INSERT INTO pages_code_fts (pages_code_fts) VALUES ('delete-all')")
+            cursor.execute("DROP TRIGGER IF EXISTS pages_code_ad_trigger")
+        cursor.execute("DELETE FROM pages")
+        create_pages_triggers(cursor)
+        cursor.execute("DELETE FROM document_outline")
+        cursor.execute("DELETE FROM document_properties")
+        cursor.execute("UPDATE documents SET text_doc_id = NULL")
+        text_owners = {} # content_hash -> doc_id holding its text: identical copies are not extracted again
+        for doc_id, filepath, content_hash in documents:
+            if is_archive(filepath) or not can_extract(filepath) or content_hash in quarantined_hashes: continue # Archives: their members have the text
+            if content_hash in text_owners:
+                cursor.execute("UPDATE documents SET text_doc_id = ? WHERE id = ?", (text_owners[content_hash], doc_id))
+                stats['duplicates'] += 1
+                continue
+            stats['documents'] += 1
+            if stats['documents'] % 100 == 0:
+                report({'type': 'progress', 'count': stats['documents']})
+                cache_conn.commit()
+            result = extract_cached(cache_conn, content_hash, doc_id, filepath)
+            if result['error']:
+                print(f"[Rebuild] !!! Text/FTS error for {filepath}: {result['error']}")
+                stats['errors'] += 1
+                continue
+            stats['cache_hits' if result.get('cached') else 'extracted'] += 1
+            page_count = write_extraction_result(cursor, result, True, page_buffer)
+            stats['pages'] += page_count
+            if result['error']: # Streamed file became unreadable
+                print(f"[Rebuild] !!! Text/FTS error for {filepath}: {result['error']}")
+                stats['errors'] += 1
+            if page_count and content_hash: text_owners[content_hash] = doc_id
+        flush_fts_pages(cursor, page_buffer)
+        conn.commit()
+        cache_conn.commit()
+        optimize_fts_tables(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cache_conn.close()
+        conn.close()
+    stats['duration'] = time.time() - start_time
+    return stats
+
+def set_page_compression(db_path=None, level=PAGE_TEXT_COMPRESSION, status_callback=None):
+    """
+    Turns compression of stored page text on (zlib level 1-9) or off (0) and converts
+    the pages already stored, then VACUUMs so the file actually shrinks. Pages stored
+    with another level are left as they are. The full-text index is not touched (it
+    indexes the text, not how it is stored). Returns {'pages', 'converted',
+    'bytes_before', 'bytes_after', 'duration'}.
+    """
+    report = status_callback or (lambda message: None)
+    db_path = db_path or DATABASE_FILE
+    start_time = time.time()
+    stats = {'pages': 0, 'converted': 0, 'bytes_before': os.path.getsize(db_path), 'bytes_after': 0, 'duration': 0}
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+    try:
+        if level > 0:
+            cursor.execute("INSERT OR REPLACE INTO index_settings (name, value) VALUES ('page_compression', ?)", (str(level),))
+        else:
+            cursor.execute("DELETE FROM index_settings WHERE name = 'page_compression'")
+        # Same text, so the indexes stay as they are: no delete/insert per page
+        cursor.execute("DROP TRIGGER IF EXISTS pages_au_trigger")
+        cursor.execute("DROP TRIGGER IF EXISTS pages_code_au_trigger")
+        last_id = -1
+        while True:
+            rows = cursor.execute("SELECT id, text FROM pages WHERE id > ? ORDER BY id LIMIT ?", (last_id, PAGE_CONVERT_BATCH)).fetchall()
+            if not rows: break
+            last_id = rows[-1][0]
+            stats['pages'] += len(rows)
+            converted = []
+            for page_id, value in rows:
+                if isinstance(value, bytes) == (level > 0): continue # Already stored that way
+                new_value = compress_page_text(decompress_page_text(value), level)
+                if type(new_value) is not type(value): converted.append((new_value, page_id)) # Short pages may not shrink
+            cursor.executemany("UPDATE pages SET text = ? WHERE id = ?", converted)
+            stats['converted'] += len(converted)
+            conn.commit()
+            report({'type': 'progress', 'count': stats['pages']})
+    finally:
+        create_pages_triggers(cursor) # Also after a failure: later writes must be indexed again
+        conn.commit()
+    try:
+        report({'type': 'status', 'message': "Compacting database..."})
+        cursor.execute("VACUUM")
+    finally:
+        conn.close()
+    stats['bytes_after'] = os.path.getsize(db_path)
+    stats['duration'] = time.time() - start_time
+    return stats
+
+def set_code_index(db_path=None, enabled=True, status_callback=None):
+    """
+    Builds (or rebuilds) the optional trigram index over page text, pages_code_fts, so
+    part number queries also match inside words of the text ('0227' in 'PN-A0227-03'),
+    or drops it and VACUUMs (enabled=False). Returns {'pages', 'bytes_before',
+    'bytes_after', 'duration'}.
+    """
+    if enabled and not TRIGRAM_ENABLED:
+        raise sqlite3.NotSupportedError(f"SQLite {sqlite3.sqlite_version} has no trigram tokenizer (3.34 or later needed)")
+    report = status_callback or (lambda message: None)
+    db_path = db_path or DATABASE_FILE
+    start_time = time.time()
+    stats = {'pages': 0, 'bytes_before': os.path.getsize(db_path), 'bytes_after': 0, 'duration': 0}
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+    try:
+        stats['pages'] = cursor.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        if enabled:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages_code_fts USING fts5(text, content='page_contents', content_rowid='id', tokenize='trigram')")
+            report({'type': 'status', 'message': f"Building the part number index over {stats['pages']} pages..."})
+            cursor.execute("INSERT INTO pages_code_fts (pages_code_fts) VALUES ('rebuild')")
+            cursor.execute("INSERT INTO pages_code_fts (pages_code_fts) VALUES ('optimize')")
+            create_pages_triggers(cursor)
+            conn.commit()
+        else:
+            for trigger_name in ('pages_code_ai_trigger', 'pages_code_ad_trigger', 'pages_code_au_trigger'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+            cursor.execute("DROP TABLE IF EXISTS pages_code_fts")
+            conn.commit()
+            report({'type': 'status', 'message': "Compacting database..."})
+            cursor.execute("VACUUM")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    stats['bytes_after'] = os.path.getsize(db_path)
+    stats['duration'] = time.time() - start_time
+    return stats
+
+
+# --- Queries ---
+def get_scan_paths(db_path=None):
+    """Retrieves the list of scan paths from the database."""
+    paths = []
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT path FROM scan_paths ORDER BY path")
+        paths = [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Database error getting scan paths: {e}")
+    finally:
+        conn.close()
+    return paths
+
+def get_folder_manufacturers(db_path=None):
+    """Returns {scan path: manufacturer} of the scan paths that have a default manufacturer."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        return dict(conn.execute("SELECT path, manufacturer FROM scan_paths WHERE manufacturer IS NOT NULL"))
+    finally:
+        conn.close()
+
+def set_folder_manufacturers(folder_manufacturers, db_path=None):
+    """Stores {scan path: manufacturer or None} so watch mode and the CLI assign the same ones as the last scan."""
+    conn = sqlite3.connect(db_path or DATABASE_FILE)
+    try:
+        conn.executemany("UPDATE scan_paths SET manufacturer = ? WHERE path = ?",
+                         [(manufacturer, path) for path, manufacturer in folder_manufacturers.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+def folder_manufacturer_for(path, folder_manufacturers):
+    """Default manufacturer of the innermost scan path containing path (None if none is assigned)."""
+    containing = [scan_path for scan_path in folder_manufacturers
+                  if path == scan_path or path.startswith(scan_path.rstrip(os.sep) + os.sep)]
+    return folder_manufacturers[max(containing, key=len)] if containing else None
+
+# Result columns of search_documents: the document details, then its number of identical copies
+SEARCH_RESULT_COLUMNS = '''id, filename, filepath, manufacturer, device_model, document_type, content_hash,
+    max(1, (SELECT COUNT(*) FROM documents copies WHERE copies.content_hash = documents.content_hash))'''
+
+def collapse_duplicates(rows):
+    """Keeps the first of the SEARCH_RESULT_COLUMNS rows per content hash, dropping the hash column."""
+    seen_hashes = set()
+    collapsed = []
+    for row in rows:
+        if row[6] is not None:
+            if row[6] in seen_hashes: continue
+            seen_hashes.add(row[6])
+        collapsed.append(row[:6] + row[7:])
+    return collapsed
+
+def is_code_query(query):
+    """True if query looks like a part number or code (one token with a digit or an inner - . / #,
+    e.g. PN-A0227-03, E42, 0227) rather than prose or FTS query syntax."""
+    query = query.strip()
+    if not CODE_QUERY_PATTERN.fullmatch(query): return False
+    return any(char.isdigit() for char in query) or re.search(r'\w[-./#]\w', query) is not None
+
+def fts_phrase(text):
+    """text as one quoted FTS5 string, so its punctuation is not read as query syntax."""
+    return '"' + text.replace('"', '""') + '"'
+
+def route_fts_query(cursor, query):
+    """
+    Picks the page text index for a query: (table, text column, MATCH expression, snippet tokens).
+    Part numbers and codes go to the trigram index pages_code_fts if it is built, else to
+    documents_fts as a phrase (unquoted, 'PN-A0227-03' is an FTS syntax error); prose
+    and FTS query syntax (AND, "...", prefix*) go to documents_fts unchanged.
+    """
+    query = query.strip()
+    if not is_code_query(query): return 'documents_fts', 2, query, 15
+    if len(query) >= CODE_QUERY_MIN_LENGTH and has_page_code_index(cursor):
+        return 'pages_code_fts', 0, fts_phrase(query), CODE_SNIPPET_TOKENS
+    return 'documents_fts', 2, fts_phrase(query), 15
+
+def search_documents(query, db_path=None, raise_errors=False):
+    """
+    Searches metadata AND full-text index.
+    Returns list of document detail tuples ORDERED potentially by FTS Rank:
+    (id, filename, filepath, manufacturer, device_model, document_type, locations).
+    Identical copies (same content hash) are collapsed into their best-ranked row;
+    locations is how many indexed copies it stands for.
+    If query is empty, returns ALL documents ordered by filename.
+    Database errors are printed and give [], or are raised with raise_errors (the CLI).
+    """
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+
+    if not query:
+        # ... (return all documents logic - same as before) ...
+        try:
+            cursor.execute(f'SELECT {SEARCH_RESULT_COLUMNS} FROM documents ORDER BY filename'); results = collapse_duplicates(cursor.fetchall()); conn.close(); return results
+        except sqlite3.Error as e:
+            conn.close()
+            if raise_errors: raise
+            print(f"DB error fetching all docs: {e}"); return []
+
+    # --- Logic for non-empty query ---
+    matching_doc_ids_ranked = {} # Store ID -> rank (rank is lower for better match)
+    search_term_meta = f"%{query}%"
+    search_term_fts = query
+
+    try:
+        # 1. Metadata Search (doesn't provide rank, assign default low relevance rank)
+        # Substring match through the trigram index; LIKE scans for short queries or old SQLite
+        if len(query.strip()) >= CODE_QUERY_MIN_LENGTH and cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_code_fts'").fetchone():
+            cursor.execute("SELECT rowid FROM documents_code_fts WHERE documents_code_fts MATCH ?", (fts_phrase(query),))
+        else:
+            cursor.execute('''
+                SELECT id FROM documents
+                WHERE filename LIKE ? OR filepath LIKE ? OR manufacturer LIKE ?
+                   OR device_model LIKE ? OR document_type LIKE ? OR keywords LIKE ?
+            ''', (search_term_meta, search_term_meta, search_term_meta,
+                  search_term_meta, search_term_meta, search_term_meta))
+        for row in cursor.fetchall():
+            if row[0] not in matching_doc_ids_ranked: # Avoid overwriting potential FTS rank
+                matching_doc_ids_ranked[row[0]] = 9999 # Assign low relevance
+
+        # 2. Full-Text Search
+        try:
+            # Select doc_id and rank. Lower rank values indicate better matches in SQLite FTS5.
+            # doc_id from pages, not the index: reading it through the index would decompress every hit
+            fts_table, text_column, fts_match, snippet_tokens = route_fts_query(cursor, search_term_fts)
+            cursor.execute(f'''
+                SELECT p.doc_id, f.rank FROM {fts_table} f JOIN pages p ON p.id = f.rowid
+                WHERE {fts_table} MATCH ? ORDER BY f.rank
+            ''', (fts_match,))
+            for doc_id, rank in cursor.fetchall():
+                matching_doc_ids_ranked[doc_id] = rank # Overwrite/add with actual FTS rank
+            print(f"FTS search ({fts_table}) updated ranks for {len(matching_doc_ids_ranked)} matches.")
+
+        except sqlite3.OperationalError as fts_e:
+             print(f"FTS search failed for '{query}': {fts_e}. Searching metadata only.")
+
+    except sqlite3.Error as e:
+        conn.close()
+        if raise_errors: raise
+        print(f"Database error during search for '{query}': {e}")
+        return []
+
+    # --- Fetch details for unique matching IDs, ordered by rank then filename ---
+    if not matching_doc_ids_ranked:
+        conn.close(); return []
+
+    # Sort IDs based on rank (lower is better), then use filename as tie-breaker later
+    sorted_ids = sorted(matching_doc_ids_ranked.keys(), key=lambda doc_id: matching_doc_ids_ranked[doc_id])
+
+    try:
+         placeholders = ','.join('?' * len(sorted_ids))
+         # Preserve the rank-based order using a trick with INSTR in ORDER BY
+         # This ensures the results are returned in the desired rank order.
+         # Alternatively, fetch all then re-sort in Python using the ranks dict.
+         sql = f'''
+            SELECT {SEARCH_RESULT_COLUMNS}
+            FROM documents
+            WHERE id IN ({placeholders})
+            ORDER BY INSTR(?, ',' || id || ',') -- Order by position in sorted_ids list
+         '''
+         # Create the ordered ID string for INSTR: ",id1,id2,id3,"
+         ordered_id_string = ',' + ','.join(map(str, sorted_ids)) + ','
+         cursor.execute(sql, list(sorted_ids) + [ordered_id_string]) # Pass IDs twice for IN and INSTR
+         results = collapse_duplicates(cursor.fetchall())
+         print(f"Fetched details for {len(results)} matching documents (ranked, copies collapsed).")
+         conn.close()
+         return results
+    except sqlite3.Error as e:
+         conn.close()
+         if raise_errors: raise
+         print(f"Database error fetching final ranked results: {e}")
+         return []
+
+def search_content_snippets(query, db_path=None):
+    """
+    Full-text search for the content view: the best-ranked page of each matching
+    document with a snippet, best documents first. Returns [(doc_id, filename,
+    filepath, snippet, page_number), ...]; raises sqlite3 errors (e.g. bad FTS syntax).
+    Only the pages shown get a snippet, so only their text is read (and decompressed).
+    Part numbers are searched as substrings if pages_code_fts is built (route_fts_query).
+    """
+    conn = connect_index(db_path)
+    try:
+        fts_table, text_column, fts_match, snippet_tokens = route_fts_query(conn.cursor(), query)
+        best_pages = {} # doc_id -> (pages.id, page_number) of its best-ranked page
+        for doc_id, page_id, page_number in conn.execute(
+                f"SELECT p.doc_id, p.id, p.page_number FROM {fts_table} f JOIN pages p ON p.id = f.rowid "
+                f"WHERE {fts_table} MATCH ? ORDER BY f.rank", (fts_match,)):
+            best_pages.setdefault(doc_id, (page_id, page_number))
+        snippets = {} # pages.id -> (filename, filepath, snippet)
+        page_ids = [page_id for page_id, page_number in best_pages.values()]
+        for start in range(0, len(page_ids), SNIPPET_BATCH_SIZE): # One query per batch, not per document
+            batch = page_ids[start:start + SNIPPET_BATCH_SIZE]
+            for page_id, filename, filepath, snippet in conn.execute(
+                    f"SELECT f.rowid, d.filename, d.filepath, snippet({fts_table}, {text_column}, '[', ']', '...', {snippet_tokens}) "
+                    f"FROM {fts_table} f CROSS JOIN pages p ON p.id = f.rowid CROSS JOIN documents d ON d.id = p.doc_id " # FTS first: MATCH runs once
+                    f"WHERE {fts_table} MATCH ? AND f.rowid IN ({','.join('?' * len(batch))})", [fts_match] + batch):
+                snippets[page_id] = (filename, filepath, snippet)
+        return [(doc_id,) + snippets[page_id] + (page_number,)
+                for doc_id, (page_id, page_number) in best_pages.items() if page_id in snippets]
+    finally:
+        conn.close()
+
+
+# --- Directory Cache ---
+# dir_cache remembers each listed directory's mtime, child count and subdirectory
+# names. A directory's mtime changes when entries are added, removed or renamed in
+# it, so a directory whose mtime still matches is not listed again and its files
+# are not stat'ed; its cached subdirectories are still visited (one stat each).
+# Editing a file in place does not change its directory's mtime, so such edits are
+# missed while the cache is on; it is off by default (skip_unchanged_dirs = 0) and
+# meant for libraries whose files are only added, replaced or removed.
+DIR_MTIME_RACE_WINDOW = 2 # Seconds; a directory modified this close to the scan is not trusted
+
+def subtree_bounds(path):
+    """(low, high) such that low <= p < high holds exactly for paths p below path (SQL range scan)."""
+    prefix = path.rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+def load_dir_cache(cursor):
+    """Loads dir_cache as {path: (mtime, child_count, [subdirectory paths])}."""
+    dir_cache = {}
+    for path, mtime, child_count, subdirs in cursor.execute("SELECT path, mtime, child_count, subdirs FROM dir_cache"):
+        dir_cache[path] = (mtime, child_count, [os.path.join(path, name) for name in subdirs.split('\n') if name])
+    return dir_cache
+
+def update_dir_cache(cursor, dir_cache, dirpath, dir_mtime, child_count, subdir_paths, trusted=True):
+    """Records a freshly listed directory and forgets cached subdirectories that disappeared."""
+    cursor.execute("INSERT OR REPLACE INTO dir_cache (path, mtime, child_count, subdirs) VALUES (?, ?, ?, ?)",
+                   (dirpath, dir_mtime if trusted else None, child_count,
+                    '\n'.join(os.path.basename(path) for path in subdir_paths)))
+    cached = dir_cache.get(dirpath)
+    for gone_dir in set(cached[2] if cached else ()) - set(subdir_paths):
+        cursor.execute("DELETE FROM dir_cache WHERE path = ? OR (path >= ? AND path < ?)", (gone_dir,) + subtree_bounds(gone_dir))
+
+def walk_scan_tree(top, dir_cache, use_dir_cache=True, skip_dir=None):
+    """
+    Sorted pre-order os.scandir walk (same order as a sorted os.walk, symlinked
+    directories are not followed). Yields (dirpath, state, dir_mtime, file_entries, subdir_paths):
+      'listed'     - file_entries are os.DirEntry objects whose stat() results are reused
+      'unchanged'  - mtime matches dir_cache; not listed, cached subdirectories are still visited
+      'unreadable' - could not be listed or stat'ed; nothing below it is known
+    skip_dir(path) -> True prunes a subdirectory and its subtree.
+    """
+    try:
+        top_mtime = os.stat(top).st_mtime
+    except OSError as e:
+        print(f"[Worker] Cannot stat {top}: {e}")
+        yield top, 'unreadable', None, None, None
+        return
+    stack = [(top, top_mtime)]
+    while stack:
+        dirpath, dir_mtime = stack.pop()
+        cached = dir_cache.get(dirpath)
+        children = []
+        if use_dir_cache and cached and dir_mtime is not None and cached[0] == dir_mtime:
+            yield dirpath, 'unchanged', dir_mtime, None, None
+            for subdir in sorted(cached[2]):
+                if skip_dir and skip_dir(subdir): continue
+                try:
+                    children.append((subdir, os.stat(subdir).st_mtime))
+                except FileNotFoundError:
+                    continue # Gone: its documents are not found and get removed
+                except OSError as e:
+                    print(f"[Worker] Cannot stat {subdir}: {e}")
+                    yield subdir, 'unreadable', None, None, None
+        else:
+            try:
+                with os.scandir(dirpath) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                print(f"[Worker] Cannot list {dirpath}: {e}")
+                yield dirpath, 'unreadable', dir_mtime, None, None
+                continue
+            file_entries, subdir_entries = [], []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir: file_entries.append(entry)
+                elif not entry.is_symlink(): subdir_entries.append(entry)
+            yield dirpath, 'listed', dir_mtime, file_entries, [entry.path for entry in subdir_entries]
+            for entry in subdir_entries:
+                if skip_dir and skip_dir(entry.path): continue
+                try:
+                    subdir_mtime = entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    subdir_mtime = None # List it
+                children.append((entry.path, subdir_mtime))
+        stack.extend(reversed(children))
+
+
+# --- Scan Journal ---
+# One scan_journal row per scan run. A run that never reached 'completed' (crash,
+# sleep, dropped share) is resumed by the next scan: the walk is sorted, so every
+# directory that sorts before the last checkpointed one was already committed.
+def path_components(path):
+    """Splits a path into components; sorting by this matches the sorted os.walk order."""
+    return os.path.normpath(path).split(os.sep)
+
+def walked_before(dirpath, checkpoint_dir):
+    """True if dirpath and its whole subtree come before checkpoint_dir in the sorted walk."""
+    dir_parts, checkpoint_parts = path_components(dirpath), path_components(checkpoint_dir)
+    return dir_parts < checkpoint_parts and checkpoint_parts[:len(dir_parts)] != dir_parts
+
+def outermost_paths(paths):
+    """Sorted (path_components order) paths without the ones inside another path: each folder is walked once."""
+    roots = []
+    for path in sorted(set(paths), key=path_components):
+        parts = path_components(path)
+        if not any(parts[:len(root)] == root for root in map(path_components, roots)): roots.append(path)
+    return roots
+
+SCAN_LOCK_SUFFIX = '.scan.lock' # Next to the database: held by the process that is scanning it
+
+def acquire_scan_lock(db_path=None):
+    """
+    Locks <database>.scan.lock for this process, so another process (GUI or CLI) does not
+    take this scan's 'running' journal row for an interrupted one and scan alongside it.
+    The OS drops the lock when the process ends, so a crashed scan leaves none behind.
+    Returns the open lock file for release_scan_lock; raises RuntimeError if another
+    process holds it.
+    """
+    lock_file = open((db_path or DATABASE_FILE) + SCAN_LOCK_SUFFIX, 'a+')
+    try:
+        if fcntl: fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        try:
+            lock_file.seek(0)
+            owner = lock_file.read().strip()
+        except OSError: owner = '' # Windows: the locked byte cannot be read
+        lock_file.close()
+        raise RuntimeError(f"Another process{f' (pid {owner})' if owner else ''} is already scanning this index.")
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+def release_scan_lock(lock_file):
+    """Releases a lock taken by acquire_scan_lock."""
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.close() # Closing the file releases the lock
+
+def get_interrupted_scan(cursor):
+    """
+    Returns (scan_id, resume_dir, files_committed) of the last unfinished scan, or None.
+    Only called while holding the scan lock, so an unfinished scan is not running elsewhere.
+    """
+    cursor.execute("SELECT scan_id, resume_dir, files_committed, status FROM scan_journal ORDER BY scan_id DESC LIMIT 1")
+    row = cursor.fetchone()
+    if row is None or row[3] == 'completed': return None
+    return row[:3]
+
+
+# --- Scan Pipeline ---
+def needs_content_hash(file_stat, existing_row):
+    """False if detect_change() can decide without reading the file: same mtime and size, hash stored."""
+    if not existing_row: return True
+    doc_id, db_last_modified, db_size, db_hash = existing_row
+    return not (file_stat.st_mtime == db_last_modified and db_size in (None, file_stat.st_size) and db_hash is not None)
+
+def detect_change(filepath, file_stat, existing_row):
+    """
+    Change detection for one file; reads the file (content hash) but never the database.
+    existing_row is the stored (id, last_modified, file_size, content_hash), or None if new.
+    Returns (action, content_hash): action is 'unchanged', 'backfill' (unchanged, but the
+    row predates hashing), 'touched' (new mtime, same content), 'added' or 'updated'.
+    Raises OSError if the file cannot be read.
+    """
+    if existing_row:
+        doc_id, db_last_modified, db_size, db_hash = existing_row
+        if file_stat.st_mtime == db_last_modified and db_size in (None, file_stat.st_size): # Same mtime, new size: edited within the mtime resolution
+            if db_hash is None: return 'backfill', compute_content_hash(filepath)
+            return 'unchanged', db_hash
+    current_hash = compute_content_hash(filepath)
+    if existing_row and file_stat.st_size == db_size and current_hash == db_hash:
+        return 'touched', current_hash
+    return ('updated' if existing_row else 'added'), current_hash
+
+def write_document_row(cursor, filepath, action, file_stat, content_hash, existing_row,
+                       folder_manufacturer=None, metadata=None):
+    """Writes the documents row for a detect_change() result. Returns the row tuple now stored."""
+    current_last_modified, current_size = file_stat.st_mtime, file_stat.st_size
+    if action == 'unchanged': return existing_row
+    doc_id = existing_row[0] if existing_row else None
+    if action == 'backfill': # Row from before hashing: store the hash once
+        cursor.execute("UPDATE documents SET file_size=?, content_hash=? WHERE id=?", (current_size, content_hash, doc_id))
+        return (doc_id, current_last_modified, current_size, content_hash)
+    if action == 'touched': # Touched/copied/restored but same content: refresh mtime, skip extraction
+        cursor.execute("UPDATE documents SET last_modified=? WHERE id=?", (current_last_modified, doc_id))
+        return (doc_id, current_last_modified, current_size, content_hash)
+
+    filename = os.path.basename(split_archive_path(filepath)[1] or filepath) # Archive members: the member's name
+    extracted_metadata = metadata or extract_metadata_from_path(filepath)
+    final_manufacturer = folder_manufacturer or extracted_metadata.get('manufacturer')
+    device_model = extracted_metadata.get('device_model')
+    document_type = extracted_metadata.get('document_type')
+    if action == 'added':
+        cursor.execute('''INSERT INTO documents (filename, filepath, manufacturer, device_model, document_type, keywords, last_modified, revision_number, revision_date, status, applicable_models, associated_test_equipment, file_size, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (filename, filepath, final_manufacturer, device_model, document_type, None, current_last_modified, None, None, None, None, None, current_size, content_hash))
+        return (cursor.lastrowid, current_last_modified, current_size, content_hash)
+    cursor.execute('UPDATE documents SET filename=?, manufacturer = CASE WHEN ? IS NOT NULL THEN ? ELSE COALESCE(documents.manufacturer, ?) END, device_model=COALESCE(documents.device_model, ?), document_type=COALESCE(documents.document_type, ?), last_modified=?, file_size=?, content_hash=? WHERE id=?',
+                   (filename, folder_manufacturer, folder_manufacturer, final_manufacturer, device_model, document_type, current_last_modified, current_size, content_hash, doc_id))
+    return (doc_id, current_last_modified, current_size, content_hash)
+
+def update_document_row(cursor, filepath, file_stat, existing_row, folder_manufacturer=None):
+    """
+    detect_change + write_document_row in one step (watch mode). Returns (action, row):
+    action is 'unchanged', 'touched', 'added' or 'updated' (only the last two need text extraction).
+    """
+    action, content_hash = detect_change(filepath, file_stat, existing_row)
+    row = write_document_row(cursor, filepath, action, file_stat, content_hash, existing_row, folder_manufacturer)
+    return ('unchanged' if action == 'backfill' else action), row
+
+def write_archive_members(cursor, archive_path, result, existing_rows, folder_manufacturer=None,
+                          page_buffer=None, batch_rows=FTS_BATCH_ROWS):
+    """
+    Writes the members of an extracted archive (result['members']) as virtual documents
+    'archive!member'. existing_rows: {member path: (id, last_modified, file_size,
+    content_hash)} of the members indexed so far; members with unchanged size and hash
+    keep their row and text. Returns ({member path: row} of all members now in the
+    archive, counts {'added', 'updated', 'reindexed', 'duplicates', 'errors', 'pages'}). Rows of members that
+    are gone are left to the caller.
+    """
+    rows = {}
+    counts = {'added': 0, 'updated': 0, 'reindexed': 0, 'duplicates': 0, 'errors': 0, 'pages': 0}
+    for member in result['members']:
+        member_path = archive_path + ARCHIVE_MEMBER_SEPARATOR + member['member']
+        if member_path in rows: continue # Duplicate name in the archive: first one wins
+        existing_row = existing_rows.get(member_path)
+        if existing_row and existing_row[2] == member['file_size'] and existing_row[3] == member['content_hash']:
+            rows[member_path] = existing_row
+            continue
+        action = 'updated' if existing_row else 'added'
+        member_stat = types.SimpleNamespace(st_mtime=member['last_modified'], st_size=member['file_size'])
+        row = write_document_row(cursor, member_path, action, member_stat, member['content_hash'], existing_row, folder_manufacturer)
+        rows[member_path] = row
+        counts[action] += 1
+        if member['error']:
+            print(f"[Worker] !!! Text/FTS error for {member_path}: {member['error']}")
+            counts['errors'] += 1
+            if action == 'updated': clear_document_text(cursor, row[0])
+        else:
+            member_result = {'doc_id': row[0], 'pages': member['pages'], 'outline': member['outline'], 'properties': member['properties']}
+            written_pages = write_extraction_result(cursor, member_result, action == 'added', page_buffer, batch_rows)
+            counts['pages'] += written_pages
+            if written_pages > 0:
+                counts['reindexed'] += 1
+            elif member_result.get('duplicate_of'):
+                counts['duplicates'] += 1
+    return rows, counts
+
+def flush_fts_pages(cursor, page_buffer):
+    """Inserts all buffered (doc_id, page_number, text) rows into pages with one executemany(); the trigger indexes them."""
+    if page_buffer:
+        level = get_page_compression(cursor)
+        cursor.executemany("INSERT INTO pages (doc_id, page_number, text) VALUES (?, ?, ?)",
+                           [(doc_id, page_number, compress_page_text(text, level)) for doc_id, page_number, text in page_buffer] if level else page_buffer)
+        page_buffer.clear()
+
+def release_text(cursor, doc_id):
+    """
+    Detaches a document from the text it shares before its content is replaced: copies
+    that used its pages/outline/properties rows get them (moved to the lowest copy), and a
+    document that used a copy's text just stops pointing at it.
+    """
+    heir = cursor.execute("SELECT MIN(id) FROM documents WHERE text_doc_id = ? AND id != ?", (doc_id, doc_id)).fetchone()[0]
+    if heir is not None:
+        for table in ('pages', 'document_outline', 'document_properties'):
+            cursor.execute(f"UPDATE {table} SET doc_id = ? WHERE doc_id = ?", (heir, doc_id))
+        cursor.execute("UPDATE documents SET text_doc_id = ? WHERE text_doc_id = ? AND id != ?", (heir, doc_id, doc_id))
+    cursor.execute("UPDATE documents SET text_doc_id = NULL WHERE id = ?", (doc_id,))
+
+def clear_document_text(cursor, doc_id):
+    """
+    Drops a document's pages, outline and properties when its new content could not be
+    extracted, so searches stop finding the old text; copies sharing them keep them.
+    """
+    release_text(cursor, doc_id)
+    for table in ('pages', 'document_outline', 'document_properties'):
+        cursor.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+
+def remove_documents(cursor, doc_ids):
+    """
+    Deletes many documents at once; returns the number deleted. Each step is one
+    set-based statement over all of them instead of the delete trigger's statements per
+    document; text shared with copies that stay is handed to the lowest of them first,
+    as the trigger would.
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS removed_documents (id INTEGER PRIMARY KEY)")
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS removed_text (id INTEGER PRIMARY KEY, heir INTEGER)")
+    cursor.execute("DELETE FROM temp.removed_documents")
+    cursor.execute("DELETE FROM temp.removed_text")
+    cursor.executemany("INSERT OR IGNORE INTO temp.removed_documents (id) VALUES (?)", ((doc_id,) for doc_id in doc_ids))
+    # Text owners being removed, each with the copy that inherits its text (NULL: none left)
+    cursor.execute("""INSERT INTO temp.removed_text (id, heir)
+                      SELECT d.id, (SELECT MIN(c.id) FROM documents c WHERE c.text_doc_id = d.id AND c.id NOT IN (SELECT id FROM temp.removed_documents))
+                      FROM documents d WHERE d.id IN (SELECT id FROM temp.removed_documents) AND d.text_doc_id = d.id""")
+    if cursor.rowcount:
+        cursor.execute("DELETE FROM pages WHERE doc_id IN (SELECT id FROM temp.removed_text WHERE heir IS NULL)")
+        if cursor.execute("SELECT 1 FROM temp.removed_text WHERE heir IS NOT NULL LIMIT 1").fetchone():
+            inherited = "IN (SELECT id FROM temp.removed_text WHERE heir IS NOT NULL)"
+            heir_of = "(SELECT heir FROM temp.removed_text WHERE id = {0})"
+            for table in ('pages', 'document_outline', 'document_properties'):
+                cursor.execute(f"UPDATE {table} SET doc_id = {heir_of.format(table + '.doc_id')} WHERE doc_id {inherited}")
+            cursor.execute(f"UPDATE documents SET text_doc_id = {heir_of.format('documents.text_doc_id')} WHERE text_doc_id {inherited}")
+    # Nothing points at them any more: the trigger finds no text to hand over
+    cursor.execute("UPDATE documents SET text_doc_id = NULL WHERE id IN (SELECT id FROM temp.removed_documents)")
+    cursor.execute("DELETE FROM documents WHERE id IN (SELECT id FROM temp.removed_documents)")
+    removed = cursor.rowcount
+    cursor.execute("DELETE FROM temp.removed_documents")
+    cursor.execute("DELETE FROM temp.removed_text")
+    return removed
+
+def share_duplicate_text(cursor):
+    """
+    Points documents whose content hash already has indexed text in a lower-id document
+    at that text and drops their own copy of it. Returns the number of documents merged.
+    """
+    owner = "SELECT MIN(o.id) FROM documents o WHERE o.content_hash = documents.content_hash AND o.text_doc_id = o.id"
+    merged = cursor.execute(f"UPDATE documents SET text_doc_id = ({owner}) WHERE content_hash IS NOT NULL AND text_doc_id = id AND id > ({owner})").rowcount
+    if merged:
+        for table in ('pages', 'document_outline', 'document_properties'):
+            cursor.execute(f"DELETE FROM {table} WHERE doc_id IN (SELECT id FROM documents WHERE text_doc_id != id)")
+    return merged
+
+def write_extraction_result(cursor, result, is_new_file, page_buffer=None, batch_rows=FTS_BATCH_ROWS):
+    """
+    Single-writer step: replaces the pages (and outline and properties) of one document with extracted pages.
+    With a page_buffer (list) the pages are queued and flushed once batch_rows are
+    buffered, so pages of many documents share one executemany(); the caller must
+    flush_fts_pages() before committing. Without one they are written right away.
+
+    Text is stored once per content hash: if another document with the same hash already
+    has indexed text, this one only points at it (text_doc_id), nothing is written and
+    result['duplicate_of'] is set to that document's id.
+
+    result['pages'] may be a generator (streamed_text_result): it is read batch_rows
+    pages at a time. If reading it fails, none of the document's text is kept,
+    result['error'] is set and 0 is returned. Returns the number of pages written.
+    """
+    doc_id = result['doc_id']
+    if not is_new_file: # Drop the previous text, unless copies still use it
+        release_text(cursor, doc_id)
+        for table in ('pages', 'document_outline', 'document_properties'):
+            cursor.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+    content_hash = cursor.execute("SELECT content_hash FROM documents WHERE id = ?", (doc_id,)).fetchone()[0]
+    owner = cursor.execute("SELECT id FROM documents WHERE content_hash = ? AND text_doc_id = id AND id != ?",
+                           (content_hash, doc_id)).fetchone() if content_hash else None
+    if owner:
+        cursor.execute("UPDATE documents SET text_doc_id = ? WHERE id = ?", (owner[0], doc_id))
+        result['duplicate_of'] = owner[0]
+        return 0
+    cursor.executemany("INSERT INTO document_outline (doc_id, position, level, title, page_number) VALUES (?, ?, ?, ?, ?)",
+                       [(doc_id, position, level, title, page_number) for position, (level, title, page_number) in enumerate(result.get('outline', ()))])
+    properties = result.get('properties')
+    if properties:
+        cursor.execute(f"INSERT OR REPLACE INTO document_properties (doc_id, {', '.join(DOCUMENT_PROPERTY_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                       (doc_id,) + tuple(properties.get(field) for field in DOCUMENT_PROPERTY_FIELDS))
+    rows = [] if page_buffer is None else page_buffer
+    page_count = 0
+    try:
+        for page_number, text in result['pages']:
+            rows.append((doc_id, page_number, text))
+            page_count += 1
+            if len(rows) >= batch_rows: flush_fts_pages(cursor, rows)
+    except OSError as e: # Streamed file became unreadable part way
+        result['error'] = str(e)
+        rows[:] = [row for row in rows if row[0] != doc_id]
+        for table in ('pages', 'document_outline', 'document_properties'):
+            cursor.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+        return 0
+    if page_buffer is None: flush_fts_pages(cursor, rows)
+    if page_count: cursor.execute("UPDATE documents SET text_doc_id = id WHERE id = ?", (doc_id,))
+    return page_count
+
+
+DOCUMENT_LOOKUP_BATCH = 500 # Paths per IN (...) query (below SQLite's default variable limit)
+
+def lookup_documents(cursor, filepaths):
+    """Returns {filepath: (id, last_modified, file_size, content_hash)} of the given paths that are indexed."""
+    rows = {}
+    for start in range(0, len(filepaths), DOCUMENT_LOOKUP_BATCH):
+        batch = filepaths[start:start + DOCUMENT_LOOKUP_BATCH]
+        cursor.execute(f"SELECT filepath, id, last_modified, file_size, content_hash FROM documents WHERE filepath IN ({','.join('?' * len(batch))})", batch)
+        rows.update((row[0], row[1:]) for row in cursor.fetchall())
+    return rows
+
+def load_quarantine(cursor):
+    """Returns {filepath: content_hash} of all quarantined files."""
+    return dict(cursor.execute("SELECT filepath, content_hash FROM quarantine"))
+
+def quarantine_file(cursor, filepath, content_hash, file_size, result):
+    """Records a file whose extraction result has 'quarantine' set."""
+    print(f"[Worker] Quarantined {filepath}: {result['error']}")
+    cursor.execute("INSERT OR REPLACE INTO quarantine (filepath, content_hash, file_size, reason, duration, quarantined) VALUES (?, ?, ?, ?, ?, ?)",
+                   (filepath, content_hash, file_size, result['error'], result['duration'], time.time()))
+
+
+# --- Staged Scan Pipeline ---
+# walk -> stat -> extract -> write, each stage on its own thread (extract fans out to
+# the process pool), connected by bounded queues: a slow stage makes the ones before
+# it wait instead of buffering the whole library in memory, and a slow PDF only
+# occupies one extraction slot while discovery and writes carry on.
+PIPELINE_DONE = None # End-of-stream marker passed down the queues
+PIPELINE_STAGES = [('walk', 'folders'), ('stat', 'files'), ('extract', 'docs'), ('write', 'items')]
+WALK_QUEUE_SIZE = 32 # Listed folders waiting for the stat stage
+WRITE_QUEUE_SIZE = 256 # Items waiting for the SQLite writer
+PIPELINE_REPORT_SECONDS = 2 # How often stage throughput is reported while scanning
+SEEN_BATCH_ROWS = 1000 # Seen document ids per executemany() into the scan_seen TEMP table
+STAT_WINDOW = HASH_THREADS * 4 # Files (and folder markers) the stat stage holds while their hashes are computed
+
+def pipeline_put(target_queue, item, stop_event):
+    """Blocking put that gives up (returns False) once the pipeline is stopped."""
+    while not stop_event.is_set():
+        try:
+            target_queue.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def pipeline_get(source_queue, stop_event):
+    """Blocking get that returns PIPELINE_DONE once the pipeline is stopped."""
+    while not stop_event.is_set():
+        try:
+            return source_queue.get(timeout=0.2)
+        except queue.Empty:
+            continue
+    return PIPELINE_DONE
+
+def snapshot_stage_stats(stage_stats, queues, elapsed):
+    """Per-stage {'items', 'per_second', 'queue', 'max_queue'} for reporting."""
+    snapshot = {}
+    for name, unit in PIPELINE_STAGES:
+        stage = stage_stats[name]
+        depth = queues[name].qsize() if name in queues else 0
+        stage['max_queue'] = max(stage['max_queue'], depth)
+        snapshot[name] = {'unit': unit, 'items': stage['items'], 'per_second': stage['items'] / (elapsed or 1e-9),
+                          'queue': depth, 'max_queue': stage['max_queue']}
+    return snapshot
+
+def format_stage_stats(stages):
+    """Formats snapshot_stage_stats() output as printable lines."""
+    return [f"{name}: {stage['items']} {stage['unit']}, {stage['per_second']:.1f}/s, "
+            f"queue {stage['queue']} (max {stage['max_queue']})" for name, stage in stages.items()]
+
+def scan_and_index(scan_paths, folder_manufacturers=None, status_callback=None,
+                   workers=DEFAULT_EXTRACT_WORKERS, db_path=None,
+                   checkpoint_files=DEFAULT_CHECKPOINT_FILES, checkpoint_seconds=DEFAULT_CHECKPOINT_SECONDS,
+                   use_dir_cache=False, fts_batch_rows=FTS_BATCH_ROWS, bulk_build=None,
+                   fts_merge_pages=FTS_MERGE_PAGES, extract_file_timeout=EXTRACT_FILE_TIMEOUT,
+                   extract_page_timeout=EXTRACT_PAGE_TIMEOUT, text_cache=True,
+                   thumbnails=THUMBNAILS_OFF, thumbnail_cache_mb=THUMBNAIL_CACHE_MB):
+    """
+    Scans the given directories and incrementally updates documents and their pages (documents_fts).
+    A file whose mtime changed is only re-extracted if its size or content
+    hash changed too; otherwise just the stored mtime is refreshed ('touched').
+    With use_dir_cache, directories whose mtime is unchanged since the last scan
+    are not listed at all (see walk_scan_tree); their documents are kept as-is, so
+    files edited in place there are not seen until a scan without it.
+
+    Runs as a staged pipeline: walk (list folders) -> stat (stat, content hash on
+    HASH_THREADS threads, path metadata) -> extract (process pool, started with the first
+    file that needs extracting, or one thread when workers <= 0) -> write.
+    Only the calling thread writes to SQLite; the stat stage looks up the rows of each
+    listed folder's files on its own connection, and the rows seen or kept by the scan
+    go into a TEMP table, so no stage holds the whole documents table in memory and
+    obsolete rows are found with one anti-join at the end. The documents row of a new file
+    is inserted as soon as the stat stage sends it for extraction, so doc_ids follow walk
+    order however extractions finish (members of a new archive are numbered when the
+    archive is written); until its text is written the row has last_modified 0 and no
+    hash, so a scan resumed after an interruption extracts it again. FTS
+    pages are buffered and inserted fts_batch_rows at a time. Changed zip/tar/gz
+    archives are extracted into virtual member documents (see write_archive_members);
+    the members of unchanged archives are kept as they are.
+
+    bulk_build (None = only when the documents table is empty and no scan is being
+    resumed) drops the secondary indexes on documents and relaxes durability pragmas
+    (BULK_BUILD_PRAGMAS) for the scan; the indexes are created once at the end, then
+    the FTS index is optimized and the previous pragmas are restored. Otherwise FTS
+    segments are merged incrementally with a budget of fts_merge_pages (see
+    merge_fts_segments); the full optimize is a separate action (optimize_fts).
+
+    A file whose extraction exceeds extract_file_timeout, or a page extract_page_timeout,
+    has its worker killed (see collect_extractions) and is recorded in the quarantine
+    table, as is a file that crashed EXTRACT_CRASH_ATTEMPTS workers; files with a
+    quarantined content hash are indexed without text until they change. Workers that
+    cannot start fail the scan (RuntimeError). With workers <= 0 the budgets are only
+    checked between pages.
+
+    With text_cache, text is read from the text cache (see open_text_cache) when the
+    content hash is cached, and extracted text is added to it; entries no document
+    uses any more are pruned at the end.
+
+    With thumbnails (THUMBNAILS_FIRST_PAGE / THUMBNAILS_ALL_PAGES) the workers also
+    render thumbnails of the PDFs they extract into the thumbnail cache, and at the
+    end the same workers render PDFs that have none yet (not those tried during the
+    scan) and the cache is trimmed to thumbnail_cache_mb (see generate_thumbnails).
+
+    Every checkpoint_files changed files or checkpoint_seconds the transaction is
+    committed. If the previous scan was interrupted, directories it had already
+    finished are skipped; their rows are kept, not treated as removed (files deleted
+    there meanwhile are picked up by the next full scan).
+    Returns a stats dict (including per-stage throughput under 'stages'); raises on
+    database errors (work since the last checkpoint is rolled back and the journal
+    marks the scan as interrupted).
+    """
+    folder_manufacturers = folder_manufacturers or {}
+    report = status_callback or (lambda message: None)
+    stats = {'added': 0, 'updated': 0, 'reindexed': 0, 'touched': 0, 'removed': 0, 'errors': 0,
+             'duration': 0, 'workers': {}, 'checkpoints': 0, 'resumed': False,
+             'dirs_listed': 0, 'dirs_skipped': 0, 'stages': {}, 'bulk_build': False,
+             'fts_segments': None, 'fts_maintenance_seconds': 0, 'quarantined': 0, 'quarantine_skipped': 0,
+             'text_cache_hits': 0, 'text_cache_lookups': 0, 'thumbnails': None, 'duplicates': 0, 'pages': 0}
+    scan_start_time = time.time()
+    scan_lock = acquire_scan_lock(db_path)
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+    pool = None
+    stage_threads = []
+    stop_event = threading.Event()
+    stage_errors = []
+    scan_id = None
+    resume_dir = None # Last directory committed by the interrupted scan being resumed
+    last_completed_dir = None # Last directory (in walk order) such that it and all before it are written
+    files_committed = 0
+    changed_since_checkpoint = 0
+    last_checkpoint_time = scan_start_time
+    stage_stats = {name: {'items': 0, 'max_queue': 0} for name, unit in PIPELINE_STAGES}
+    page_buffer = [] # Extracted pages waiting for the next executemany()
+    thumbnails_tried = set() # Content hashes the extract stage rendered thumbnails of (or failed to)
+    saved_pragmas = None # Set while bulk building
+
+    def checkpoint():
+        nonlocal changed_since_checkpoint, last_checkpoint_time, files_committed
+        flush_fts_pages(cursor, page_buffer)
+        files_committed += changed_since_checkpoint
+        resume_marker = resume_dir
+        if last_completed_dir and (not resume_dir or path_components(last_completed_dir) > path_components(resume_dir)):
+            resume_marker = last_completed_dir # Revisited ancestors of resume_dir must not move it back
+        cursor.execute("UPDATE scan_journal SET resume_dir=?, files_committed=?, last_checkpoint=? WHERE scan_id=?",
+                       (resume_marker, files_committed, time.time(), scan_id))
+        conn.commit()
+        stats['checkpoints'] += 1
+        changed_since_checkpoint = 0
+        last_checkpoint_time = time.time()
+        print(f"[Worker] Checkpoint: {files_committed} changed files committed.")
+
+    def run_stage(name, body):
+        try:
+            body()
+        except Exception as e:
+            print(f"[Worker] !!! {name} stage failed: {e}")
+            stage_errors.append(e)
+            stop_event.set()
+
+    try:
+        interrupted_scan = get_interrupted_scan(cursor)
+        if bulk_build is None:
+            bulk_build = not interrupted_scan and cursor.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+        if bulk_build: # Before the first write: pragmas can't change inside a transaction
+            saved_pragmas = set_bulk_build_pragmas(cursor)
+            drop_secondary_indexes(cursor, 'documents')
+            if TRIGRAM_ENABLED: drop_documents_code_index(cursor)
+            stats['bulk_build'] = True
+            print("[Worker] Bulk build: secondary indexes deferred, durability relaxed.")
+        if interrupted_scan:
+            scan_id, resume_dir, files_committed = interrupted_scan
+            stats['resumed'] = True
+            cursor.execute("UPDATE scan_journal SET status='running' WHERE scan_id=?", (scan_id,))
+            print(f"[Worker] Resuming interrupted scan #{scan_id} after: {resume_dir or '(start)'}")
+            report({'type': 'status', 'message': f"Resuming interrupted scan ({files_committed} files already committed)..."})
+        else:
+            cursor.execute("INSERT INTO scan_journal (started, last_checkpoint, status, files_committed) VALUES (?, ?, 'running', 0)",
+                           (scan_start_time, scan_start_time))
+            scan_id = cursor.lastrowid
+        conn.commit()
+        scan_paths = outermost_paths(scan_paths) # Same order as the journal's resume_dir
+
+        # Documents seen (or kept) by this scan, and unlisted folders whose files are kept;
+        # every other row is obsolete (see "Remove obsolete entries")
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS scan_seen (id INTEGER PRIMARY KEY)")
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS scan_kept_dirs (path TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.scan_seen")
+        cursor.execute("DELETE FROM temp.scan_kept_dirs")
+        seen_buffer = [] # Seen ids waiting for the next executemany() into scan_seen
+
+        def mark_seen(doc_id):
+            seen_buffer.append((doc_id,))
+            if len(seen_buffer) >= SEEN_BATCH_ROWS: flush_seen()
+
+        def flush_seen():
+            cursor.executemany("INSERT OR IGNORE INTO temp.scan_seen (id) VALUES (?)", seen_buffer)
+            seen_buffer.clear()
+        dir_cache = load_dir_cache(cursor)
+        quarantine = load_quarantine(cursor)
+        quarantined_hashes = set(quarantine.values()) # Read by the stat stage, extended by the writer
+        skip_dir = (lambda path: walked_before(path, resume_dir)) if resume_dir else None
+        pool = create_extraction_pool(workers)
+        max_pending = max(1, workers) * MAX_PENDING_PER_WORKER
+        walk_queue = queue.Queue(maxsize=WALK_QUEUE_SIZE)
+        extract_queue = queue.Queue(maxsize=max_pending)
+        write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        queues = {'stat': walk_queue, 'extract': extract_queue, 'write': write_queue} # Input queue of each stage
+        report({'type': 'status', 'message': f"Starting incremental scan ({max(workers, 0) or 'no'} extraction workers)..."})
+        print(f"[Worker] Starting incremental scan with {workers} extraction workers...")
+
+        # --- Stage 1: walk (list folders) ---
+        def walk_stage():
+            for directory in scan_paths:
+                if resume_dir and walked_before(directory, resume_dir):
+                    print(f"[Worker] Skipping (done before interruption): {directory}")
+                    continue
+                if not os.path.isdir(directory):
+                    print(f"[Worker] Skipping inaccessible path: {directory}")
+                    report({'type': 'status', 'message': f"Skipping: {directory[:50]}..."})
+                    continue
+                print(f"[Worker] Scanning: {directory}...")
+                report({'type': 'status', 'message': f"Scanning: {directory[:50]}..."})
+                for root_dir, dir_state, dir_mtime, file_entries, subdir_paths in walk_scan_tree(
+                        directory, dir_cache, use_dir_cache, skip_dir):
+                    stage_stats['walk']['items'] += 1
+                    dir_item = {'dir': root_dir, 'state': dir_state, 'mtime': dir_mtime, 'entries': file_entries,
+                                'subdirs': subdir_paths, 'manufacturer': folder_manufacturers.get(directory)}
+                    if not pipeline_put(walk_queue, dir_item, stop_event): return
+            pipeline_put(walk_queue, PIPELINE_DONE, stop_event)
+
+        # --- Stage 2: stat (stat, content hash, path metadata) ---
+        def stat_stage():
+            # Own connection: short reads between the writer's commits (rollback journal, no WAL)
+            lookup_conn = sqlite3.connect(db_path or DATABASE_FILE, timeout=30)
+            try:
+                stat_loop(lookup_conn.cursor())
+            finally:
+                lookup_conn.close()
+
+        def stat_loop(lookup_cursor):
+            files_seen = 0
+            # Items in walk order; a file waits here until its content hash is computed (on
+            # HASH_THREADS threads), so the hashes of up to STAT_WINDOW files are read at once
+            outbox = deque()
+
+            def route_file(item, change): # Sends a file on once its hash is known: to the writer, or for extraction
+                try:
+                    item['action'], item['hash'] = change.result()
+                except OSError as e:
+                    print(f"[Worker] OS Error processing file {item['filepath']}: {e}")
+                    item['kind'] = 'file_error'
+                    return pipeline_put(write_queue, item, stop_event)
+                target_queue = write_queue
+                if item['action'] in ('added', 'updated'):
+                    filepath = item['filepath']
+                    item['metadata'] = extract_metadata_from_path(filepath)
+                    if item['hash'] in quarantined_hashes:
+                        item['quarantined'] = True # Same content timed out before: no text
+                    elif is_streamed_text(filepath, item['stat'].st_size):
+                        item['result'] = streamed_text_result(None, filepath) # The writer reads it
+                    elif can_extract(filepath):
+                        target_queue = extract_queue
+                        if item['action'] == 'added' and not pipeline_put(write_queue, dict(item, kind='reserve'), stop_event): return False
+                return pipeline_put(target_queue, item, stop_event)
+
+            def drain(limit):
+                while len(outbox) > limit:
+                    target_queue, item, change = outbox.popleft()
+                    if not (route_file(item, change) if change else pipeline_put(target_queue, item, stop_event)): return False
+                return True
+
+            hash_pool = concurrent.futures.ThreadPoolExecutor(HASH_THREADS, thread_name_prefix='scan-hash')
+            try:
+                while True:
+                    dir_item = pipeline_get(walk_queue, stop_event)
+                    if dir_item is PIPELINE_DONE: break
+                    root_dir = dir_item['dir']
+                    file_count = 0
+                    outbox.append((write_queue, dict(dir_item, kind='dir_start', entries=None), None))
+                    if dir_item['state'] == 'listed':
+                        report({'type': 'status', 'message': f"Scanning: ...{os.path.basename(root_dir)}"})
+                        entries = [entry for entry in dir_item['entries'] if is_supported_file(entry.name)]
+                        existing_rows = lookup_documents(lookup_cursor, [entry.path for entry in entries])
+                        files_seen += len(dir_item['entries']) - len(entries)
+                        for entry in entries:
+                            files_seen += 1
+                            if files_seen % 100 == 0: report({'type': 'progress', 'count': files_seen})
+                            filepath = entry.path
+                            item = {'kind': 'file', 'dir': root_dir, 'filepath': filepath,
+                                    'existing': existing_rows.get(filepath), 'manufacturer': dir_item['manufacturer']}
+                            try:
+                                item['stat'] = entry.stat() # Cached by scandir on Windows
+                                if needs_content_hash(item['stat'], item['existing']):
+                                    change = hash_pool.submit(detect_change, filepath, item['stat'], item['existing'])
+                                else:
+                                    change = concurrent.futures.Future()
+                                    change.set_result(detect_change(filepath, item['stat'], item['existing']))
+                                outbox.append((None, item, change))
+                            except OSError as e:
+                                print(f"[Worker] OS Error processing file {filepath}: {e}")
+                                item['kind'] = 'file_error'
+                                outbox.append((write_queue, item, None))
+                            stage_stats['stat']['items'] += 1
+                            file_count += 1
+                            if not drain(STAT_WINDOW): return
+                    outbox.append((write_queue, {'kind': 'dir_end', 'dir': root_dir, 'file_count': file_count}, None))
+                    if not drain(STAT_WINDOW): return
+                if not drain(0): return
+            finally: # Stopped early: hashes not started yet are dropped
+                for target_queue, item, change in outbox:
+                    if change: change.cancel()
+                hash_pool.shutdown()
+            pipeline_put(extract_queue, PIPELINE_DONE, stop_event)
+
+        # --- Stage 3: extract (text cache, then worker processes or this thread without a pool) ---
+        def extract_stage():
+            cache_conn = open_text_cache(db_path) if text_cache else None # Only this thread uses the caches
+            thumb_conn = open_thumbnail_cache(db_path) if thumbnails else None
+            try:
+                extract_loop(cache_conn, thumb_conn)
+                if cache_conn: cache_conn.commit()
+                if thumb_conn: thumb_conn.commit()
+            finally:
+                if cache_conn: cache_conn.close()
+                if thumb_conn: thumb_conn.close()
+
+        def extract_loop(cache_conn, thumb_conn):
+            input_done = False
+            uncommitted = 0 # Files added to the text cache since its last commit
+
+            def finish(item):
+                nonlocal uncommitted
+                stage_stats['extract']['items'] += 1
+                result = item['result']
+                if thumb_conn:
+                    for thumbnail_source in result.get('members', [result]):
+                        thumbnail_hash = thumbnail_source.get('content_hash', item['hash'])
+                        if not result.get('cached'): thumbnails_tried.add(thumbnail_hash) # Rendered or failed: not again after the scan
+                        store_thumbnails(thumb_conn, thumbnail_hash, thumbnail_source.get('thumbnails'))
+                    if stage_stats['extract']['items'] % TEXT_CACHE_COMMIT_FILES == 0: thumb_conn.commit()
+                if cache_conn and not result['error'] and not result.get('cached'):
+                    if 'members' in result:
+                        for member in result['members']:
+                            if not member['error']: store_cached_pages(cache_conn, member['content_hash'], member['pages'], member['outline'], member['properties'])
+                    else:
+                        store_cached_pages(cache_conn, item['hash'], result['pages'], result['outline'], result['properties'])
+                    uncommitted += 1
+                    if uncommitted >= TEXT_CACHE_COMMIT_FILES:
+                        cache_conn.commit()
+                        uncommitted = 0
+                return pipeline_put(write_queue, item, stop_event)
+
+            while not stop_event.is_set():
+                idle = pool is None or not pool['workers'] or any(worker['job'] is None for worker in pool['workers'])
+                if pool is not None:
+                    for item in collect_extractions(pool, 0.2 if input_done or not idle else 0,
+                                                    extract_file_timeout, extract_page_timeout):
+                        if not finish(item): return
+                    busy = not all(worker['job'] is None for worker in pool['workers'])
+                    if input_done and not busy: break
+                    if input_done or not idle: continue # Wait for a worker
+                elif input_done: break
+                try:
+                    item = extract_queue.get(timeout=0.05 if pool is not None and busy else 0.2)
+                except queue.Empty:
+                    continue
+                if item is PIPELINE_DONE:
+                    input_done = True
+                    continue
+                needs_thumbnails = (thumb_conn is not None and item['filepath'].lower().endswith('.pdf')
+                                    and not has_thumbnails(thumb_conn, item['hash']))
+                if cache_conn and not is_archive(item['filepath']) and not needs_thumbnails: # Archives: their members are cached instead
+                    stats['text_cache_lookups'] += 1
+                    cached_result = read_cached_result(cache_conn, item['hash'], None, item['filepath'])
+                    if cached_result is not None: # Cache hit: the file itself is not read
+                        stats['text_cache_hits'] += 1
+                        item['result'] = cached_result
+                        if not finish(item): return
+                        continue
+                if pool is None:
+                    item['result'] = extract_document_text(None, item['filepath'], None, extract_file_timeout, extract_page_timeout, thumbnails)
+                    if not finish(item): return
+                else:
+                    submit_extraction(pool, item, thumbnails)
+            pipeline_put(write_queue, PIPELINE_DONE, stop_event)
+
+        for name, body in [('walk', walk_stage), ('stat', stat_stage), ('extract', extract_stage)]:
+            thread = threading.Thread(target=run_stage, args=(name, body), name=f"scan-{name}", daemon=True)
+            thread.start()
+            stage_threads.append(thread)
+
+        # --- Stage 4: write (this thread is the only SQLite writer) ---
+        dir_order = deque() # Folders in walk order, until all their files are written
+        dir_progress = {} # folder -> {'state', 'mtime', 'subdirs', 'written', 'expected', 'trusted'}
+        reserved_rows = {} # filepath -> row inserted for a new file still being extracted
+        last_report_time = time.time()
+        while True:
+            item = pipeline_get(write_queue, stop_event)
+            if item is PIPELINE_DONE: break
+            kind = item['kind']
+            if kind == 'dir_start':
+                root_dir = item['dir']
+                dir_order.append(root_dir)
+                dir_progress[root_dir] = {'state': item['state'], 'mtime': item['mtime'], 'subdirs': item['subdirs'],
+                                          'written': 0, 'expected': None, 'trusted': True}
+                if item['state'] == 'listed':
+                    stats['dirs_listed'] += 1
+                else:
+                    # Not listed: keep its documents (and, if unreadable, everything below it)
+                    cursor.execute("INSERT OR IGNORE INTO temp.scan_kept_dirs (path) VALUES (?)", (root_dir,))
+                    if item['state'] == 'unreadable':
+                        cursor.execute("INSERT OR IGNORE INTO temp.scan_seen (id) SELECT id FROM documents WHERE filepath >= ? AND filepath < ?",
+                                       subtree_bounds(root_dir))
+                    else: stats['dirs_skipped'] += 1
+            elif kind == 'dir_end':
+                dir_progress[item['dir']]['expected'] = item['file_count']
+            elif kind == 'reserve': # New file sent for extraction: insert its row now, in walk order
+                row = write_document_row(cursor, item['filepath'], 'added', types.SimpleNamespace(st_mtime=0, st_size=item['stat'].st_size),
+                                         None, None, item['manufacturer'], item.get('metadata'))
+                reserved_rows[item['filepath']] = row
+                mark_seen(row[0])
+            else:
+                filepath, existing_row = item['filepath'], item['existing']
+                if kind == 'file_error':
+                    if existing_row: mark_seen(existing_row[0]) # Keep the row; retry next scan
+                    dir_progress[item['dir']]['trusted'] = False
+                else:
+                    action = item['action']
+                    row = reserved_rows.pop(filepath, None)
+                    if row: # Inserted by its 'reserve' item; now it gets its real mtime and hash
+                        row = (row[0], item['stat'].st_mtime, item['stat'].st_size, item['hash'])
+                        cursor.execute("UPDATE documents SET last_modified=?, file_size=?, content_hash=? WHERE id=?", row[1:] + row[:1])
+                    else:
+                        row = write_document_row(cursor, filepath, action, item['stat'], item['hash'], existing_row,
+                                                 item['manufacturer'], item.get('metadata'))
+                    mark_seen(row[0])
+                    if action in ('added', 'updated', 'touched'):
+                        stats[action] += 1
+                        changed_since_checkpoint += 1
+                    if 'result' in item:
+                        result = item['result']
+                        result['doc_id'] = row[0]
+                        if result['worker'] is not None: record_worker_stats(stats['workers'], result) # Not cached or streamed
+                        if result['error']:
+                            print(f"[Worker] !!! Text/FTS error for {filepath}: {result['error']}")
+                            stats['errors'] += 1
+                            if action == 'updated': clear_document_text(cursor, row[0]) # Old text no longer matches the file
+                            if result['quarantine']:
+                                quarantine_file(cursor, filepath, item['hash'], item['stat'].st_size, result)
+                                quarantine[filepath] = item['hash']
+                                quarantined_hashes.add(item['hash'])
+                                stats['quarantined'] += 1
+                        else:
+                            if quarantine.pop(filepath, None) is not None: # Changed content extracted fine
+                                cursor.execute("DELETE FROM quarantine WHERE filepath = ?", (filepath,))
+                            if 'members' in result:
+                                cursor.execute("SELECT filepath, id, last_modified, file_size, content_hash FROM documents WHERE filepath >= ? AND filepath < ?",
+                                               archive_member_bounds(filepath))
+                                member_rows, counts = write_archive_members(
+                                    cursor, filepath, result, {row[0]: row[1:] for row in cursor.fetchall()},
+                                    item['manufacturer'], page_buffer, fts_batch_rows)
+                                for member_row in member_rows.values(): mark_seen(member_row[0])
+                                for key, count in counts.items(): stats[key] += count
+                                changed_since_checkpoint += counts['added'] + counts['updated']
+                            else:
+                                written_pages = write_extraction_result(cursor, result, action == 'added', page_buffer, fts_batch_rows)
+                                stats['pages'] += written_pages
+                                if written_pages > 0:
+                                    stats['reindexed'] += 1
+                                elif result.get('duplicate_of'):
+                                    stats['duplicates'] += 1
+                                elif result['error']: # Streamed file became unreadable
+                                    print(f"[Worker] !!! Text/FTS error for {filepath}: {result['error']}")
+                                    stats['errors'] += 1
+                    elif action == 'updated': # No extractor for this type (any more), or quarantined content
+                        clear_document_text(cursor, row[0])
+                    if item.get('quarantined'): stats['quarantine_skipped'] += 1
+                if is_archive(filepath) and 'members' not in item.get('result', {}):
+                    # Archive not (successfully) re-read: its indexed members stay as they are
+                    cursor.execute("INSERT OR IGNORE INTO temp.scan_seen (id) SELECT id FROM documents WHERE filepath >= ? AND filepath < ?",
+                                   archive_member_bounds(filepath))
+                dir_progress[item['dir']]['written'] += 1
+            stage_stats['write']['items'] += 1
+
+            # Folders whose files are all written: record them in dir_cache, advance the resume point
+            while dir_order and dir_progress[dir_order[0]]['expected'] == dir_progress[dir_order[0]]['written']:
+                root_dir = dir_order.popleft()
+                progress = dir_progress.pop(root_dir)
+                if progress['state'] == 'listed':
+                    # Only trust the mtime if every file made it in and the directory was not changing mid-scan
+                    update_dir_cache(cursor, dir_cache, root_dir, progress['mtime'], progress['written'] + len(progress['subdirs']), progress['subdirs'],
+                                     trusted=progress['trusted'] and progress['mtime'] is not None and progress['mtime'] < scan_start_time - DIR_MTIME_RACE_WINDOW)
+                last_completed_dir = root_dir
+            if changed_since_checkpoint and (changed_since_checkpoint >= checkpoint_files or
+                                             time.time() - last_checkpoint_time >= checkpoint_seconds):
+                checkpoint()
+            if time.time() - last_report_time >= PIPELINE_REPORT_SECONDS:
+                last_report_time = time.time()
+                report({'type': 'pipeline', 'stages': snapshot_stage_stats(stage_stats, queues, last_report_time - scan_start_time)})
+            else:
+                for name, stage_queue in queues.items():
+                    stage_stats[name]['max_queue'] = max(stage_stats[name]['max_queue'], stage_queue.qsize())
+        if stage_errors: raise stage_errors[0]
+        flush_fts_pages(cursor, page_buffer)
+        flush_seen()
+
+        stats['duration'] = time.time() - scan_start_time
+        stats['stages'] = snapshot_stage_stats(stage_stats, queues, stats['duration'])
+        print(f"[Worker] Scan loop finished in {stats['duration']:.2f}s "
+              f"({stats['dirs_listed']} folders listed, {stats['dirs_skipped']} unchanged folders skipped).")
+        for line in format_stage_stats(stats['stages']): print(f"[Worker]   {line}")
+        for line in format_worker_stats(stats['workers']): print(f"[Worker]   {line}")
+        report({'type': 'status', 'message': "Removing obsolete entries..."})
+
+        # --- Remove obsolete entries ---
+        # Rows neither seen nor in a kept folder, collected in a TEMP table by one pass over documents
+        conn.create_function('document_dir', 1, document_dir, deterministic=True)
+        removal_filter = "id NOT IN (SELECT id FROM temp.scan_seen) AND document_dir(filepath) NOT IN (SELECT path FROM temp.scan_kept_dirs)"
+        if resume_dir: # Not walked this time: keep rows from directories done before the interruption
+            conn.create_function('walked_before_resume', 1, lambda path: walked_before(path, resume_dir), deterministic=True)
+            removal_filter += " AND NOT walked_before_resume(document_dir(filepath))"
+        cursor.execute("DROP TABLE IF EXISTS temp.scan_removed")
+        cursor.execute(f"CREATE TEMP TABLE scan_removed AS SELECT id, document_dir(filepath) AS dir FROM documents WHERE {removal_filter}")
+        if cursor.execute("SELECT 1 FROM temp.scan_removed LIMIT 1").fetchone():
+            stats['removed'] = remove_documents(cursor, (row[0] for row in conn.execute("SELECT id FROM temp.scan_removed")))
+            # Their directories must be listed again next time, or re-appearing files would be missed
+            cursor.execute("DELETE FROM dir_cache WHERE path IN (SELECT dir FROM temp.scan_removed)")
+            print(f"[Worker] Removed {stats['removed']} obsolete documents.")
+        cursor.execute("DROP TABLE temp.scan_removed")
+
+        # Quarantine entries of files no longer indexed (removed here or by watch mode)
+        cursor.execute("DELETE FROM quarantine WHERE filepath NOT IN (SELECT filepath FROM documents)")
+        cursor.execute("UPDATE scan_journal SET status='completed', finished=?, resume_dir=NULL, files_committed=? WHERE scan_id=?",
+                       (time.time(), files_committed + changed_since_checkpoint, scan_id))
+        conn.commit()
+        print("[Worker] DB commit successful.")
+        if text_cache:
+            pruned = prune_text_cache(db_path)
+            print(f"[Worker] Text cache: {format_cache_hits(stats)}; {pruned} unused entries pruned.")
+        if thumbnails:
+            report({'type': 'status', 'message': "Rendering thumbnails..."})
+            stats['thumbnails'] = generate_thumbnails(db_path, thumbnails, thumbnail_cache_mb, pool=pool, file_timeout=extract_file_timeout,
+                                                      page_timeout=extract_page_timeout, skip_hashes=thumbnails_tried)
+            print(f"[Worker] Thumbnails: {stats['thumbnails']['rendered']} rendered after the scan, "
+                  f"{stats['thumbnails']['evicted']} evicted, cache {stats['thumbnails']['bytes'] / 1024 / 1024:.1f} MB.")
+        if saved_pragmas is not None:
+            report({'type': 'status', 'message': "Building search indexes..."})
+            print("[Worker] Bulk build: creating secondary indexes...")
+            create_secondary_indexes(cursor, 'documents')
+            if TRIGRAM_ENABLED: create_documents_code_index(cursor)
+            conn.commit()
+
+        # --- FTS maintenance: full optimize after a bulk build, else a bounded merge ---
+        try:
+            maintenance_start = time.time()
+            if saved_pragmas is not None:
+                report({'type': 'status', 'message': "Optimizing index..."})
+                print("[Worker] Optimizing FTS indexes...")
+                optimize_fts_tables(cursor)
+                conn.commit()
+            elif fts_merge_pages > 0:
+                report({'type': 'status', 'message': "Merging index segments..."})
+                merge_fts_segments(conn, fts_merge_pages)
+            stats['fts_maintenance_seconds'] = time.time() - maintenance_start
+            stats['fts_segments'] = count_fts_segments(cursor)
+            print(f"[Worker] FTS maintenance took {stats['fts_maintenance_seconds']:.2f}s; {stats['fts_segments']} segments.")
+        except Exception as opt_e: print(f"[Worker] FTS maintenance error: {opt_e}")
+        return stats
+
+    except Exception:
+        conn.rollback()
+        if scan_id is not None: # Keep the journal resumable from the last checkpoint
+            try:
+                conn.execute("UPDATE scan_journal SET status='interrupted' WHERE scan_id=?", (scan_id,))
+                conn.commit()
+            except sqlite3.Error as journal_e: print(f"[Worker] Could not update scan journal: {journal_e}")
+        raise
+    finally:
+        stop_event.set() # Unblocks any stage still waiting on a queue
+        for thread in stage_threads: thread.join()
+        if pool is not None: shutdown_extraction_pool(pool)
+        if saved_pragmas is not None: # Also after a failed bulk build (init_db recreates the indexes otherwise)
+            try:
+                create_secondary_indexes(cursor, 'documents')
+                if TRIGRAM_ENABLED: create_documents_code_index(cursor)
+                conn.commit()
+                restore_pragmas(cursor, saved_pragmas)
+                print("[Worker] Bulk build: settings restored.")
+            except sqlite3.Error as restore_e: print(f"[Worker] Could not restore bulk build settings: {restore_e}")
+        conn.close()
+        release_scan_lock(scan_lock)
+
+
+# --- Watch Mode ---
+# A watcher thread reports changed paths (inotify on Linux, otherwise a polling
+# diff of directory snapshots). Paths are debounced and reindexed one at a time,
+# in-process, so new documents become searchable without a full scan.
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x040, 0x080, 0x100, 0x200
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, name length
+
+def index_file(cursor, filepath, stats, folder_manufacturer=None, text_cache=None, extract=None):
+    """
+    Indexes one file (watch mode); updates stats like scan_and_index does. text_cache:
+    open_text_cache() connection or None. extract(doc_id, filepath) extracts the text
+    (see extract_in_worker); without it the file is extracted in-process.
+    """
+    cursor.execute("SELECT id, last_modified, file_size, content_hash FROM documents WHERE filepath = ?", (filepath,))
+    action, row = update_document_row(cursor, filepath, os.stat(filepath), cursor.fetchone(), folder_manufacturer)
+    if action == 'unchanged': return
+    stats[action] += 1
+    if action == 'touched': return
+    content_hash = row[3]
+    quarantined = cursor.execute("SELECT 1 FROM quarantine WHERE content_hash = ?", (content_hash,)).fetchone()
+    if quarantined or not can_extract(filepath):
+        if action == 'updated': clear_document_text(cursor, row[0])
+        return
+    if is_archive(filepath): result = extract(row[0], filepath) if extract else extract_document_text(row[0], filepath)
+    else: result = extract_cached(text_cache, content_hash, row[0], filepath, extract=extract)
+    if result['error']:
+        print(f"[Watch] !!! Text/FTS error for {filepath}: {result['error']}")
+        stats['errors'] += 1
+        if action == 'updated': clear_document_text(cursor, row[0])
+        if result['quarantine']: quarantine_file(cursor, filepath, content_hash, row[2], result)
+        return
+    cursor.execute("DELETE FROM quarantine WHERE filepath = ?", (filepath,))
+    if 'members' not in result:
+        written_pages = write_extraction_result(cursor, result, action == 'added')
+        stats['pages'] += written_pages
+        if written_pages > 0:
+            stats['reindexed'] += 1
+        elif result.get('duplicate_of'):
+            stats['duplicates'] += 1
+        elif result['error']: # Streamed file became unreadable
+            print(f"[Watch] !!! Text/FTS error for {filepath}: {result['error']}")
+            stats['errors'] += 1
+        return
+    cursor.execute("SELECT filepath, id, last_modified, file_size, content_hash FROM documents WHERE filepath >= ? AND filepath < ?",
+                   archive_member_bounds(filepath))
+    existing_rows = {member_row[0]: member_row[1:] for member_row in cursor.fetchall()}
+    member_rows, counts = write_archive_members(cursor, filepath, result, existing_rows, folder_manufacturer)
+    for key, count in counts.items(): stats[key] += count
+    stats['removed'] += remove_documents(cursor, [existing_rows[member_path][0] for member_path in existing_rows if member_path not in member_rows])
+    if text_cache is not None:
+        for member in result['members']:
+            if not member['error']: store_cached_pages(text_cache, member['content_hash'], member['pages'], member['outline'], member['properties'])
+
+def index_path(cursor, path, text_cache=None, folder_manufacturer=None, extract=None):
+    """
+    Brings the index in line with one changed path: a file is (re)indexed, a directory
+    is indexed recursively, and documents at or below a path that no longer exists are
+    removed. folder_manufacturer is assigned as in scan_and_index; extract as in
+    index_file. Returns the counters (added, updated, reindexed, touched, removed,
+    errors) and 'failed': files of a directory that could not be read, to try again.
+    Raises sqlite3.Error, or OSError if a single file cannot be read.
+    """
+    stats = {'added': 0, 'updated': 0, 'reindexed': 0, 'touched': 0, 'removed': 0, 'errors': 0, 'duplicates': 0, 'pages': 0, 'failed': []}
+    if os.path.isdir(path):
+        found = set()
+        for root_dir, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if not is_supported_file(filename): continue
+                filepath = os.path.join(root_dir, filename)
+                try:
+                    index_file(cursor, filepath, stats, folder_manufacturer, text_cache, extract)
+                    found.add(filepath)
+                except InterruptedError: raise
+                except OSError as e:
+                    print(f"[Watch] OS Error processing file {filepath}: {e}")
+                    stats['failed'].append(filepath)
+        cursor.execute("SELECT id, filepath FROM documents WHERE filepath >= ? AND filepath < ?", subtree_bounds(path))
+        gone_ids = [doc_id for doc_id, filepath in cursor.fetchall()
+                    if split_archive_path(filepath)[0] not in found and not os.path.exists(split_archive_path(filepath)[0])]
+    elif os.path.isfile(path):
+        if is_supported_file(os.path.basename(path)): index_file(cursor, path, stats, folder_manufacturer, text_cache, extract)
+        return stats
+    else: # Deleted or moved away (file or whole directory)
+        cursor.execute("SELECT id FROM documents WHERE filepath = ? OR (filepath >= ? AND filepath < ?) OR (filepath >= ? AND filepath < ?)",
+                       (path,) + subtree_bounds(path) + archive_member_bounds(path))
+        gone_ids = [row[0] for row in cursor.fetchall()]
+    stats['removed'] += remove_documents(cursor, gone_ids)
+    return stats
+
+def inotify_watch(scan_paths, note_change, stop_event):
+    """
+    Linux inotify watcher (via ctypes; no extra dependency). One watch per directory,
+    added recursively, including directories created or moved in later; the watches of
+    a directory moved away are removed. Raises OSError if inotify
+    is unavailable or the watch limit (fs.inotify.max_user_watches) is hit at startup.
+    """
+    if not sys.platform.startswith('linux'): raise OSError("inotify is only available on Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    watches = {} # wd -> directory path
+
+    def add_tree(top):
+        for root_dir, dirs, files in os.walk(top):
+            wd = libc.inotify_add_watch(fd, os.fsencode(root_dir), INOTIFY_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch failed for {root_dir}: {os.strerror(errno)}")
+            watches[wd] = root_dir
+
+    def remove_tree(top):
+        prefix = top.rstrip(os.sep) + os.sep
+        for wd, watched_dir in list(watches.items()):
+            if watched_dir == top or watched_dir.startswith(prefix):
+                libc.inotify_rm_watch(fd, wd)
+                del watches[wd]
+
+    try:
+        for directory in scan_paths:
+            if os.path.isdir(directory): add_tree(directory)
+        print(f"[Watch] inotify watching {len(watches)} folders.")
+        while not stop_event.is_set():
+            if not select.select([fd], [], [], 0.5)[0]: continue
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + INOTIFY_EVENT_HEADER.size:offset + INOTIFY_EVENT_HEADER.size + name_length].rstrip(b'\0')
+                offset += INOTIFY_EVENT_HEADER.size + name_length
+                if mask & IN_Q_OVERFLOW: # Events were dropped: reindex everything watched
+                    for directory in scan_paths: note_change(directory)
+                    continue
+                if mask & IN_IGNORED:
+                    watches.pop(wd, None)
+                    continue
+                if wd not in watches or not name: continue
+                path = os.path.join(watches[wd], os.fsdecode(name))
+                if mask & IN_ISDIR and mask & IN_MOVED_FROM: # Its watches would report events under the old path
+                    remove_tree(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        add_tree(path)
+                    except OSError as e: print(f"[Watch] {e}")
+                note_change(path)
+    finally:
+        os.close(fd)
+
+def snapshot_directory(dirpath):
+    """Lists one directory as {name: (is_dir, mtime, size)}; None if it cannot be listed."""
+    snapshot = {}
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    snapshot[entry.name] = (True, None, None) # Subdirectories have their own snapshot
+                else:
+                    file_stat = entry.stat()
+                    snapshot[entry.name] = (False, file_stat.st_mtime, file_stat.st_size)
+    except OSError:
+        return None
+    return snapshot
+
+def polling_watch(scan_paths, note_change, stop_event, poll_interval=WATCH_POLL_INTERVAL):
+    """Fallback watcher: re-lists every directory each poll_interval and diffs the snapshots."""
+    snapshots = {} # dirpath -> snapshot
+
+    def add_tree(top):
+        for root_dir, dirs, files in os.walk(top):
+            snapshot = snapshot_directory(root_dir)
+            if snapshot is not None: snapshots[root_dir] = snapshot
+
+    def drop_tree(top):
+        for dirpath in [d for d in snapshots if d == top or d.startswith(top.rstrip(os.sep) + os.sep)]:
+            del snapshots[dirpath]
+
+    for directory in scan_paths:
+        if os.path.isdir(directory): add_tree(directory)
+    print(f"[Watch] Polling {len(snapshots)} folders every {poll_interval}s.")
+    while not stop_event.wait(poll_interval):
+        for dirpath in sorted(snapshots):
+            if stop_event.is_set(): return
+            old_snapshot = snapshots.get(dirpath)
+            if old_snapshot is None: continue # Dropped earlier in this pass
+            new_snapshot = snapshot_directory(dirpath)
+            if new_snapshot is None or new_snapshot == old_snapshot: continue # Unreadable (transient?) or unchanged
+            snapshots[dirpath] = new_snapshot
+            for name in sorted(old_snapshot.keys() | new_snapshot.keys()):
+                old_entry, new_entry = old_snapshot.get(name), new_snapshot.get(name)
+                if old_entry == new_entry: continue
+                path = os.path.join(dirpath, name)
+                if old_entry and old_entry[0]: drop_tree(path) # Directory gone or replaced
+                if new_entry and new_entry[0]: add_tree(path)
+                note_change(path)
+
+def watch_and_index(scan_paths, stop_event, status_callback=None, db_path=None, backend='auto',
+                    poll_interval=WATCH_POLL_INTERVAL, debounce_seconds=WATCH_DEBOUNCE_SECONDS, write_lock=None,
+                    text_cache=True, folder_manufacturers=None, extract_file_timeout=EXTRACT_FILE_TIMEOUT,
+                    extract_page_timeout=EXTRACT_PAGE_TIMEOUT):
+    """
+    Watch mode: runs until stop_event is set. Changed paths are collected by a
+    watcher thread ('inotify', 'poll', or 'auto' = inotify with polling fallback),
+    debounced, and reindexed one at a time with index_path, each in its own
+    transaction. write_lock (optional) serializes this with full scans in the same
+    process; each debounced batch also holds the scan lock (acquire_scan_lock), so it
+    never writes while another process scans the index, and waits as below until it is free. Extracted text goes to the text cache too (unless text_cache is False).
+    folder_manufacturers ({scan path: manufacturer}) is applied as in scan_and_index.
+    Text is extracted by one pool worker with the scan's budgets (extract_file_timeout,
+    extract_page_timeout): a file over budget is killed and quarantined. A path that
+    cannot be indexed (database or scan lock held by another writer, file unreadable) is tried
+    again after WATCH_RETRY_SECONDS, doubled each time, and given up after
+    WATCH_RETRY_ATTEMPTS attempts (the next scan picks it up).
+    Reports {'type': 'watch', 'path': ..., <counters>} for paths that changed the index
+    or were given up (errors), and {'type': 'error'} if the watcher or the worker fails.
+    """
+    report = status_callback or (lambda message: None)
+    pending_changes = {} # path -> time of the last event (or of the next retry, minus debounce_seconds)
+    failed_attempts = {} # path -> attempts that failed so far
+    changes_lock = threading.Lock()
+
+    def note_change(path):
+        if os.path.isfile(path) and not is_supported_file(os.path.basename(path)): return
+        with changes_lock: pending_changes[path] = time.time()
+
+    def run_watcher():
+        try:
+            if backend != 'poll':
+                try:
+                    inotify_watch(scan_paths, note_change, stop_event)
+                    return
+                except OSError as e:
+                    if backend == 'inotify': raise
+                    print(f"[Watch] inotify unavailable ({e}); falling back to polling.")
+            polling_watch(scan_paths, note_change, stop_event, poll_interval)
+        except Exception as e:
+            print(f"[Watch] !!! Watcher stopped: {e}")
+            report({'type': 'error', 'message': f"Folder watcher stopped:\n{e}"})
+            stop_event.set()
+
+    watcher_thread = threading.Thread(target=run_watcher, daemon=True)
+    watcher_thread.start()
+    conn = connect_index(db_path, timeout=30)
+    cursor = conn.cursor()
+    cache_conn = open_text_cache(db_path) if text_cache else None
+    pool = create_extraction_pool(1)
+    extract = lambda doc_id, filepath: extract_in_worker(pool, doc_id, filepath, extract_file_timeout, extract_page_timeout, stop_event)
+
+    def retry_later(path, error):
+        attempts = failed_attempts.get(path, 0) + 1
+        if attempts >= WATCH_RETRY_ATTEMPTS:
+            failed_attempts.pop(path, None)
+            print(f"[Watch] !!! Giving up on {path} after {attempts} attempts: {error}")
+            report({'type': 'watch', 'path': path, 'added': 0, 'updated': 0, 'touched': 0, 'removed': 0, 'errors': 1})
+            return
+        failed_attempts[path] = attempts
+        delay = WATCH_RETRY_SECONDS * 2 ** (attempts - 1)
+        print(f"[Watch] Could not index {path} ({error}); trying again in {delay}s.")
+        with changes_lock: # A newer event keeps its own (earlier) time
+            pending_changes[path] = min(pending_changes.get(path, float('inf')), time.time() + delay - debounce_seconds)
+
+    def index_settled(settled):
+        """Reindexes a debounced batch of paths; returns False if watch mode must stop."""
+        for path in settled:
+            if stop_event.is_set(): break
+            try:
+                changes = index_path(cursor, path, cache_conn, folder_manufacturer_for(path, folder_manufacturers or {}), extract)
+                conn.commit()
+                if cache_conn: cache_conn.commit()
+            except (sqlite3.Error, OSError) as e:
+                conn.rollback()
+                if cache_conn: cache_conn.rollback()
+                if not stop_event.is_set(): retry_later(path, e)
+                continue
+            except RuntimeError as e: # Extraction workers cannot start
+                conn.rollback()
+                if cache_conn: cache_conn.rollback()
+                print(f"[Watch] !!! {e}")
+                report({'type': 'error', 'message': f"Watch mode stopped:\n{e}"})
+                return False
+            failed_attempts.pop(path, None)
+            for filepath in changes.pop('failed'): retry_later(filepath, "could not be read")
+            if any(changes[key] for key in ('added', 'updated', 'touched', 'removed', 'errors')):
+                print(f"[Watch] {path}: {changes}")
+                report(dict(changes, type='watch', path=path))
+        return True
+
+    try:
+        while not stop_event.wait(0.5):
+            now = time.time()
+            with changes_lock:
+                settled = sorted(path for path, last_event in pending_changes.items() if now - last_event >= debounce_seconds)
+                for path in settled: del pending_changes[path]
+            if not settled: continue
+            with write_lock or nullcontext():
+                try: # Another process (e.g. the CLI) scanning this index: wait for it like for a locked database
+                    scan_lock = acquire_scan_lock(db_path)
+                except RuntimeError as e:
+                    for path in settled: retry_later(path, e)
+                    continue
+                try:
+                    if not index_settled(settled): break
+                finally:
+                    release_scan_lock(scan_lock)
+    finally:
+        stop_event.set()
+        watcher_thread.join(timeout=2)
+        shutdown_extraction_pool(pool)
+        if cache_conn: cache_conn.close()
+        conn.close()
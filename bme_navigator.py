@@ -1,23 +1,24 @@
 # START OF FULL SCRIPT (v4 - File Tree Browser, Session, Notes Edit/Del, Outline+, Rank)
+import sys
+if __name__ == "__main__" and sys.argv[1:2] and sys.argv[1] in ('index', 'search', 'stats', 'optimize', 'rebuild-fts', 'thumbnails', 'compress', 'code-index'):
+    # Headless CLI (see bme_cli.py); run before tkinter is imported. alter_sys makes bme_cli
+    # the __main__ module, so extraction workers re-import it instead of this GUI script.
+    import runpy
+    runpy.run_module('bme_cli', run_name='__main__', alter_sys=True)
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, PanedWindow, Text, Scrollbar, Canvas, Frame, Label, Toplevel, Entry, simpledialog, Menu, Listbox
 import sqlite3
 import os
-import sys
 import platform
 import subprocess
 import threading
 import queue
 import fitz  # PyMuPDF
 import time # For timestamps
+import io # For thumbnail images from the cache
+import multiprocessing # For freeze_support (extraction pool in frozen builds)
 import configparser # For session state
 import ast # For evaluating stored tuples/dicts safely
-try:
-    from docx import Document # python-docx
-    DOCX_ENABLED = True
-except ImportError:
-    print("WARNING: python-docx not found. DOCX support will be disabled.")
-    DOCX_ENABLED = False
 try:
     from PIL import Image, ImageTk
     PIL_ENABLED = True
@@ -25,34 +26,31 @@ except ImportError:
     print("WARNING: Pillow not found. PDF/Icon support might be affected.")
     PIL_ENABLED = False
 
-import sys
 import re # For metadata extraction
-from collections import defaultdict # For managing tab state
+from collections import defaultdict, deque # For managing tab state
 
 # --- Configuration ---
-DATABASE_FILE = 'bme_doc_index.db'
-CONFIG_FILE = 'bme_navigator.ini' # For saving state
+# DATABASE_FILE, SUPPORTED_EXTENSIONS and the DB schema live in the GUI-free indexing engine
+from bme_indexer import (DATABASE_FILE, SUPPORTED_EXTENSIONS, DEFAULT_EXTRACT_WORKERS,
+                         DEFAULT_CHECKPOINT_FILES, DEFAULT_CHECKPOINT_SECONDS, FTS_BATCH_ROWS, FTS_MERGE_PAGES,
+                         EXTRACT_FILE_TIMEOUT, EXTRACT_PAGE_TIMEOUT,
+                         WATCH_DEBOUNCE_SECONDS, WATCH_POLL_INTERVAL,
+                         CONFIG_FILE, init_db, get_scan_paths, search_documents, search_content_snippets, optimize_fts, get_document_pages, format_cache_hits,
+                         split_archive_path, read_archive_member, extract_document_text, iter_txt_pages, is_archive, archive_member_bounds,
+                         get_document_outline, get_document_properties, DOCUMENT_PROPERTY_FIELDS,
+                         get_thumbnail, THUMBNAILS_OFF, THUMBNAIL_CACHE_MB, get_document_locations,
+                         scan_and_index, format_worker_stats, format_stage_stats, watch_and_index,
+                         get_folder_manufacturers, set_folder_manufacturers)
 
 # --- Constants ---
+# Text-viewed types whose pages are slides or sheets: heading shown above each page
+PAGED_TEXT_LABELS = {'.pptx': "Slide", '.xlsx': "Sheet", '.docx': "Section", '.html': "Section", '.htm': "Section",
+                     '.txt': "Page", '.rtf': "Page", '.csv': "Page"}
+TEXT_VIEW_MAX_PAGES = 20 # Pages shown at once in a text view; jumping further re-renders around the target
 ZOOM_STEP = 0.2
 MIN_ZOOM = 0.3
 MAX_ZOOM = 5.0
 DEFAULT_ZOOM = 1.0
-# --- UPDATE SUPPORTED EXTENSIONS ---
-SUPPORTED_EXTENSIONS = (
-    # Documents
-    '.pdf', '.docx', '.doc', '.txt', '.rtf',
-    '.html', '.htm',
-    # Spreadsheets
-    '.xlsx', '.xls', '.csv',
-    # Presentations
-    '.pptx', '.ppt',
-    # Images (Common raster formats)
-    '.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff',
-    # --- ADD Compressed Formats ---
-    '.zip', '.7z', '.rar', '.gz', '.tar', # Add common archive types
-    '.exe',
-)
 
 # --- Global Variables ---
 add_favorite_menu_index = 1
@@ -66,6 +64,7 @@ search_entry = None
 status_bar_label = None
 scan_progress_bar = None
 metadata_widgets = {}
+thumbnail_label = None # First-page preview above the metadata, from the thumbnail cache
 links_listbox = None
 links_map = {}
 notes_text_widget = None
@@ -80,6 +79,11 @@ search_results_queue = queue.Queue() # Queue for search results
 search_button_ref = None # Store reference to the search button
 scan_status_queue = queue.Queue() # Queue for scan thread communication
 scan_button_ref = None # Store reference to scan menu/button
+scan_in_progress = False # True while the scan worker thread runs
+index_write_lock = threading.Lock() # Serializes full scans and watch-mode reindexing
+watch_status_queue = queue.Queue() # Queue for watch mode communication
+watch_stop_event = None # Set to stop watch mode; None while not watching
+watch_enabled_var = None # tk.BooleanVar behind the File menu checkbutton
 
 # State for collapsible panes
 is_left_pane_collapsed = False
@@ -247,7 +251,7 @@ def restore_session_tabs():
 
             # Verify doc_id still exists and file path is valid before opening
             details = get_document_details(doc_id)
-            if details and os.path.exists(details[2]): # Check DB record and file existence
+            if details and os.path.exists(split_archive_path(details[2])[0]): # Check DB record and file (or archive) existence
                 filepath_to_open = details[2]
                 print(f" - Restoring Doc ID {doc_id} ({os.path.basename(filepath_to_open)})")
 
@@ -375,166 +379,18 @@ def search_content_with_snippets(query):
     """
     if not query: return []
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
     results = []
-    fts_query = query # Use the raw query
-
     try:
-        # Use ROW_NUMBER() to get the highest ranked snippet/page per doc_id.
-        cursor.execute(f"""
-            WITH RankedMatches AS (
-                SELECT
-                    doc_id, page_number,
-                    snippet(documents_fts, 2, '[', ']', '...', 15) as snippet_text,
-                    rank, ROW_NUMBER() OVER(PARTITION BY doc_id ORDER BY rank) as rn
-                FROM documents_fts WHERE documents_fts MATCH ?
-            )
-            SELECT rm.doc_id, d.filename, d.filepath, rm.snippet_text, rm.page_number
-            FROM RankedMatches rm JOIN documents d ON rm.doc_id = d.id
-            WHERE rm.rn = 1 ORDER BY rm.rank;
-        """, (fts_query,))
-        results = cursor.fetchall()
-        print(f"Content search for '{fts_query}' found {len(results)} top snippets.")
-
+        results = search_content_snippets(query, DATABASE_FILE)
+        print(f"Content search for '{query}' found {len(results)} top snippets.")
     except sqlite3.OperationalError as e:
-        print(f"FTS Error during content search for '{fts_query}': {e}")
-        print("Falling back to simpler FTS query...")
-        try: # Fallback without ROW_NUMBER
-             cursor.execute(f"""
-                 SELECT f.doc_id, d.filename, d.filepath,
-                        snippet(documents_fts, 2, '[', ']', '...', 15), f.page_number
-                 FROM documents_fts f JOIN documents d ON f.doc_id = d.id
-                 WHERE f.documents_fts MATCH ? ORDER BY rank, f.doc_id, f.page_number
-             """, (fts_query,))
-             results = cursor.fetchall() # Might contain multiple results per doc
-             print(f"Fallback FTS search found {len(results)} total snippets.")
-             # Optional: Filter results in Python to keep only one per doc_id if needed
-             # unique_results = {}
-             # for r in results:
-             #    if r[0] not in unique_results: unique_results[r[0]] = r
-             # results = list(unique_results.values())
-
-        except Exception as fallback_e:
-             print(f"Fallback FTS query also failed: {fallback_e}")
-             messagebox.showerror("Search Error", f"Full-text search failed.\nError: {e}")
+        print(f"FTS Error during content search for '{query}': {e}")
+        messagebox.showerror("Search Error", f"Full-text search failed.\nError: {e}")
     except sqlite3.Error as e:
         print(f"Database error during content search: {e}")
         messagebox.showerror("Database Error", f"Error searching content:\n{e}")
-    finally:
-        conn.close()
     return results
 
-def init_db():
-    """Initializes the SQLite database and tables if they don't exist."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    # --- Scan Paths Table ---
-    # Replace placeholder with correct definition
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scan_paths (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            path TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    # --- Documents Table ---
-    # Ensure this is the FULL definition with BME enhancements
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            filepath TEXT NOT NULL UNIQUE,
-            manufacturer TEXT,
-            device_model TEXT,
-            document_type TEXT,
-            keywords TEXT,
-            last_modified REAL NOT NULL,
-            revision_number TEXT,
-            revision_date TEXT,
-            status TEXT,
-            applicable_models TEXT,
-            associated_test_equipment TEXT
-        )
-    ''')
-
-    # --- FTS5 Table for Full-Text Search ---
-    cursor.execute('''
-        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
-            doc_id UNINDEXED,
-            page_number UNINDEXED,
-            content
-            -- Optionally add tokenize='porter'
-        )
-    ''')
-    # Optional: Trigger to keep FTS table synced on documents delete
-    cursor.execute('''
-        CREATE TRIGGER IF NOT EXISTS documents_ad_trigger AFTER DELETE ON documents BEGIN
-            DELETE FROM documents_fts WHERE doc_id=old.id;
-        END;
-    ''')
-
-    # --- Links Table ---
-    # Ensure this is the correct definition with description
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS links (
-            link_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_doc_id INTEGER NOT NULL,
-            target_doc_id INTEGER NOT NULL,
-            description TEXT, -- Added description
-            FOREIGN KEY (source_doc_id) REFERENCES documents (id) ON DELETE CASCADE,
-            FOREIGN KEY (target_doc_id) REFERENCES documents (id) ON DELETE CASCADE,
-            UNIQUE (source_doc_id, target_doc_id)
-        )
-    ''')
-
-    # --- Notes Table ---
-    # Ensure this is the correct definition with page_number
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notes (
-            note_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            doc_id INTEGER NOT NULL,
-            page_number INTEGER,  -- Added page context
-            note_text TEXT NOT NULL,
-            created_timestamp REAL NOT NULL,
-            FOREIGN KEY (doc_id) REFERENCES documents (id) ON DELETE CASCADE
-        )
-    ''')
-
-    # --- Favorites Table ---
-    # Ensure this is the correct definition
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS favorites (
-            fav_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            doc_id INTEGER NOT NULL,
-            page_number INTEGER NOT NULL,
-            FOREIGN KEY (doc_id) REFERENCES documents (id) ON DELETE CASCADE
-        )
-    ''')
-
-    # --- Indexes ---
-    # Ensure all necessary indexes are created
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_filepath ON documents (filepath)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_filename ON documents (filename)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_manufacturer ON documents (manufacturer)')
-    # ... (all other indexes from previous working versions) ...
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_model ON documents (device_model)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_type ON documents (document_type)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_revision ON documents (revision_number)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_status ON documents (status)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_link_source ON links (source_doc_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_link_target ON links (target_doc_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_note_doc ON notes (doc_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fav_name ON favorites (name)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_fav_doc ON favorites (doc_id)')
-
-
-    conn.commit()
-    conn.close()
-    print("Database initialized/verified (All Tables).") # Updated print message
-
 def add_favorite(name, doc_id, page_number):
     """Adds a new favorite bookmark to the database."""
     if not name:
@@ -611,20 +467,6 @@ def rename_favorite(fav_id, new_name):
     finally:
         conn.close()
 
-def get_scan_paths():
-    """Retrieves the list of scan paths from the database."""
-    paths = []
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT path FROM scan_paths ORDER BY path")
-        paths = [row[0] for row in cursor.fetchall()]
-    except sqlite3.Error as e:
-        print(f"Database error getting scan paths: {e}")
-    finally:
-        conn.close()
-    return paths
-
 def add_scan_path(path):
     """Adds a new scan path to the database."""
     conn = sqlite3.connect(DATABASE_FILE)
@@ -661,31 +503,15 @@ def remove_scan_path(path):
         conn.close()
 
 
-def extract_metadata_from_path(filepath):
-    """ BASIC heuristic metadata extraction (same as before). """
-    # ... (Keep the previous implementation) ...
-    metadata = {'manufacturer': None, 'device_model': None, 'document_type': None}
-    path_lower = filepath.lower()
-    filename_lower = os.path.basename(path_lower)
-    known_manufacturers = ['siemens', 'ge', 'philips', 'draeger', 'medtronic'] # Fallback list
-    known_doc_types = ['manual', 'sop', 'datasheet', 'service', 'user', 'quick guide', 'pm', 'calibration', 'protocol']
-    for manuf in known_manufacturers:
-        if manuf in path_lower:
-            metadata['manufacturer'] = manuf.title()
-            break
-    for dtype in known_doc_types:
-        if re.search(r'\b' + re.escape(dtype) + r'\b', path_lower):
-            metadata['document_type'] = dtype.title()
-            match_model = re.search(r'([a-zA-Z0-9]+(?:[-_][a-zA-Z0-9]+)*)_{0}|{0}_([a-zA-Z0-9]+(?:[-_][a-zA-Z0-9]+)*)'.format(dtype), filename_lower)
-            if match_model:
-                 potential_model = match_model.group(1) or match_model.group(2)
-                 if potential_model and len(potential_model) > 2: metadata['device_model'] = potential_model.upper()
-            break
-    if not metadata['device_model']:
-         match_generic_model = re.search(r'\b([a-zA-Z]{2,6}[-_][a-zA-Z0-9]{2,8})\b', filename_lower)
-         if match_generic_model: metadata['device_model'] = match_generic_model.group(1).upper()
-    return metadata
-def scan_and_update_worker(status_queue):
+def get_scan_setting(option, default, section='Scan'):
+    """Returns an integer option from a config section ([Scan] by default), or default if missing/invalid."""
+    try:
+        return config.getint(section, option, fallback=default)
+    except ValueError:
+        print(f"Invalid '{option}' in config, using default.")
+        return default
+
+def scan_and_update_worker(status_queue, folder_manufacturers=None):
     """
     Worker function to perform scan/index/FTS in a background thread.
     Communicates status and results via the queue.
@@ -703,363 +529,78 @@ def scan_and_update_worker(status_queue):
         status_queue.put({'type': 'finished', 'added': 0, 'updated': 0, 'reindexed': 0, 'removed': 0, 'errors': 0, 'duration': 0})
         return
 
-    conn = None
-    added_count = 0; updated_count = 0; fts_reindexed_count = 0
-    skipped_page_errors = 0; removed_count = 0
-    scan_start_time = time.time()
-
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        existing_files = {row[0]: (row[1], row[2]) for row in cursor.execute('SELECT filepath, id, last_modified FROM documents')}
-        found_paths_ids = {}
-        status_queue.put({'type': 'status', 'message': "Starting incremental scan..."})
-        print("[Worker] Starting incremental scan...") # Worker console log
-
-        files_processed_total = 0
-
-        for directory in scan_paths:
-            if not os.path.isdir(directory):
-                print(f"[Worker] Skipping inaccessible path: {directory}")
-                status_queue.put({'type': 'status', 'message': f"Skipping: {directory[:50]}..."})
-                continue
-
-            # --- Prompting for Manufacturer CANNOT easily be done in worker thread ---
-            # Option 1: Prompt *before* starting the thread (simpler).
-            # Option 2: Use queue to ask main thread to prompt (more complex).
-            # Let's stick to Option 1: Modify the trigger function to prompt first.
-            # We need to pass the folder_manufacturer map to the worker.
-            # For now, let's assume folder_manufacturer is handled *before* calling worker
-            # Or remove the prompting feature from the threaded version for simplicity first.
-            # ---> Let's REMOVE folder prompting for this threaded version first <---
-            folder_manufacturer = None # Remove prompting from worker
-
-            print(f"[Worker] Scanning: {directory}...")
-            status_queue.put({'type': 'status', 'message': f"Scanning: {directory[:50]}..."})
-
-            for root_dir, _, files in os.walk(directory):
-                # Send periodic status update maybe based on folder?
-                status_queue.put({'type': 'status', 'message': f"Scanning: ...{os.path.basename(root_dir)}"})
-
-                for filename in files:
-                    files_processed_total += 1
-                    # Send occasional progress update (e.g., every 100 files)
-                    if files_processed_total % 100 == 0:
-                         status_queue.put({'type': 'progress', 'count': files_processed_total})
-
-
-                    if filename.lower().endswith(SUPPORTED_EXTENSIONS) and not filename.startswith('~$'):
-                        filepath = os.path.join(root_dir, filename)
-                        doc_id = None
-                        try:
-                            current_last_modified = os.path.getmtime(filepath)
-                            needs_db_processing = False; is_new_file = False
-
-                            if filepath not in existing_files: needs_db_processing = True; is_new_file = True
-                            else:
-                                doc_id, db_last_modified = existing_files[filepath]
-                                if current_last_modified > db_last_modified: needs_db_processing = True
-                                else: found_paths_ids[filepath] = doc_id; continue # Unchanged
-
-                            if needs_db_processing:
-                                extracted_metadata = extract_metadata_from_path(filepath)
-                                final_manufacturer = folder_manufacturer or extracted_metadata.get('manufacturer') # Using None for folder_manuf now
-                                device_model = extracted_metadata.get('device_model')
-                                document_type = extracted_metadata.get('document_type')
-
-                                if is_new_file:
-                                    cursor.execute('INSERT INTO documents (...) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (...)) # Full INSERT
-                                    doc_id = cursor.lastrowid; added_count += 1
-                                else: # Update
-                                    cursor.execute('UPDATE documents SET ... WHERE id=?', (...)) # Full UPDATE
-                                    updated_count += 1
-                                existing_files[filepath] = (doc_id, current_last_modified)
-                                found_paths_ids[filepath] = doc_id
-
-                                # --- FTS Processing ---
-                                print(f"[Worker] Processing FTS for Doc ID {doc_id} ({filename[:20]}...)")
-                                # Put indexing status update
-                                status_queue.put({'type': 'status', 'message': f"Indexing: {filename[:40]}..."})
-
-                                cursor.execute("DELETE FROM documents_fts WHERE doc_id = ?", (doc_id,))
-                                pages_indexed_this_file = 0; file_ext = os.path.splitext(filename)[1].lower()
-                                try: # Page-by-page extraction/indexing
-                                    if file_ext == '.pdf':
-                                         # ... PDF FTS logic ...
-                                         pass
-                                    elif file_ext == '.docx' and DOCX_ENABLED:
-                                         # ... DOCX FTS logic ...
-                                         pass
-                                    elif file_ext == '.txt':
-                                         # ... TXT FTS logic ...
-                                         pass
-                                    elif file_ext in ['.html', '.htm']:
-                                         # ... HTML FTS logic ...
-                                         pass
-
-                                    if pages_indexed_this_file > 0: fts_reindexed_count += 1
-                                    # No need to print here, status sent via queue
-
-                                except Exception as text_ex:
-                                    print(f"[Worker] !!! Text/FTS error for {filename}: {text_ex}")
-                                    skipped_page_errors += 1
-
-                        except Exception as e: print(f"[Worker] Error processing file {filepath}: {e}")
-
-        # --- End Scan Loop ---
-        scan_duration = time.time() - scan_start_time
-        print(f"[Worker] Scan loop finished in {scan_duration:.2f}s.")
-        status_queue.put({'type': 'status', 'message': "Removing obsolete entries..."})
-
-        # --- Remove obsolete entries ---
-        paths_in_db = set(existing_files.keys())
-        paths_found_on_disk_this_scan = set(found_paths_ids.keys())
-        paths_to_remove = paths_in_db - paths_found_on_disk_this_scan
-        if paths_to_remove:
-            ids_to_remove = [existing_files[p][0] for p in paths_to_remove if p in existing_files]
-            if ids_to_remove:
-                 cursor.executemany('DELETE FROM documents WHERE id = ?', [(id,) for id in ids_to_remove])
-                 removed_count = cursor.rowcount
-                 print(f"[Worker] Removed {removed_count} obsolete documents.")
-
-        conn.commit()
-        print("[Worker] DB commit successful.")
-
-        # --- Optimize FTS ---
-        try:
-             status_queue.put({'type': 'status', 'message': "Optimizing index..."})
-             print("[Worker] Optimizing FTS index...")
-             cursor.execute("INSERT INTO documents_fts(documents_fts) VALUES('optimize');")
-             conn.commit()
-             print("[Worker] Optimization complete.")
-        except Exception as opt_e: print(f"[Worker] DB optimize error: {opt_e}")
-
-        # --- Put final result on queue ---
-        status_queue.put({
-            'type': 'finished', 'added': added_count, 'updated': updated_count,
-            'reindexed': fts_reindexed_count, 'removed': removed_count,
-            'errors': skipped_page_errors, 'duration': scan_duration
-        })
-
+        # Walk + DB writes happen on this thread; text extraction runs in a process pool
+        with index_write_lock: # Watch mode waits while a full scan runs
+            stats = scan_and_index(scan_paths, folder_manufacturers=folder_manufacturers,
+                                   status_callback=status_queue.put,
+                                   workers=get_scan_setting('extract_workers', DEFAULT_EXTRACT_WORKERS),
+                                   checkpoint_files=get_scan_setting('checkpoint_files', DEFAULT_CHECKPOINT_FILES),
+                                   checkpoint_seconds=get_scan_setting('checkpoint_seconds', DEFAULT_CHECKPOINT_SECONDS),
+                                   use_dir_cache=bool(get_scan_setting('skip_unchanged_dirs', 0)),
+                                   fts_batch_rows=get_scan_setting('fts_batch_rows', FTS_BATCH_ROWS),
+                                   bulk_build=None if get_scan_setting('bulk_build', 1) else False,
+                                   fts_merge_pages=get_scan_setting('fts_merge_pages', FTS_MERGE_PAGES),
+                                   extract_file_timeout=get_scan_setting('extract_file_timeout', EXTRACT_FILE_TIMEOUT),
+                                   extract_page_timeout=get_scan_setting('extract_page_timeout', EXTRACT_PAGE_TIMEOUT),
+                                   text_cache=bool(get_scan_setting('text_cache', 1)),
+                                   thumbnails=get_scan_setting('thumbnails', THUMBNAILS_OFF),
+                                   thumbnail_cache_mb=get_scan_setting('thumbnail_cache_mb', THUMBNAIL_CACHE_MB))
+        stats['type'] = 'finished'
+        status_queue.put(stats)
     except sqlite3.Error as e:
          print(f"[Worker] !!! DB error during scan: {e}")
-         if conn: conn.rollback()
-         status_queue.put({'type': 'error', 'message': f"Scan DB error:\n{e}"})
+         status_queue.put({'type': 'error', 'message': f"Scan DB error:\n{e}\n\nWork up to the last checkpoint was saved; run Scan/Update Index again to resume."})
+    except RuntimeError as e: # Another process is scanning this index, or extraction workers cannot start
+         print(f"[Worker] !!! Scan not run: {e}")
+         status_queue.put({'type': 'error', 'message': f"Scan stopped:\n{e}"})
     except Exception as e:
          print(f"[Worker] !!! Unexpected scan error: {e}")
-         if conn: conn.rollback()
-         status_queue.put({'type': 'error', 'message': f"Unexpected scan error:\n{e}"})
+         status_queue.put({'type': 'error', 'message': f"Unexpected scan error:\n{e}\n\nWork up to the last checkpoint was saved; run Scan/Update Index again to resume."})
     finally:
-        if conn: conn.close()
         print("[Worker] Thread finished.")
 
 def scan_and_update_index():
     """
-    Scans configured directories, prompts for manufacturer, extracts text PAGE BY PAGE,
-    and incrementally updates the database and FTS index based on modification times.
-    Shows progress.
+    Prompts for a default manufacturer per scan path, then runs the scan/index
+    in the background worker thread (see start_scan_thread).
     """
-    global status_bar_label, root, scan_progress_bar # Ensure progress bar is global
+    global status_bar_label, root
 
+    if scan_in_progress:
+        messagebox.showinfo("Scan Info", "A scan is already in progress.")
+        return
     scan_paths = get_scan_paths()
     if not scan_paths:
         messagebox.showinfo("Scan", "No scan paths configured. Please add paths via 'File -> Manage Scan Paths...'.")
         return
 
-    conn = None
-    final_msg = "Scan Aborted. Ready." # Default message if errors occur early
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        added_count = 0
-        updated_count = 0 # Counts metadata updates
-        fts_reindexed_count = 0 # Counts files whose FTS was fully re-indexed
-        skipped_page_errors = 0
-
-        # Get existing files: filepath -> (id, last_modified)
-        existing_files = {row[0]: (row[1], row[2]) for row in cursor.execute('SELECT filepath, id, last_modified FROM documents')}
-        print(f"Loaded {len(existing_files)} existing file records from DB.")
-        # Keep track of files found on disk this scan to detect deletions
-        # Map filepath -> id (for both existing and newly added files)
-        found_paths_ids = {}
-
-        print("Starting incremental scan...")
-        status_bar_label.config(text="Starting incremental scan...")
-        # --- Show and Start Progress Bar ---
-        if scan_progress_bar:
-             scan_progress_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=1, pady=0, before=status_bar_label)
-             scan_progress_bar.start(10) # Start animation (interval in ms)
-        root.update_idletasks()
-        # --- End Progress Bar Start ---
-        scan_start_time = time.time()
-        files_processed_since_update = 0
-
-        # --- Loop through each configured scan path ---
-        for directory in scan_paths:
-            if not os.path.isdir(directory):
-                print(f"Warning: Configured scan path not found or inaccessible: {directory}")
-                status_bar_label.config(text=f"Skipping inaccessible path: {directory[:50]}...")
-                root.update_idletasks()
-                continue
-
-            # --- Prompt for Folder-Level Manufacturer ---
-            status_bar_label.config(text=f"Prompting for: {directory[:50]}...")
-            root.update_idletasks()
-            prompt_title = "Assign Manufacturer"
-            prompt_text = f"Enter default manufacturer for files found within:\n'{directory}'\n\n(Leave blank or Cancel to skip)"
-            folder_manufacturer = simpledialog.askstring(prompt_title, prompt_text, parent=root)
-            if folder_manufacturer is not None: # Check if Cancel was pressed
-                folder_manufacturer = folder_manufacturer.strip() or None # Treat empty as None
-                if folder_manufacturer: print(f"Assigning Manufacturer '{folder_manufacturer}' to files in {directory}")
-                else: print(f"No default manufacturer assigned for {directory}.")
-            else: # User pressed Cancel
-                folder_manufacturer = None
-                print(f"Manufacturer assignment cancelled for {directory}.")
-
-
-            status_bar_label.config(text=f"Scanning: {directory[:50]}...")
-            root.update_idletasks()
-            print(f"Scanning: {directory}...")
-
-            # --- Walk through the current directory ---
-            for root_dir, _, files in os.walk(directory):
-                status_bar_label.config(text=f"Scanning: ...{os.path.basename(root_dir)}")
-                for filename in files:
-                    # --- Periodic GUI Update ---
-                    files_processed_since_update += 1
-                    if files_processed_since_update >= 50: root.update_idletasks(); files_processed_since_update = 0
-
-                    if filename.lower().endswith(SUPPORTED_EXTENSIONS) and not filename.startswith('~$'):
-                        filepath = os.path.join(root_dir, filename)
-                        # found_paths_on_disk.add(filepath) # We use found_paths_ids instead now
-                        doc_id = None
-
-                        try:
-                            current_last_modified = os.path.getmtime(filepath)
-                            needs_db_processing = False # Flag if DB needs any write operation
-
-                            # --- Determine File Status ---
-                            if filepath not in existing_files:
-                                # Case 1: New File
-                                print(f" + Found new file: {filename}")
-                                needs_db_processing = True
-                                is_new_file = True
-                                # doc_id will be assigned after insert
-                            else:
-                                # Case 2: Existing File - Check modification time
-                                doc_id, db_last_modified = existing_files[filepath]
-                                is_new_file = False
-                                if current_last_modified > db_last_modified:
-                                    print(f" * Found updated file: {filename} (ID: {doc_id})")
-                                    needs_db_processing = True
-                                else:
-                                    # File exists and hasn't changed, store its ID and skip DB processing
-                                    found_paths_ids[filepath] = doc_id # <<< RECORD ID FOR UNCHANGED FILE
-                                    continue # Skip to next file in loop
-
-                            # --- Process if New or Updated ---
-                            if needs_db_processing:
-                                # Prepare metadata
-                                extracted_metadata = extract_metadata_from_path(filepath)
-                                final_manufacturer = folder_manufacturer or extracted_metadata.get('manufacturer')
-                                device_model = extracted_metadata.get('device_model')
-                                document_type = extracted_metadata.get('document_type')
-
-                                if is_new_file:
-                                    cursor.execute('''INSERT INTO documents (filename, filepath, manufacturer, device_model, document_type, keywords, last_modified, revision_number, revision_date, status, applicable_models, associated_test_equipment) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                                                   (filename, filepath, final_manufacturer, device_model, document_type, None, current_last_modified, None,None,None,None,None))
-                                    doc_id = cursor.lastrowid; added_count += 1
-                                else: # File updated
-                                    cursor.execute('UPDATE documents SET filename=?, manufacturer = CASE WHEN ? IS NOT NULL THEN ? ELSE COALESCE(documents.manufacturer, ?) END, device_model=COALESCE(documents.device_model, ?), document_type=COALESCE(documents.document_type, ?), last_modified=? WHERE id=?',
-                                                   (filename, folder_manufacturer, folder_manufacturer, final_manufacturer, device_model, document_type, current_last_modified, doc_id))
-                                    updated_count += 1
-                                # Update cache/tracking dictionary immediately after insert/update
-                                existing_files[filepath] = (doc_id, current_last_modified) # Update cache with new time/id
-                                found_paths_ids[filepath] = doc_id # Store ID for this processed file
-
-
-                                # --- Process FTS Indexing/Re-indexing ---
-                                print(f"   - Processing FTS for Doc ID {doc_id}...")
-                                status_bar_label.config(text=f"Indexing: {filename[:40]}...")
-                                root.update_idletasks()
-                                cursor.execute("DELETE FROM documents_fts WHERE doc_id = ?", (doc_id,))
-                                pages_indexed_this_file = 0; file_ext = os.path.splitext(filename)[1].lower()
-                                try:
-                                    if file_ext == '.pdf':
-                                        with fitz.open(filepath) as doc:
-                                            for page_num, page in enumerate(doc):
-                                                page_text = page.get_text("text", sort=True)
-                                                if page_text and page_text.strip():
-                                                    cursor.execute("INSERT INTO documents_fts (doc_id, page_number, content) VALUES (?, ?, ?)",(doc_id, page_num, page_text))
-                                                    pages_indexed_this_file += 1
-                                    elif file_ext == '.docx' and DOCX_ENABLED:
-                                         doc = Document(filepath); full_text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
-                                         if full_text: cursor.execute("INSERT INTO documents_fts (doc_id, page_number, content) VALUES (?, ?, ?)", (doc_id, 0, full_text)); pages_indexed_this_file = 1
-                                    elif file_ext == '.txt':
-                                         content = None;
-                                         for enc in ['utf-8', 'cp1252', 'latin-1']:
-                                             try:
-                                                  with open(filepath, 'r', encoding=enc) as f: content = f.read(); break
-                                             except: continue
-                                         if content and content.strip(): cursor.execute("INSERT INTO documents_fts (doc_id, page_number, content) VALUES (?, ?, ?)", (doc_id, 0, content)); pages_indexed_this_file = 1
-                                    elif file_ext in ['.html', '.htm']:
-                                        html_content = ""; extracted_text = ""
-                                        try:
-                                             for enc in ['utf-8', 'cp1252', 'latin-1']:
-                                                  try:
-                                                       with open(filepath, 'r', encoding=enc) as f: html_content = f.read(); break
-                                                  except UnicodeDecodeError: continue
-                                             if not html_content: raise ValueError("Could not decode HTML")
-                                             html_content = re.sub(r'<script.*?<\/script>','',html_content,flags=re.I|re.S); html_content = re.sub(r'<style.*?<\/style>','',html_content,flags=re.I|re.S)
-                                             extracted_text = re.sub(r'<.*?>',' ',html_content); extracted_text = re.sub(r'\s+',' ',extracted_text).strip()
-                                             if extracted_text: cursor.execute("INSERT INTO documents_fts (doc_id, page_number, content) VALUES (?, ?, ?)",(doc_id, 0, extracted_text)); pages_indexed_this_file = 1
-                                        except Exception as html_ex: print(f"HTML Err: {html_ex}"); skipped_page_errors += 1
-
-                                    if pages_indexed_this_file > 0: print(f"     - Re-Indexed {pages_indexed_this_file} pages/blocks."); fts_reindexed_count += 1
-                                    else: print(f"     - No indexable text found.")
-                                except Exception as text_ex: print(f"   - !!! Error during text extraction/FTS indexing for {filename}: {text_ex}"); skipped_page_errors += 1
-
-                        except OSError as e: print(f"OS Error processing file {filepath}: {e}")
-                        except Exception as e: print(f"General Error processing file {filepath}: {e}")
-
-        # --- End Main Scan Loop ---
-        scan_duration = time.time() - scan_start_time
-        print(f"Directory scanning finished in {scan_duration:.2f} seconds.")
-        status_bar_label.config(text="Removing obsolete entries...")
+    # --- Prompt for Folder-Level Manufacturer (must happen on the GUI thread) ---
+    folder_manufacturers = {}
+    prompted = {} # Every path asked about, None if left blank
+    for directory in scan_paths:
+        if not os.path.isdir(directory): continue # Worker reports inaccessible paths
+        status_bar_label.config(text=f"Prompting for: {directory[:50]}...")
         root.update_idletasks()
+        prompt_title = "Assign Manufacturer"
+        prompt_text = f"Enter default manufacturer for files found within:\n'{directory}'\n\n(Leave blank or Cancel to skip)"
+        folder_manufacturer = simpledialog.askstring(prompt_title, prompt_text, parent=root)
+        if folder_manufacturer is not None: # Check if Cancel was pressed
+            folder_manufacturer = folder_manufacturer.strip() or None # Treat empty as None
+            if folder_manufacturer:
+                print(f"Assigning Manufacturer '{folder_manufacturer}' to files in {directory}")
+                folder_manufacturers[directory] = folder_manufacturer
+            else: print(f"No default manufacturer assigned for {directory}.")
+        else: # User pressed Cancel
+            print(f"Manufacturer assignment cancelled for {directory}.")
+        prompted[directory] = folder_manufacturers.get(directory)
+
+    previous_manufacturers = get_folder_manufacturers()
+    set_folder_manufacturers(prompted) # Watch mode assigns the same ones
+    if watch_stop_event and get_folder_manufacturers() != previous_manufacturers:
+        stop_watch_mode(); start_watch_mode()
+    start_scan_thread(folder_manufacturers)
 
-        # --- Remove obsolete entries ---
-        removed_count = 0
-        paths_in_db = set(existing_files.keys())
-        # Use the keys from found_paths_ids which includes new, updated, AND unchanged files found
-        paths_found_on_disk_this_scan = set(found_paths_ids.keys())
-        paths_to_remove = paths_in_db - paths_found_on_disk_this_scan
-        if paths_to_remove:
-            ids_to_remove = [existing_files[p][0] for p in paths_to_remove if p in existing_files]
-            if ids_to_remove:
-                 cursor.executemany('DELETE FROM documents WHERE id = ?', [(id,) for id in ids_to_remove])
-                 removed_count = cursor.rowcount
-                 print(f"Removed {removed_count} obsolete document entries.")
-
-        conn.commit()
-        print("Database transaction committed.")
-        final_msg = f"Scan Complete ({scan_duration:.1f}s). Added: {added_count}, Updated: {updated_count}, Re-Indexed: {fts_reindexed_count}, Removed: {removed_count}."
-        if skipped_page_errors > 0: final_msg += f" Text Errors: {skipped_page_errors}."
-        final_msg += " Ready."
-        messagebox.showinfo("Scan Complete", f"Scan finished in {scan_duration:.1f} seconds.\nDocs Added: {added_count}\nDocs Updated: {updated_count}\nFiles Re-Indexed(FTS): {fts_reindexed_count}\nDocs Removed: {removed_count}\nText Extraction Errors: {skipped_page_errors}")
-
-    except sqlite3.Error as e: print(f"DB error during scan: {e}"); messagebox.showerror("DB Error", f"Scan DB error:\n{e}"); conn.rollback() if conn else None; final_msg="Scan failed! DB error."
-    except Exception as e: print(f"Unexpected scan error: {e}"); messagebox.showerror("Scan Error", f"Unexpected scan error:\n{e}"); conn.rollback() if conn else None; final_msg="Scan failed! Unexpected error."
-    finally:
-        if scan_progress_bar: scan_progress_bar.stop(); scan_progress_bar.pack_forget()
-        if conn:
-             try:
-                  print("Optimizing FTS index..."); status_bar_label.config(text="Optimizing index..."); root.update_idletasks()
-                  opt_cursor = conn.cursor(); opt_cursor.execute("INSERT INTO documents_fts(documents_fts) VALUES('optimize');"); conn.commit(); print("Optimization complete.")
-             except Exception as opt_e: print(f"DB optimize error: {opt_e}")
-             conn.close()
-        build_file_tree(); clear_details_panel(); status_bar_label.config(text=final_msg)
-        
 def get_document_details(doc_id):
     """Retrieves all details for a single document by its ID."""
     if not doc_id: return None
@@ -1233,86 +774,6 @@ def delete_note(note_id):
 # --- End Database Functions Placeholder ---
 
 
-# --- Modified Search Function (for Rank) ---
-def search_documents(query):
-    """
-    Searches metadata AND full-text index.
-    Returns list of document detail tuples ORDERED potentially by FTS Rank.
-    If query is empty, returns ALL documents ordered by filename.
-    """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    if not query:
-        # ... (return all documents logic - same as before) ...
-        try:
-            cursor.execute('SELECT id, filename, filepath, manufacturer, device_model, document_type FROM documents ORDER BY filename'); results = cursor.fetchall(); conn.close(); return results
-        except sqlite3.Error as e: print(f"DB error fetching all docs: {e}"); conn.close(); return []
-
-    # --- Logic for non-empty query ---
-    matching_doc_ids_ranked = {} # Store ID -> rank (rank is lower for better match)
-    search_term_meta = f"%{query}%"
-    search_term_fts = query
-
-    try:
-        # 1. Metadata Search (doesn't provide rank, assign default low relevance rank)
-        cursor.execute('''
-            SELECT id FROM documents
-            WHERE filename LIKE ? OR filepath LIKE ? OR manufacturer LIKE ?
-               OR device_model LIKE ? OR document_type LIKE ? OR keywords LIKE ?
-        ''', (search_term_meta, search_term_meta, search_term_meta,
-              search_term_meta, search_term_meta, search_term_meta))
-        for row in cursor.fetchall():
-            if row[0] not in matching_doc_ids_ranked: # Avoid overwriting potential FTS rank
-                matching_doc_ids_ranked[row[0]] = 9999 # Assign low relevance
-
-        # 2. Full-Text Search
-        try:
-            # Select doc_id and rank. Lower rank values indicate better matches in SQLite FTS5.
-            cursor.execute('''
-                SELECT doc_id, rank FROM documents_fts WHERE documents_fts MATCH ? ORDER BY rank
-            ''', (search_term_fts,))
-            for doc_id, rank in cursor.fetchall():
-                matching_doc_ids_ranked[doc_id] = rank # Overwrite/add with actual FTS rank
-            print(f"FTS search updated ranks for {len(matching_doc_ids_ranked)} matches.")
-
-        except sqlite3.OperationalError as fts_e:
-             print(f"FTS search failed for '{query}': {fts_e}. Searching metadata only.")
-
-    except sqlite3.Error as e:
-        print(f"Database error during search for '{query}': {e}")
-        conn.close(); return []
-
-    # --- Fetch details for unique matching IDs, ordered by rank then filename ---
-    if not matching_doc_ids_ranked:
-        conn.close(); return []
-
-    # Sort IDs based on rank (lower is better), then use filename as tie-breaker later
-    sorted_ids = sorted(matching_doc_ids_ranked.keys(), key=lambda doc_id: matching_doc_ids_ranked[doc_id])
-
-    try:
-         placeholders = ','.join('?' * len(sorted_ids))
-         # Preserve the rank-based order using a trick with INSTR in ORDER BY
-         # This ensures the results are returned in the desired rank order.
-         # Alternatively, fetch all then re-sort in Python using the ranks dict.
-         sql = f'''
-            SELECT id, filename, filepath, manufacturer, device_model, document_type
-            FROM documents
-            WHERE id IN ({placeholders})
-            ORDER BY INSTR(?, ',' || id || ',') -- Order by position in sorted_ids list
-         '''
-         # Create the ordered ID string for INSTR: ",id1,id2,id3,"
-         ordered_id_string = ',' + ','.join(map(str, sorted_ids)) + ','
-         cursor.execute(sql, list(sorted_ids) + [ordered_id_string]) # Pass IDs twice for IN and INSTR
-         results = cursor.fetchall()
-         print(f"Fetched details for {len(results)} matching documents (ranked).")
-         conn.close()
-         return results
-    except sqlite3.Error as e:
-         print(f"Database error fetching final ranked results: {e}")
-         conn.close(); return []
-
-
 # --- Utility & Helper Functions (Keep As Is) ---
 def open_file_externally_selected():
     """Opens the currently selected file externally."""
@@ -1327,8 +788,9 @@ def open_file_externally_selected():
 
 
 def open_file_externally(filepath):
-    """Opens the given file using the default system application."""
+    """Opens the given file using the default system application (for an archive member: its archive)."""
     # ... (Same as previous) ...
+    filepath = split_archive_path(filepath)[0]
     try:
         if not os.path.exists(filepath): messagebox.showerror("Error", f"File not found:\n{filepath}"); return
         if platform.system() == "Windows": os.startfile(filepath)
@@ -1468,6 +930,104 @@ def display_text_in_tab(tab_id, text_content):
     # Always ensure PDF nav is hidden for text
     pdf_nav_frame.pack_forget()
     update_page_label_for_tab(tab_id) # Clear label
+def display_pages_in_tab(tab_id, pages, page_label="Page", first_index=0, more=False):
+    """Displays a window of extracted (page_number, text) pages (see read_text_window) as text, each
+       under a '--- Slide 3 ---' style heading; the heading positions are kept in state['page_marks']
+       for go_to_favorite. first_index pages come before the window; more: pages follow it."""
+    state = tab_states.get(tab_id)
+    if not state: return
+    state['text_complete'] = not first_index and not more # Every page is shown
+    if len(pages) == 1 and pages[0][0] == 0 and state['text_complete']:
+        display_text_in_tab(tab_id, pages[0][1])
+        state['page_marks'] = {0: '1.0'}
+        return
+    display_text_in_tab(tab_id, "")
+    text_widget = state['widgets']['text_viewer']
+    text_widget.config(state=tk.NORMAL)
+    state['page_marks'] = {}
+    if first_index: text_widget.insert(tk.END, f"({first_index} earlier {page_label.lower()}s not shown)\n\n")
+    for page_number, text in pages:
+        state['page_marks'][page_number] = text_widget.index(tk.END + "-1c")
+        text_widget.insert(tk.END, f"--- {page_label} {page_number + 1} ---\n{text}\n\n")
+    if more: text_widget.insert(tk.END, f"(More {page_label.lower()}s not shown; search results and the outline jump to them)")
+    if not pages: text_widget.insert(tk.END, "(No text extracted)")
+    text_widget.config(state=tk.DISABLED)
+
+def read_text_window(doc_id, filepath, around_page=None):
+    """
+    Reads the pages a text view shows (runs off the Tk thread): TEXT_VIEW_MAX_PAGES from
+    the start, or from two before around_page. TXT files are streamed, so only the pages
+    up to the end of the window are read. Returns {'pages', 'first_index', 'more', 'error'}.
+    """
+    try:
+        if filepath.lower().endswith('.txt') and not split_archive_path(filepath)[1]:
+            pages = iter_txt_pages(filepath)
+        else: # Slides/sheets/sections, archive members: the indexer's extractors
+            result = extract_document_text(doc_id, filepath)
+            if result['error']: return {'error': result['error']}
+            pages = result['pages']
+        before = deque(maxlen=2) # Pages shown above around_page
+        window, first_index = [], 0
+        for index, page in enumerate(pages):
+            if len(window) >= TEXT_VIEW_MAX_PAGES:
+                return {'pages': window, 'first_index': first_index, 'more': True, 'error': None}
+            if window or around_page is None or page[0] >= around_page:
+                if not window: window, first_index = list(before), index - len(before)
+                window.append(page)
+            else: before.append(page)
+        if not window and before: return read_text_window(doc_id, filepath) # No such page: show the start
+        return {'pages': window, 'first_index': first_index, 'more': False, 'error': None}
+    except Exception as e:
+        return {'error': str(e)}
+
+def load_text_view(tab_id, around_page=None):
+    """Fills a text view with read_text_window() in a background thread; scroll_text_to_page() calls meanwhile wait for it."""
+    state = tab_states.get(tab_id)
+    if not state: return
+    state.setdefault('page_marks', {}) # Marks it as a text view for the page navigation
+    state['text_loading'] = True
+    if around_page is not None: state['scroll_to'] = around_page
+    if status_bar_label: status_bar_label.config(text=f"Reading {os.path.basename(state['filepath'])}...")
+    result_queue = queue.Queue()
+    threading.Thread(target=lambda: result_queue.put(read_text_window(state['doc_id'], state['filepath'], around_page)), daemon=True).start()
+
+    def check_text_window():
+        try:
+            window = result_queue.get_nowait()
+        except queue.Empty:
+            root.after(100, check_text_window)
+            return
+        if tab_states.get(tab_id) is not state: return # Tab closed meanwhile
+        state['text_loading'] = False
+        if status_bar_label: status_bar_label.config(text="Ready.")
+        if window['error']:
+            display_text_in_tab(tab_id, f"Error reading document:\n{window['error']}")
+            state['text_complete'] = True # Nothing more to read
+            return
+        display_pages_in_tab(tab_id, window['pages'], state['page_label'], window['first_index'], window['more'])
+        scroll_to = state.pop('scroll_to', None)
+        if scroll_to in state['page_marks']: show_text_page(tab_id, scroll_to)
+        elif scroll_to is not None and scroll_to != around_page: load_text_view(tab_id, scroll_to) # Asked for while loading
+    root.after(100, check_text_window)
+
+def scroll_text_to_page(tab_id, page_number):
+    """Scrolls a text view so the heading of page_number is at the top, reading the pages around it if they are not shown."""
+    state = tab_states.get(tab_id)
+    if not state or 'page_marks' not in state: return
+    if state.get('text_loading'): # Scrolled to once the pages are shown
+        state['scroll_to'] = page_number
+    elif page_number in state['page_marks']:
+        show_text_page(tab_id, page_number)
+    elif not state.get('text_complete'): # Outside the shown window
+        load_text_view(tab_id, page_number)
+
+def show_text_page(tab_id, page_number):
+    """Scrolls a text view to the heading of a page it shows."""
+    state = tab_states[tab_id]
+    text_widget = state['widgets']['text_viewer']
+    text_widget.see(tk.END); text_widget.see(state['page_marks'][page_number])
+    print(f"Scrolled tab {tab_id} to page {page_number + 1}")
+
 def update_history_and_load(tab_id, new_page_num, is_history_navigation=False):
     """Loads a new page, updating history if it's not a back/forward action."""
     state = tab_states.get(tab_id)
@@ -1650,6 +1210,13 @@ def open_selected_in_new_tab():
              print(f"Error: Could not find doc_id for file node: {filepath}")
     # else: Double-clicked a folder - do nothing (or maybe expand?)
 
+def open_pdf_document(filepath):
+    """fitz.open() for a PDF file or a PDF inside an archive ('archive!member'), read into memory."""
+    archive_path, member_name = split_archive_path(filepath)
+    if member_name: return fitz.open(stream=read_archive_member(archive_path, member_name), filetype='pdf')
+    return fitz.open(filepath)
+
+
 def open_document_in_tab(doc_id):
     """Opens a document specified by doc_id in a new tab or selects existing tab.
        Handles PDF, DOCX, TXT, HTML (text view), and others (no preview).
@@ -1664,7 +1231,7 @@ def open_document_in_tab(doc_id):
     doc_id_chk, filename, filepath, _, _, _, _, _, _, _, _, _ = details
     if doc_id_chk != doc_id: print(f"Warning: Mismatch between requested doc_id ({doc_id}) and retrieved id ({doc_id_chk})")
 
-    if not os.path.exists(filepath):
+    if not os.path.exists(split_archive_path(filepath)[0]):
         messagebox.showerror("Error", f"File not found (it may have been moved or deleted):\n{filepath}\n\nConsider re-scanning.")
         return None
 
@@ -1728,7 +1295,7 @@ def open_document_in_tab(doc_id):
         if ext == '.pdf':
             pdf_doc_obj = None
             try:
-                 pdf_doc_obj = fitz.open(filepath)
+                 pdf_doc_obj = open_pdf_document(filepath)
                  print(f"Tab {tab_id}: Opened fitz object for PDF. Type: {type(pdf_doc_obj)}, Pages: {len(pdf_doc_obj) if pdf_doc_obj else 'N/A'}")
                  state['doc_obj'] = pdf_doc_obj # Assign ONLY if successful
             except Exception as fitz_open_e:
@@ -1750,41 +1317,11 @@ def open_document_in_tab(doc_id):
                 display_text_in_tab(tab_id, "Error: PDF has no pages.");
                 if state['doc_obj']: state['doc_obj'].close(); state['doc_obj'] = None
 
-        elif ext == '.docx' and DOCX_ENABLED:
-             try:
-                  doc = Document(filepath); full_text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
-                  display_text_in_tab(tab_id, full_text); initial_load_successful = True
-             except Exception as docx_e: display_text_in_tab(tab_id, f"Error reading DOCX:\n{docx_e}")
-
-        elif ext == '.txt':
-             content = None; error_txt = None
-             for enc in ['utf-8', 'cp1252', 'latin-1']:
-                try:
-                    with open(filepath, 'r', encoding=enc) as f: content = f.read(); break
-                except UnicodeDecodeError: continue
-                except Exception as txt_e: error_txt = f"Error reading TXT:\n{txt_e}"; break
-             if content is not None: display_text_in_tab(tab_id, content); initial_load_successful = True
-             elif error_txt: display_text_in_tab(tab_id, error_txt)
-             else: display_text_in_tab(tab_id, f"Error decoding TXT.")
-
-        elif ext in ['.html', '.htm']: # HTML Display Added
-            print(f"Tab {tab_id}: Displaying HTML as extracted text.")
-            html_content = ""; extracted_text = ""; error_html = None
-            try:
-                 for enc in ['utf-8', 'cp1252', 'latin-1']:
-                      try:
-                           with open(filepath, 'r', encoding=enc) as f: html_content = f.read(); break
-                      except UnicodeDecodeError: continue
-                 if not html_content: raise ValueError("Could not decode HTML")
-                 html_content = re.sub(r'<script.*?<\/script>', '', html_content, flags=re.IGNORECASE | re.DOTALL)
-                 html_content = re.sub(r'<style.*?<\/style>', '', html_content, flags=re.IGNORECASE | re.DOTALL)
-                 extracted_text = re.sub(r'<.*?>', ' ', html_content)
-                 extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
-                 display_text_in_tab(tab_id, extracted_text or "(HTML content extracted as empty)")
-                 initial_load_successful = True
-            except Exception as html_ex:
-                 error_html = f"Error reading/parsing HTML file:\n{html_ex}"
-                 print(f"!!! {error_html}"); display_text_in_tab(tab_id, error_html)
+        elif split_archive_path(filepath)[1] or ext in PAGED_TEXT_LABELS: # Archive members, slides/sheets: the indexer's text
+             state['page_label'] = PAGED_TEXT_LABELS.get(ext, "Page")
+             display_text_in_tab(tab_id, "Loading...")
+             load_text_view(tab_id) # Off the Tk thread; only the pages shown are read
+             initial_load_successful = True
 
         else: # Handle other non-previewable types
             display_text_in_tab(tab_id, f"'{filename}'\n\nPreview not available for this file type.\nUse 'File' -> 'Open Externally'.")
@@ -1988,72 +1525,87 @@ REFERENCE_PATTERNS = [
     {'type': 'filename',      'regex': FILENAME_PATTERN},     # Filename as fallback
 ]
 # --- End Patterns ---
+def end_scan_ui():
+    """Stops the progress bar and marks the scan as no longer running."""
+    global scan_in_progress
+    scan_in_progress = False
+    if scan_progress_bar: scan_progress_bar.stop(); scan_progress_bar.pack_forget()
+    if scan_button_ref: scan_button_ref.config(state=tk.NORMAL) # Re-enable button
+
 def check_scan_queue():
     """Checks the scan status queue and updates the GUI."""
     global scan_status_queue, status_bar_label, scan_progress_bar, scan_button_ref, root
 
     try:
-        # Get message from queue if available, non-blocking
-        message = scan_status_queue.get_nowait()
-
-        msg_type = message.get('type')
-
-        if msg_type == 'status':
-            if status_bar_label: status_bar_label.config(text=message.get('message', 'Scanning...'))
-            # Keep checking queue if status update received
-            root.after(50, check_scan_queue)
-        elif msg_type == 'progress':
-             # Optional: Update progress bar if using determinate mode later
-             # count = message.get('count', 0)
-             # If progress bar is indeterminate, just keep checking
-             root.after(50, check_scan_queue)
-        elif msg_type == 'error':
-            # Error occurred in worker thread
-            if scan_progress_bar: scan_progress_bar.stop(); scan_progress_bar.pack_forget()
-            if scan_button_ref: scan_button_ref.config(state=tk.NORMAL) # Re-enable button
-            messagebox.showerror("Scan Error", message.get('message', 'Unknown error during scan.'))
-            if status_bar_label: status_bar_label.config(text="Scan failed! Ready.")
-            build_file_tree(); clear_details_panel() # Refresh tree even on error
-        elif msg_type == 'info':
-             # Informational message (e.g., no paths)
-             messagebox.showinfo("Scan Info", message.get('message', 'Scan information.'))
-             # Assume scan finished cleanly in this case
-             if scan_progress_bar: scan_progress_bar.stop(); scan_progress_bar.pack_forget()
-             if scan_button_ref: scan_button_ref.config(state=tk.NORMAL)
-             if status_bar_label: status_bar_label.config(text="Scan finished. Ready.")
-             build_file_tree(); clear_details_panel()
-        elif msg_type == 'finished':
-            # Scan finished successfully
-            if scan_progress_bar: scan_progress_bar.stop(); scan_progress_bar.pack_forget()
-            if scan_button_ref: scan_button_ref.config(state=tk.NORMAL) # Re-enable
-
-            # Format final message from received stats
-            duration = message.get('duration', 0)
-            final_msg = f"Scan Complete ({duration:.1f}s). Added: {message.get('added',0)}, Updated: {message.get('updated',0)}, Re-Indexed: {message.get('reindexed',0)}, Removed: {message.get('removed',0)}."
-            if message.get('errors', 0) > 0: final_msg += f" Text Errors: {message.get('errors',0)}."
-            final_msg += " Ready."
-            if status_bar_label: status_bar_label.config(text=final_msg)
-            messagebox.showinfo("Scan Complete", f"Scan finished in {duration:.1f} seconds.\nDocs Added: {message.get('added',0)}\nDocs Updated: {message.get('updated',0)}\nFiles Re-Indexed(FTS): {message.get('reindexed',0)}\nDocs Removed: {message.get('removed',0)}\nText Extraction Errors: {message.get('errors',0)}")
-            build_file_tree(); clear_details_panel() # Refresh tree
+        # Drain everything queued since the last tick; the worker can post many
+        # status messages per second, so handling one per tick would lag behind.
+        while True:
+            message = scan_status_queue.get_nowait()
+            msg_type = message.get('type')
+
+            if msg_type == 'status':
+                if status_bar_label: status_bar_label.config(text=message.get('message', 'Scanning...'))
+            elif msg_type == 'progress':
+                 # Optional: Update progress bar if using determinate mode later
+                 pass
+            elif msg_type == 'pipeline':
+                # Periodic per-stage throughput and queue depth from the scan pipeline
+                stage_text = " | ".join(f"{name} {stage['per_second']:.0f}/s (q {stage['queue']})" for name, stage in message.get('stages', {}).items())
+                if status_bar_label: status_bar_label.config(text=f"Scanning... {stage_text}")
+            elif msg_type == 'error':
+                # Error occurred in worker thread
+                end_scan_ui()
+                messagebox.showerror("Scan Error", message.get('message', 'Unknown error during scan.'))
+                if status_bar_label: status_bar_label.config(text="Scan failed! Ready.")
+                build_file_tree(); clear_details_panel() # Refresh tree even on error
+                return
+            elif msg_type == 'info':
+                 # Informational message (e.g., no paths); a 'finished' message follows
+                 messagebox.showinfo("Scan Info", message.get('message', 'Scan information.'))
+            elif msg_type == 'finished':
+                # Scan finished successfully
+                end_scan_ui()
+
+                # Format final message from received stats
+                duration = message.get('duration', 0)
+                final_msg = f"Scan Complete ({duration:.1f}s). Added: {message.get('added',0)}, Updated: {message.get('updated',0)}, Re-Indexed: {message.get('reindexed',0)}, Unchanged (touched): {message.get('touched',0)}, Removed: {message.get('removed',0)}."
+                if message.get('errors', 0) > 0: final_msg += f" Text Errors: {message.get('errors',0)}."
+                if message.get('quarantined'): final_msg += f" Quarantined (extraction too slow or crashed): {message['quarantined']}."
+                if message.get('quarantine_skipped'): final_msg += f" Skipped as quarantined: {message['quarantine_skipped']}."
+                if message.get('text_cache_lookups'): final_msg += f" Text cache: {format_cache_hits(message)}."
+                if message.get('duplicates'): final_msg += f" Identical copies (text shared): {message['duplicates']}."
+                if message.get('thumbnails'): final_msg += f" Thumbnails rendered: {message['thumbnails']['rendered']}."
+                if message.get('dirs_skipped'): final_msg += f" Unchanged folders skipped: {message.get('dirs_skipped',0)}."
+                if message.get('resumed'): final_msg += " (Resumed interrupted scan.)"
+                if message.get('bulk_build'): final_msg += " (Bulk build.)"
+                if message.get('fts_segments') is not None: final_msg += f" Index segments: {message['fts_segments']} (maintenance {message.get('fts_maintenance_seconds', 0):.1f}s)."
+                final_msg += " Ready."
+                if status_bar_label: status_bar_label.config(text=final_msg)
+                worker_lines = format_worker_stats(message.get('workers', {}))
+                worker_text = ("\n\nExtraction Throughput:\n" + "\n".join(worker_lines)) if worker_lines else ""
+                stage_lines = format_stage_stats(message.get('stages', {}))
+                if stage_lines: worker_text += "\n\nPipeline Stages:\n" + "\n".join(stage_lines)
+                messagebox.showinfo("Scan Complete", f"Scan finished in {duration:.1f} seconds.\nDocs Added: {message.get('added',0)}\nDocs Updated: {message.get('updated',0)}\nFiles Re-Indexed(FTS): {message.get('reindexed',0)}\nTouched, Content Unchanged: {message.get('touched',0)}\nDocs Removed: {message.get('removed',0)}\nText Extraction Errors: {message.get('errors',0)}\nNewly Quarantined: {message.get('quarantined',0)}{worker_text}")
+                build_file_tree(); clear_details_panel() # Refresh tree
+                return
 
     except queue.Empty:
         # Queue empty, check again later if scan is still running
-        # Check button state to see if scan is considered 'running' by the UI
-        if scan_button_ref and scan_button_ref['state'] == tk.DISABLED:
+        if scan_in_progress:
              root.after(100, check_scan_queue) # Check again in 100ms
     except Exception as e:
          print(f"Error processing scan status queue: {e}")
-         if scan_progress_bar: scan_progress_bar.stop(); scan_progress_bar.pack_forget()
-         if scan_button_ref: scan_button_ref.config(state=tk.NORMAL)
+         end_scan_ui()
          if status_bar_label: status_bar_label.config(text="Error processing scan results. Ready.")
-def start_scan_thread():
+def start_scan_thread(folder_manufacturers=None):
     """Disables UI, starts the scan worker thread, and initiates queue check."""
     global scan_button_ref, scan_status_queue, scan_progress_bar, root, status_bar_label
+    global scan_in_progress
 
-    # --- Check if scan is already running (optional) ---
-    # if scan_button_ref and scan_button_ref['state'] == tk.DISABLED:
-    #     messagebox.showinfo("Scan Info", "A scan is already in progress.")
-    #     return
+    if scan_in_progress:
+        messagebox.showinfo("Scan Info", "A scan is already in progress.")
+        return
+    scan_in_progress = True
 
     # --- Disable Scan Button ---
     if scan_button_ref: scan_button_ref.config(state=tk.DISABLED)
@@ -2072,12 +1624,112 @@ def start_scan_thread():
         except queue.Empty: break
 
     # --- Start Worker Thread ---
-    scan_thread = threading.Thread(target=scan_and_update_worker, args=(scan_status_queue,), daemon=True)
+    scan_thread = threading.Thread(target=scan_and_update_worker, args=(scan_status_queue, folder_manufacturers), daemon=True)
     scan_thread.start()
 
     # --- Start Queue Check Loop ---
     root.after(100, check_scan_queue) # Start checking the queue
 
+# --- Index Maintenance ---
+def optimize_search_index():
+    """File menu: full FTS optimize in a background thread (scans only merge incrementally)."""
+    if scan_in_progress:
+        messagebox.showinfo("Optimize Search Index", "Please wait until the scan has finished.")
+        return
+    if not messagebox.askyesno("Optimize Search Index", "Merge the whole full-text index into a single segment?\n\n"
+                               "This speeds up searches after many scans, but can take several minutes on a large index."):
+        return
+    if status_bar_label: status_bar_label.config(text="Optimizing search index...")
+    result_queue = queue.Queue()
+
+    def optimize_worker():
+        try:
+            with index_write_lock: # Waits for a watch-mode update in progress
+                result_queue.put(optimize_fts())
+        except Exception as e:
+            print(f"!!! Optimize error: {e}")
+            result_queue.put({'error': str(e)})
+
+    def check_optimize_result():
+        try:
+            result = result_queue.get_nowait()
+        except queue.Empty:
+            root.after(200, check_optimize_result)
+            return
+        if 'error' in result:
+            if status_bar_label: status_bar_label.config(text="Optimize failed. Ready.")
+            messagebox.showerror("Optimize Search Index", f"Could not optimize the search index:\n{result['error']}")
+            return
+        message = (f"Search index optimized in {result['duration']:.1f}s: "
+                   f"{result['segments_before']} -> {result['segments_after']} segments.")
+        if status_bar_label: status_bar_label.config(text=message + " Ready.")
+        messagebox.showinfo("Optimize Search Index", message)
+
+    threading.Thread(target=optimize_worker, daemon=True).start()
+    root.after(200, check_optimize_result)
+
+# --- Watch Mode (Live Indexing) ---
+def start_watch_mode():
+    """Starts the background watcher/reindexer thread for the configured scan paths."""
+    global watch_stop_event
+    if watch_stop_event: return # Already watching
+    scan_paths = get_scan_paths()
+    if not scan_paths:
+        if status_bar_label: status_bar_label.config(text="Watch mode: no scan paths configured.")
+        if watch_enabled_var: watch_enabled_var.set(False)
+        return
+    watch_stop_event = threading.Event()
+    watch_thread = threading.Thread(target=watch_and_index, args=(scan_paths, watch_stop_event), kwargs={
+        'status_callback': watch_status_queue.put,
+        'backend': config.get('Watch', 'backend', fallback='auto'),
+        'poll_interval': get_scan_setting('poll_interval', WATCH_POLL_INTERVAL, section='Watch'),
+        'debounce_seconds': get_scan_setting('debounce_seconds', WATCH_DEBOUNCE_SECONDS, section='Watch'),
+        'write_lock': index_write_lock, 'text_cache': bool(get_scan_setting('text_cache', 1)),
+        'folder_manufacturers': get_folder_manufacturers(),
+        'extract_file_timeout': get_scan_setting('extract_file_timeout', EXTRACT_FILE_TIMEOUT),
+        'extract_page_timeout': get_scan_setting('extract_page_timeout', EXTRACT_PAGE_TIMEOUT)}, daemon=True)
+    watch_thread.start()
+    if watch_enabled_var: watch_enabled_var.set(True)
+    if status_bar_label: status_bar_label.config(text=f"Watching {len(scan_paths)} scan path(s) for changes.")
+    root.after(500, check_watch_queue)
+
+def stop_watch_mode():
+    """Signals the watch thread to stop (it finishes the file it is indexing)."""
+    global watch_stop_event
+    if watch_stop_event: watch_stop_event.set()
+    watch_stop_event = None
+    if watch_enabled_var: watch_enabled_var.set(False)
+
+def toggle_watch_mode():
+    """File menu checkbutton handler; the choice is remembered in the config."""
+    if not config.has_section('Watch'): config.add_section('Watch')
+    if watch_enabled_var.get():
+        start_watch_mode()
+    else:
+        stop_watch_mode()
+        if status_bar_label: status_bar_label.config(text="Watch mode stopped. Ready.")
+    config['Watch']['enabled'] = '1' if watch_stop_event else '0'
+
+def check_watch_queue():
+    """Shows watch-mode activity in the status bar and refreshes the tree after changes."""
+    tree_changed = False
+    try:
+        while True:
+            message = watch_status_queue.get_nowait()
+            if message.get('type') == 'error':
+                stop_watch_mode()
+                if status_bar_label: status_bar_label.config(text="Watch mode stopped (error).")
+                messagebox.showerror("Watch Mode", message.get('message', 'Unknown watch mode error.'))
+                return
+            if message.get('type') == 'watch':
+                changes = ", ".join(f"{key} {message[key]}" for key in ('added', 'updated', 'touched', 'removed', 'errors') if message.get(key))
+                if status_bar_label: status_bar_label.config(text=f"Live index: {os.path.basename(message.get('path', ''))} ({changes})")
+                if message.get('added') or message.get('removed'): tree_changed = True
+    except queue.Empty:
+        pass
+    if tree_changed and not scan_in_progress: build_file_tree()
+    if watch_stop_event: root.after(500, check_watch_queue)
+
 def check_search_queue():
     """Checks the results queue from the search thread without blocking and updates GUI."""
     print(f"--- check_search_queue called (Time: {time.time():.2f}) ---") # DEBUG - Top level entry
@@ -2160,6 +1812,7 @@ def check_search_queue():
                  search_results_tree = tree # Assign to global
                  print(f"  -> Assigned Treeview widget: {search_results_tree}") # Debug
                  tree.bind("<Double-1>", on_search_result_double_click) # Bind double-click
+                 tree.bind("<<TreeviewSelect>>", on_search_result_select) # Details and preview of the hit
                  root.update_idletasks()
             except Exception as create_e:
                  print(f"  !!! ERROR CREATING SEARCH RESULTS TAB/TREE: {create_e}") # Debug
@@ -2178,7 +1831,8 @@ def check_search_queue():
 
              if results_data:
                   for i, row_data in enumerate(results_data):
-                       doc_id, filename, _, _, _, _ = row_data # Get basic info
+                       doc_id, filename, _, _, _, _, locations = row_data # Get basic info
+                       if locations > 1: filename = f"{filename} ({locations} locations)" # Identical copies collapsed
                        snippet_info = snippet_map.get(doc_id) # Get snippet/page from FTS results
                        if snippet_info: snippet, page_num = snippet_info; display_snippet = snippet.replace('\n', ' ').replace('\r', ''); display_page = str(page_num + 1) if page_num is not None else "N/A"
                        else: display_snippet = "(Metadata Match)"; display_page = "N/A"; page_num = None
@@ -2293,12 +1947,13 @@ def find_matching_docs_in_db(references_dict, current_doc_id):
                              # Find the highest-ranked document containing the ref_text via FTS
                              # Exclude the current document ID from FTS results as well
                              cursor.execute("""
-                                 SELECT fts.doc_id, d.filename
-                                 FROM documents_fts fts JOIN documents d ON fts.doc_id = d.id
-                                 WHERE fts.documents_fts MATCH ? AND fts.doc_id != ?
+                                 SELECT p.doc_id, d.filename
+                                 FROM documents_fts fts JOIN pages p ON p.id = fts.rowid JOIN documents d ON p.doc_id = d.id
+                                 WHERE fts.documents_fts MATCH ? AND p.doc_id != ?
+                                   AND d.content_hash IS NOT (SELECT content_hash FROM documents WHERE id = ?) -- Not an identical copy
                                  ORDER BY rank -- Get best match first
                                  LIMIT 1
-                             """, (ref_text, current_doc_id))
+                             """, (ref_text, current_doc_id, current_doc_id))
                              found_match_info = cursor.fetchone()
                              if found_match_info: print(f"     FOUND FTS match: ID={found_match_info[0]}, File={found_match_info[1]}")
                              else: print(f"     NO FTS match found.")
@@ -2349,22 +2004,17 @@ def suggest_links_for_current_doc():
     root.update_idletasks()
 
     # --- Extract text (use full text for better results) ---
-    # NOTE: Re-extracting text here is inefficient. Ideally, use indexed FTS text?
-    # But FTS text might lose context/formatting needed for regex.
-    # Let's re-extract for now.
+    # Prefer the indexer's text cache (same page text, no file access); re-extract otherwise
     full_text = ""
-    print(f"Extracting full text for {current_filepath}...")
-    ext = os.path.splitext(current_filepath)[1].lower()
     try:
-        if ext == '.pdf':
-             with fitz.open(current_filepath) as doc:
-                  for page in doc: full_text += page.get_text("text", sort=True) + "\n"
-        elif ext == '.docx' and DOCX_ENABLED:
-             doc = Document(current_filepath); full_text = "\n".join(p.text for p in doc.paragraphs)
-        elif ext == '.txt':
-             # Simple read, might fail on encoding
-              with open(current_filepath, 'r', encoding='utf-8', errors='ignore') as f: full_text = f.read()
-        # Add other formats if necessary
+        cached_pages = get_document_pages(current_doc_id)
+        if cached_pages is not None:
+            print(f"Using cached text for {current_filepath}...")
+            full_text = "\n".join(text for page_number, text in cached_pages)
+        else: # Same extractors as the indexer
+             result = extract_document_text(current_doc_id, current_filepath)
+             if result['error']: raise ValueError(result['error'])
+             full_text = "\n".join(text for page_number, text in result['pages'])
     except Exception as e:
          messagebox.showerror("Error", f"Could not extract text from current document:\n{e}")
          status_bar_label.config(text="Error extracting text. Ready.")
@@ -2449,6 +2099,15 @@ def suggest_links_for_current_doc():
     dialog.wait_window()
     status_bar_label.config(text="Ready.")
 
+def on_search_result_select(event):
+    """Shows the selected search result in the details panel, with the thumbnail of its best-matching page if cached."""
+    global search_results_tree, search_results_map
+    if not search_results_tree: return
+    target_data = search_results_map.get(search_results_tree.focus())
+    if not target_data or target_data.get('doc_id') is None: return
+    update_details_panel(target_data['doc_id'])
+    if target_data.get('page'): show_thumbnail_preview(target_data['doc_id'], target_data['page'])
+
 def on_search_result_double_click(event):
     """Handles double-click on the Search Results treeview item."""
     global search_results_tree, search_results_map
@@ -2750,6 +2409,8 @@ def go_to_favorite(fav_id, doc_id, page_number):
             target_page = max(0, min(page_number, doc_length - 1)) # Clamp page
             update_history_and_load(target_tab_id, target_page) # Use history nav
             print(f"Navigated tab {target_tab_id} to favorite/target page {target_page + 1}")
+        elif state and 'page_marks' in state: # Slides/sheets/sections/text pages shown as text
+            scroll_text_to_page(target_tab_id, page_number)
         else:
             print(f"Warning: Could not get document object for tab {target_tab_id} to navigate page.")
             messagebox.showwarning("Navigation Warning", "Opened document tab, but could not navigate to the specific page.")
@@ -2996,9 +2657,10 @@ def populate_tree_node(parent_iid, dir_path):
                 # Add a dummy child to make it expandable
                 file_tree.insert(folder_iid, tk.END, text="Loading...")
             elif is_supported_file:
-                file_tree.insert(parent_iid, tk.END, text=f" {item_name}",
+                file_iid = file_tree.insert(parent_iid, tk.END, text=f" {item_name}",
                              values=[item_path, "file"], # Store only path and type
                              image=file_icon)
+                if is_archive(item_path): file_tree.insert(file_iid, tk.END, text="Loading...") # Members listed on expand
 
     except OSError as e:
         print(f"Error reading directory {dir_path}: {e}")
@@ -3022,6 +2684,25 @@ def on_tree_open(event):
         children = file_tree.get_children(iid)
         if children and file_tree.item(children[0], "text") == "Loading...":
             populate_tree_node(iid, dir_path)
+    elif item_type == "file" and is_archive(file_tree.set(iid, "path")):
+        children = file_tree.get_children(iid)
+        if children and file_tree.item(children[0], "text") == "Loading...":
+            populate_archive_node(iid, file_tree.set(iid, "path"))
+
+def populate_archive_node(parent_iid, archive_path):
+    """Lists the indexed members of an archive under its tree node."""
+    global file_tree, file_icon
+    file_tree.delete(*file_tree.get_children(parent_iid))
+    conn = sqlite3.connect(DATABASE_FILE); cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT filepath FROM documents WHERE filepath >= ? AND filepath < ? ORDER BY filepath", archive_member_bounds(archive_path))
+        member_paths = [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as e: print(f"Error listing archive members of {archive_path}: {e}"); member_paths = []
+    finally: conn.close()
+    for member_path in member_paths:
+        file_tree.insert(parent_iid, tk.END, text=f" {split_archive_path(member_path)[1]}",
+                         values=[member_path, "file"], image=file_icon)
+    if not member_paths: file_tree.insert(parent_iid, tk.END, text="(No indexed members)")
 
 def build_file_tree():
     """Populates the top-level nodes of the file tree based on scan_paths."""
@@ -3289,6 +2970,8 @@ def update_metadata_tab(doc_id):
     global metadata_widgets
 
     details = get_document_details(doc_id) if doc_id else None
+    properties = get_document_properties(doc_id) if details else None # PDF info recorded at scan time
+    show_thumbnail_preview(doc_id if details else None)
 
     # Define the map based on SELECT order in get_document_details
     # 0=id, 1=filename, 2=filepath, 3=manufacturer, 4=device_model, 5=document_type,
@@ -3306,7 +2989,13 @@ def update_metadata_tab(doc_id):
         if key == 'edit_button': continue # Skip the button itself
 
         index = fields_map.get(key)
-        if widget and index is not None:
+        if widget and key == 'locations': # Other folders holding an identical copy
+            other_paths = [path for path in get_document_locations(doc_id) if path != details[2]] if details else []
+            widget.config(text="\n".join(other_paths) if other_paths else "N/A")
+        elif widget and key in DOCUMENT_PROPERTY_FIELDS:
+            value = properties.get(key) if properties else None
+            widget.config(text=str(value) if value not in (None, '') else "N/A")
+        elif widget and index is not None:
             # Check if details is None (clearing) or get the value
             value = details[index] if details else ""
             # Ensure value is a string before setting, handle None/empty
@@ -3442,6 +3131,18 @@ def update_notes_tab(doc_id):
     except: pass
     update_note_buttons_state() # Reset Edit/Delete based on selection (none initially)
     
+def show_thumbnail_preview(doc_id, page_number=0):
+    """Shows the cached thumbnail of a page (else of the first page) above the metadata; blank if none is cached. Never opens the document."""
+    global thumbnail_label
+    if not thumbnail_label: return
+    image_data = get_thumbnail(doc_id, page_number) if doc_id and PIL_ENABLED else None
+    if image_data is None and doc_id and PIL_ENABLED and page_number: image_data = get_thumbnail(doc_id, 0)
+    thumbnail_label.image = None
+    if image_data is not None:
+        try: thumbnail_label.image = ImageTk.PhotoImage(Image.open(io.BytesIO(image_data))) # Keep a reference
+        except Exception as e: print(f"Error showing thumbnail for doc {doc_id}: {e}")
+    thumbnail_label.config(image=thumbnail_label.image or '')
+
 def update_outline_tab(doc_id):
     """Updates the 'Outline' (TOC) tab."""
     # ... (Keep previous implementation) ...
@@ -3451,22 +3152,29 @@ def update_outline_tab(doc_id):
     details = get_document_details(doc_id) if doc_id else None
     if not details: outline_tree.insert('', tk.END, text="(Select a document)"); return
     filepath = details[2]; ext = os.path.splitext(filepath)[1].lower()
-    if ext == '.pdf':
-        try:
-            with fitz.open(filepath) as doc: toc = doc.get_toc(simple=False)
-            if toc:
-                parent_map = {'0': ''}
-                for item in toc:
-                    level, title, page, dest_info = item[:4]
-                    parent_iid = parent_map.get(str(level - 1), '')
-                    page_num_zero_based = page - 1
-                    # Store page number as the primary tag for navigation
-                    iid = outline_tree.insert(parent_iid, tk.END, text=f" {title}", values=[page], open=False, tags=(page_num_zero_based,))
-                    parent_map[str(level)] = iid
-            else: outline_tree.insert('', tk.END, text="(No outline found in PDF)")
-        except Exception as e: print(f"Err getting PDF TOC: {e}"); outline_tree.insert('', tk.END, text="(Error reading PDF outline)")
-    elif ext == '.docx' and DOCX_ENABLED: outline_tree.insert('', tk.END, text="(DOCX outline not yet supported)")
-    else: outline_tree.insert('', tk.END, text="(Outline unavailable for this file type)")
+    try: outline = load_document_outline(doc_id, filepath)
+    except Exception as e: print(f"Err getting PDF TOC: {e}"); outline_tree.insert('', tk.END, text="(Error reading PDF outline)"); return
+    parent_map = {0: ''}
+    for level, title, page_number in outline:
+        parent_iid = parent_map.get(level - 1, '')
+        parent_map[level] = insert_outline_item(parent_iid, title, page_number)
+    if not outline: outline_tree.insert('', tk.END, text="(No outline found in PDF)" if ext == '.pdf' else "(Outline unavailable for this file type)")
+
+def load_document_outline(doc_id, filepath):
+    """
+    Outline of a document as [(level, title, page_number), ...] (page_number zero-based, -1
+    if none). Bookmarks and headings come from the index; only PDFs indexed before their
+    bookmarks were recorded (no properties row) are opened to read them.
+    """
+    if os.path.splitext(filepath)[1].lower() == '.pdf' and get_document_properties(doc_id) is None:
+        with open_pdf_document(filepath) as doc:
+            return [(level, title, page - 1) for level, title, page, *_ in doc.get_toc(simple=False)]
+    return get_document_outline(doc_id)
+
+def insert_outline_item(parent_iid, title, page_number):
+    """Adds one outline entry; the zero-based page is its tag for navigation (none for bookmarks without a page)."""
+    if page_number < 0: return outline_tree.insert(parent_iid, tk.END, text=f" {title}", values=[""], open=False)
+    return outline_tree.insert(parent_iid, tk.END, text=f" {title}", values=[page_number + 1], open=False, tags=(page_number,))
 
 
 # --- Dialog Functions ---
@@ -3695,7 +3403,7 @@ def open_add_link_dialog():
         query = link_search_entry.get();
         if not query: return
         results_data = search_documents(query); link_results_list.delete(0, tk.END); link_results_map.clear(); count = 0 # search_documents now returns full data
-        for doc_id, filename, _, manuf, model, _ in results_data:
+        for doc_id, filename, _, manuf, model, _, _ in results_data:
              if doc_id == source_doc_id: continue
              display_text = f"{filename} ({manuf or '?'} / {model or '?'})"; link_results_list.insert(tk.END, display_text); link_results_map[count] = doc_id; count += 1
     link_search_entry.bind("<Return>", perform_link_search); search_button = ttk.Button(search_frame, text="Search", command=perform_link_search); search_button.pack(side=tk.LEFT, padx=5)
@@ -3770,6 +3478,8 @@ def open_manage_paths_dialog():
     close_button.pack(side=tk.RIGHT, padx=5) # Close on right
 
     dialog.wait_window()
+    if watch_stop_event: # Watch the updated path list
+        stop_watch_mode(); start_watch_mode()
 
 
 
@@ -3858,7 +3568,7 @@ def on_outline_double_click(event):
         print(f"Outline double-click: Tab for Doc ID {doc_id_of_outline} not found. Opening...")
         # We need the filepath to open it
         details = get_document_details(doc_id_of_outline)
-        if details and os.path.exists(details[2]):
+        if details and os.path.exists(split_archive_path(details[2])[0]):
              target_tab_id = open_document_in_tab(doc_id_of_outline) # Open the tab
              if target_tab_id:
                   target_state = tab_states.get(target_tab_id) # Get the state of the NEWLY opened tab
@@ -3876,6 +3586,11 @@ def on_outline_double_click(event):
         print(f"Outline nav failed: Could not find/create state for Doc ID {doc_id_of_outline}.")
         return # Should not happen if open_document_in_tab worked
 
+    if 'page_marks' in target_state: # Text view with a heading per page/section
+        if viewer_notebook.select() != target_tab_id: viewer_notebook.select(target_tab_id)
+        scroll_text_to_page(target_tab_id, page_num_zero_based)
+        return
+
     doc_obj = target_state.get('doc_obj')
     if not doc_obj or not isinstance(doc_obj, fitz.Document):
         # This might happen if the file opened is not a PDF or failed initial load
@@ -4082,20 +3797,18 @@ def filter_outline(event=None):
 
     # Get the source TOC data for the currently selected document
     selected_iid = file_tree.focus()
-    toc_data = [] # List to hold original TOC items: [level, title, page, dest]
+    toc_data = [] # List to hold original TOC items: (level, title, page_number)
     original_filepath = None
+    doc_id = get_selected_doc_id()
 
-    if selected_iid and file_tree.set(selected_iid, "type") == "file":
+    if doc_id is not None:
         filepath = file_tree.set(selected_iid, "path")
         original_filepath = filepath # Store for error messages
-        ext = os.path.splitext(filepath)[1].lower()
-        if ext == '.pdf':
-             try:
-                  with fitz.open(filepath) as doc:
-                       toc_data = doc.get_toc(simple=False)
-             except Exception as e:
-                  print(f"Error getting TOC for outline filter: {e}")
-                  toc_data = [] # Ensure it's an empty list on error
+        try:
+             toc_data = load_document_outline(doc_id, filepath)
+        except Exception as e:
+             print(f"Error getting TOC for outline filter: {e}")
+             toc_data = [] # Ensure it's an empty list on error
 
     # Clear the existing tree
     outline_tree.delete(*outline_tree.get_children())
@@ -4123,7 +3836,7 @@ def filter_outline(event=None):
         items_at_this_level = [item for item in toc_list if item[0] == current_level]
 
         for item in items_at_this_level:
-            level, title, page, dest_info = item[:4]
+            level, title, page_number = item
             # Check if title matches
             item_matches = query in title.lower()
             # Recursively check children (need to pass the rest of the list)
@@ -4141,9 +3854,8 @@ def filter_outline(event=None):
             if item_matches or child_matches:
                 matches_found_at_this_level_or_below = True
                 # Add this item and its data to our collection
-                page_num_zero_based = page - 1
                 # Use a unique ID based on index maybe? Or just store tuple
-                # For simplicity, store tuple: (level, title, page, page_num_zero_based)
+                # For simplicity, store tuple: (level, title, page_number)
                 matching_items_and_parents[tuple(item)] = {'children_match': child_matches} # Store item itself
 
         return matches_found_at_this_level_or_below
@@ -4153,14 +3865,10 @@ def filter_outline(event=None):
     # For now, let's just list the matching items flatly (simpler)
 
     matches_count = 0
-    for item in toc_data:
-         level, title, page, dest_info = item[:4]
+    for level, title, page_number in toc_data:
          if query in title.lower():
-              page_num_zero_based = page - 1
               # Insert directly into root for now (flat list of matches)
-              outline_tree.insert('', tk.END, text=f" {title}",
-                                  values=[page], open=False,
-                                  tags=(page_num_zero_based,))
+              insert_outline_item('', title, page_number)
               matches_count += 1
 
     if matches_count == 0:
@@ -4212,10 +3920,11 @@ def perform_search(event=None):
 # --- Main GUI Construction ---
 def create_main_window():
     global root, viewer_notebook, details_notebook, file_tree, search_entry, status_bar_label
-    global metadata_widgets, links_listbox, links_map, notes_text_widget, outline_tree, outline_search_entry
+    global metadata_widgets, thumbnail_label, links_listbox, links_map, notes_text_widget, outline_tree, outline_search_entry
     global main_paned_window
     global favorites_menu # Declare global reference
     global search_button_ref
+    global watch_enabled_var
     
 
     root = tk.Tk()
@@ -4326,6 +4035,9 @@ def create_main_window():
     menubar.add_cascade(label="File", menu=file_menu)
     file_menu.add_command(label="Manage Scan Paths...", command=open_manage_paths_dialog)
     file_menu.add_command(label="Scan/Update Index", command=scan_and_update_index, accelerator="Ctrl+S")
+    watch_enabled_var = tk.BooleanVar(value=False)
+    file_menu.add_checkbutton(label="Watch Folders (Live Indexing)", variable=watch_enabled_var, command=toggle_watch_mode)
+    file_menu.add_command(label="Optimize Search Index...", command=optimize_search_index)
     file_menu.add_command(label="Open Selected Externally", command=open_file_externally_selected, accelerator="Ctrl+O")
     file_menu.add_command(label="Close Current Tab", command=close_current_tab, accelerator="Ctrl+W")
     file_menu.add_separator()
@@ -4437,10 +4149,12 @@ def create_main_window():
     metadata_tab_frame = ttk.Frame(details_notebook, padding=10)
     details_notebook.add(metadata_tab_frame, text=" Metadata ")
     metadata_widgets.clear(); row_num = 0
-    field_labels = {'filename': "Filename:", 'filepath': "Filepath:", 'manufacturer': "Manufacturer:", 'device_model': "Device Model:", 'document_type': "Document Type:", 'revision_number': "Revision:", 'revision_date': "Rev Date:", 'status': "Status:", 'applicable_models': "Other Models:", 'associated_test_equipment': "Test Equip:", 'keywords': "Keywords:"}
+    thumbnail_label = ttk.Label(metadata_tab_frame, anchor='center'); thumbnail_label.grid(row=row_num, column=0, columnspan=2, pady=(0, 5)); row_num += 1
+    field_labels = {'filename': "Filename:", 'filepath': "Filepath:", 'manufacturer': "Manufacturer:", 'device_model': "Device Model:", 'document_type': "Document Type:", 'revision_number': "Revision:", 'revision_date': "Rev Date:", 'status': "Status:", 'applicable_models': "Other Models:", 'associated_test_equipment': "Test Equip:", 'keywords': "Keywords:",
+                    'locations': "Locations:", 'page_count': "Pages:", 'title': "PDF Title:", 'author': "Author:", 'producer': "Producer:", 'created': "Created:"}
     for key, label_text in field_labels.items():
         lbl_static = ttk.Label(metadata_tab_frame, text=label_text, style="Bold.TLabel"); lbl_static.grid(row=row_num, column=0, sticky="nw", padx=0, pady=1)
-        wrap = 300 if key in ['filepath', 'keywords', 'applicable_models', 'associated_test_equipment'] else 250
+        wrap = 300 if key in ['filepath', 'locations', 'keywords', 'applicable_models', 'associated_test_equipment'] else 250
         lbl_dynamic = ttk.Label(metadata_tab_frame, text="N/A", wraplength=wrap, anchor='w'); lbl_dynamic.grid(row=row_num, column=1, sticky="ew", padx=5, pady=1); metadata_widgets[key] = lbl_dynamic; row_num += 1
     metadata_tab_frame.columnconfigure(1, weight=1)
     edit_meta_button = ttk.Button(metadata_tab_frame, text="Edit Metadata...", command=open_edit_metadata_dialog, state=tk.DISABLED); edit_meta_button.grid(row=row_num, column=0, columnspan=2, pady=(15, 0), sticky='ew'); metadata_widgets['edit_button'] = edit_meta_button
@@ -4508,6 +4222,7 @@ def create_main_window():
 # --- Initialization ---
 # (Keep the if __name__ == "__main__": block the same as the previous version)
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Extraction pool workers re-launch the frozen exe
     metadata_widgets = {}; links_map = {}; selected_note_id = None
     config = configparser.ConfigParser() # Initialize config parser instance
 
@@ -4524,6 +4239,7 @@ if __name__ == "__main__":
     # --- Restore Session ---
     root.after(200, restore_session_tabs) # Restore tabs shortly after window appears
     update_add_favorite_menu_state()
+    if config.getboolean('Watch', 'enabled', fallback=False): start_watch_mode()
     # --- Apply Saved Sash Positions ---
     # (Moved inside create_main_window using root.after)
 
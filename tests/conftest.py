@@ -0,0 +1,67 @@
+# BME Document Navigator - Test Fixtures
+# Scans run over small generated libraries under tmp_path; TXT/HTML/CSV/RTF and the
+# Office formats need no third-party package, so PyMuPDF is not needed.
+#   python -m pytest -q
+import os
+import sys
+import time
+import sqlite3
+import subprocess
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bme_indexer import init_db, scan_and_index, search_content_snippets
+
+
+@pytest.fixture
+def library(tmp_path):
+    """A folder of documents and an initialized index database: (folder, db_path)."""
+    folder = tmp_path / 'library'
+    folder.mkdir()
+    db_path = str(tmp_path / 'index.db')
+    init_db(db_path)
+    return folder, db_path
+
+
+def write_file(path, content, mtime=None):
+    """Writes text or bytes to path; mtime (seconds) defaults to a second after the current one, so edits are seen."""
+    old_mtime = os.path.getmtime(path) if os.path.exists(path) else time.time()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(content, bytes): path.write_bytes(content)
+    else: path.write_text(content)
+    os.utime(path, (mtime or old_mtime + 1,) * 2)
+
+
+def scan(folder, db_path, **options):
+    """scan_and_index() of folder, extracting in this process and without the text cache unless options say otherwise."""
+    options = dict({'workers': 0, 'text_cache': False}, **options)
+    return scan_and_index([str(folder)], db_path=db_path, **options)
+
+
+def query(db_path, sql, params=()):
+    """Rows of one SELECT on a fresh connection."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def documents(db_path):
+    """{filename: (id, text_doc_id)} of every indexed document."""
+    return {filename: (doc_id, text_doc_id) for filename, doc_id, text_doc_id in
+            query(db_path, "SELECT filename, id, text_doc_id FROM documents")}
+
+
+def found(text, db_path):
+    """Sorted filenames of the documents search_content_snippets finds for text."""
+    return sorted(row[1] for row in search_content_snippets(text, db_path))
+
+
+def hold_scan_lock(db_path):
+    """Starts a process that holds the scan lock of db_path until its stdin is closed; returns it once the lock is held."""
+    holder = subprocess.Popen([sys.executable, '-c', "import sys, bme_indexer; lock = bme_indexer.acquire_scan_lock(sys.argv[1]);"
+                               "print('locked', flush=True); sys.stdin.read()", db_path],
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    assert any(line.strip() == 'locked' for line in iter(holder.stdout.readline, '')) # After import-time warnings
+    return holder
@@ -0,0 +1,87 @@
+# BME Document Navigator - Command Line Tests
+# bme_cli.main() end to end: exit codes, output, and the cross-process scan lock.
+import os
+import json
+import pytest
+import bme_indexer
+from bme_cli import main, EXIT_OK, EXIT_NO_MATCHES, EXIT_USAGE, EXIT_PARTIAL, EXIT_ERROR
+from conftest import write_file, query, hold_scan_lock
+
+
+@pytest.fixture
+def cli(tmp_path):
+    """Runs bme_cli.main with a database and config under tmp_path: cli(*args) -> exit code."""
+    db_path = str(tmp_path / 'index.db')
+    return lambda *args: main(['--db', db_path, '--config', str(tmp_path / 'none.ini')] + list(args))
+
+
+def test_index_then_search(cli, tmp_path, capsys):
+    folder = tmp_path / 'library'
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    assert cli('index', '--add-path', str(folder), '--workers', '0') == EXIT_OK
+    assert "pages/s written" in capsys.readouterr().out
+    assert cli('search', 'occlusion') == EXIT_OK
+    assert 'pump.txt' in capsys.readouterr().out
+    assert cli('search', 'defibrillator') == EXIT_NO_MATCHES
+
+
+def test_index_counts_pages_from_cache_and_stream(cli, tmp_path, capsys, monkeypatch):
+    folder = tmp_path / 'library'
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'log.txt', "ventilator log line\n" * 3000)
+    monkeypatch.setattr(bme_indexer, 'TXT_STREAM_BYTES', 1024) # log.txt goes straight to the writer
+    assert cli('index', '--add-path', str(folder), '--workers', '0', '--json') == EXIT_OK
+    first = json.loads(capsys.readouterr().out)
+    assert first['pages'] == 2 and sum(worker['pages'] for worker in first['workers'].values()) == 1
+    os.remove(str(tmp_path / 'index.db')) # Rebuilt from the text cache: no extraction, still pages written
+    assert cli('index', '--add-path', str(folder), '--workers', '0', '--json') == EXIT_OK
+    second = json.loads(capsys.readouterr().out)
+    assert second['text_cache_hits'] == 1 and second['pages'] == 2
+
+
+def test_index_without_scan_paths_is_a_usage_error(cli):
+    assert cli('index') == EXIT_USAGE
+
+
+def test_index_with_unreadable_file_is_partial(cli, tmp_path):
+    folder = tmp_path / 'library'
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'broken.docx', b"not a zip file")
+    assert cli('index', '--add-path', str(folder), '--workers', '0') == EXIT_PARTIAL
+
+
+def test_search_without_database_is_an_error(cli, tmp_path):
+    assert cli('search', 'pump') == EXIT_ERROR
+    assert not os.path.exists(tmp_path / 'index.db')
+
+
+@pytest.mark.parametrize('command', ['stats', 'optimize'])
+def test_maintenance_without_database_is_an_error(cli, tmp_path, capsys, command):
+    assert cli(command) == EXIT_ERROR
+    assert "No index database" in capsys.readouterr().err
+    assert not os.path.exists(tmp_path / 'index.db')
+
+
+def test_search_of_a_database_without_tables_is_an_error(cli, tmp_path):
+    (tmp_path / 'index.db').write_bytes(b"")
+    assert cli('search', 'pump') == EXIT_ERROR
+
+
+def test_index_refuses_while_another_process_scans(cli, tmp_path, capsys):
+    folder = tmp_path / 'library'
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    assert cli('index', '--add-path', str(folder), '--workers', '0') == EXIT_OK
+    db_path = str(tmp_path / 'index.db')
+    holder = hold_scan_lock(db_path)
+    try:
+        capsys.readouterr()
+        assert cli('index', '--workers', '0') == EXIT_ERROR
+        assert f"pid {holder.pid}" in capsys.readouterr().err
+    finally:
+        holder.stdin.close()
+        holder.wait(10)
+    # The holder is gone, and with it the lock: a 'running' row it left is resumed
+    bme_indexer.sqlite3.connect(db_path).execute("UPDATE scan_journal SET status='running'").connection.commit()
+    assert cli('index', '--workers', '0', '--json') == EXIT_OK
+    assert json.loads(capsys.readouterr().out)['resumed']
+    assert query(db_path, "SELECT status FROM scan_journal") == [('completed',)]
@@ -0,0 +1,130 @@
+# BME Document Navigator - Extraction Pool Tests
+# Scans with worker processes. The fake worker loops below stand in for
+# bme_indexer.extraction_worker_main: 'spawn' pickles them by reference, so the
+# workers import this module and run them.
+import os
+import time
+import pytest
+import bme_indexer
+from conftest import write_file, scan, query, found
+
+
+def worker_that_never_starts(job_conn):
+    os._exit(3)
+
+
+def worker_crashing_on(job_conn, crash=lambda filepath: 'crash' in os.path.basename(filepath)):
+    """Sends 'ready', then crashes on files for which crash(filepath) is true and extracts the rest."""
+    job_conn.send(('ready', os.getpid()))
+    while True:
+        job = job_conn.recv()
+        if job is None: break
+        if crash(job[1]): os._exit(9)
+        if 'slow' in os.path.basename(job[1]): time.sleep(60)
+        job_conn.send(('done', bme_indexer.extract_document_text(job[0], job[1], thumbnails=job[2], text=job[3])))
+
+
+def crash_once(filepath):
+    """True the first time a 'flaky' file is seen: leaves a marker next to it (not a supported file type)."""
+    if 'flaky' not in os.path.basename(filepath) or os.path.exists(filepath + '.crashed'): return False
+    open(filepath + '.crashed', 'w').close()
+    return True
+
+
+def worker_crashing_once(job_conn):
+    worker_crashing_on(job_conn, crash_once)
+
+
+def count_worker_starts(monkeypatch):
+    """Counts the extraction processes started from now on: a list holding the count."""
+    starts, start_worker = [0], bme_indexer.start_extraction_worker
+
+    def counted_start(context):
+        starts[0] += 1
+        return start_worker(context)
+    monkeypatch.setattr(bme_indexer, 'start_extraction_worker', counted_start)
+    return starts
+
+
+# --- Process pool ---
+def test_pool_scan_extracts_in_worker_processes(library, monkeypatch):
+    folder, db_path = library
+    starts = count_worker_starts(monkeypatch)
+    names = [f'manual{number:02}.txt' for number in range(12)]
+    for number, name in enumerate(names):
+        write_file(folder / name, f"service manual number{number} " * (3000 if number == 0 else 10))
+    stats = scan(folder, db_path, workers=3)
+    assert stats['added'] == 12 and stats['reindexed'] == 12 and stats['errors'] == 0
+    assert starts[0] == 3
+    assert os.getpid() not in stats['workers'] and sum(worker['files'] for worker in stats['workers'].values()) == 12
+    assert [row[0] for row in query(db_path, "SELECT filename FROM documents ORDER BY id")] == names
+    assert found("number7", db_path) == ['manual07.txt']
+
+
+def test_pool_is_not_started_without_extraction_work(library, monkeypatch):
+    folder, db_path = library
+    for number in range(3):
+        write_file(folder / f'manual{number}.txt', f"service manual number{number}")
+    scan(folder, db_path, workers=2, text_cache=True)
+    starts = count_worker_starts(monkeypatch)
+    stats = scan(folder, db_path, workers=2) # Nothing changed
+    assert stats['added'] == stats['updated'] == 0 and starts[0] == 0
+
+    os.remove(db_path) # Same files again: all of them from the text cache
+    bme_indexer.init_db(db_path)
+    stats = scan(folder, db_path, workers=2, text_cache=True)
+    assert stats['added'] == 3 and stats['text_cache_hits'] == 3 and starts[0] == 0
+    assert found("number1", db_path) == ['manual1.txt']
+
+
+# --- Quarantine and budgets ---
+def test_worker_over_budget_is_killed_and_file_quarantined(library, monkeypatch):
+    folder, db_path = library
+    monkeypatch.setattr(bme_indexer, 'extraction_worker_main', worker_crashing_on)
+    write_file(folder / 'slow.txt', "never extracted")
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    stats = scan(folder, db_path, workers=2, extract_file_timeout=3, extract_page_timeout=3)
+    assert stats['quarantined'] == 1 and stats['errors'] == 1
+    assert [row[0] for row in query(db_path, "SELECT filepath FROM quarantine")] == [str(folder / 'slow.txt')]
+    assert found("occlusion", db_path) == ['pump.txt']
+
+    os.utime(folder / 'slow.txt', (time.time() + 60,) * 2) # Same content: not extracted again
+    stats = scan(folder, db_path, workers=2, extract_file_timeout=3, extract_page_timeout=3)
+    assert stats['touched'] == 1 and stats['quarantined'] == 0
+    write_file(folder / 'slow.txt', "changed content")
+    monkeypatch.undo()
+    stats = scan(folder, db_path, workers=1)
+    assert stats['updated'] == 1 and stats['errors'] == 0
+    assert query(db_path, "SELECT filepath FROM quarantine") == []
+
+
+def test_file_crashing_twice_is_quarantined(library, monkeypatch):
+    folder, db_path = library
+    monkeypatch.setattr(bme_indexer, 'extraction_worker_main', worker_crashing_on)
+    write_file(folder / 'crash.txt', "crashes every worker")
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    stats = scan(folder, db_path, workers=1)
+    assert stats['quarantined'] == 1
+    assert [row[0] for row in query(db_path, "SELECT filepath FROM quarantine")] == [str(folder / 'crash.txt')]
+    assert found("occlusion", db_path) == ['pump.txt']
+
+
+def test_file_crashing_once_is_retried(library, monkeypatch):
+    folder, db_path = library
+    monkeypatch.setattr(bme_indexer, 'extraction_worker_main', worker_crashing_once)
+    write_file(folder / 'flaky.txt', "infusion pump occlusion alarm")
+    stats = scan(folder, db_path, workers=1)
+    assert stats['quarantined'] == 0 and stats['errors'] == 0 and stats['reindexed'] == 1
+    assert os.path.exists(str(folder / 'flaky.txt') + '.crashed') # It did crash a worker
+    assert found("occlusion", db_path) == ['flaky.txt']
+
+
+def test_workers_that_cannot_start_fail_the_scan(library, monkeypatch):
+    folder, db_path = library
+    monkeypatch.setattr(bme_indexer, 'extraction_worker_main', worker_that_never_starts)
+    for number in range(5):
+        write_file(folder / f'doc{number}.txt', f"manual number{number}")
+    with pytest.raises(RuntimeError, match="failing to start"):
+        scan(folder, db_path, workers=2)
+    assert query(db_path, "SELECT COUNT(*) FROM quarantine") == [(0,)]
+    assert query(db_path, "SELECT status FROM scan_journal") == [('interrupted',)]
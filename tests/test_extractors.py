@@ -0,0 +1,143 @@
+# BME Document Navigator - Text Extractor Tests
+# The extractors called directly on small generated files. Office packages are built
+# with zipfile from the few parts the extractors read.
+import io
+import zipfile
+import bme_indexer
+from bme_indexer import (extract_docx_pages, extract_html_pages, extract_pptx_pages, extract_xlsx_pages, extract_csv_pages, extract_rtf_pages,
+                         parse_pdf_date, iter_txt_pages)
+
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PML_NS = 'http://schemas.openxmlformats.org/presentationml/2006/main'
+SML_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+DML_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+WML_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def ooxml_package(parts):
+    """Bytes of a zip package holding {part_name: xml_text}."""
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as package:
+        for name, xml in parts.items(): package.writestr(name, xml)
+    return data.getvalue()
+
+
+def relationships(targets):
+    """A .rels part relating rId1, rId2, ... to targets."""
+    return (f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(f'<Relationship Id="rId{number}" Target="{target}"/>' for number, target in enumerate(targets, 1))
+            + '</Relationships>')
+
+
+def docx(body, styles=''):
+    """A DOCX package from the WordprocessingML of its body and style definitions."""
+    return ooxml_package({'word/document.xml': f'<w:document xmlns:w="{WML_NS}"><w:body>{body}</w:body></w:document>',
+                          'word/styles.xml': f'<w:styles xmlns:w="{WML_NS}">{styles}</w:styles>'})
+
+
+def paragraph(text, style=None):
+    """A w:p with one run of text, in the given paragraph style."""
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}<w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+def pptx(slides):
+    """A PPTX package; slides is a list of slides, each a list of paragraphs, listed in reverse part order."""
+    parts = {'ppt/_rels/presentation.xml.rels': relationships(f'slides/slide{number}.xml' for number in range(1, len(slides) + 1)),
+             'ppt/presentation.xml': f'<p:presentation xmlns:p="{PML_NS}" xmlns:r="{REL_NS}"><p:sldIdLst>'
+                                     + ''.join(f'<p:sldId r:id="rId{number}"/>' for number in range(len(slides), 0, -1))
+                                     + '</p:sldIdLst></p:presentation>'}
+    for number, paragraphs in enumerate(slides, 1):
+        parts[f'ppt/slides/slide{number}.xml'] = (f'<p:sld xmlns:p="{PML_NS}" xmlns:a="{DML_NS}"><a:txBody>'
+                                                  + ''.join(f'<a:p><a:r><a:t>{text}</a:t></a:r></a:p>' for text in paragraphs)
+                                                  + '</a:txBody></p:sld>')
+    return ooxml_package(parts)
+
+
+def test_docx_pages_split_at_headings_and_page_breaks():
+    styles = ('<w:style w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>'
+              '<w:style w:styleId="ServiceHeading"><w:name w:val="Service Heading"/><w:basedOn w:val="Heading1"/></w:style>')
+    body = (paragraph("Intro text") + paragraph("Alarms", 'Heading1') + paragraph("Occlusion alarm")
+            + '<w:p><w:r><w:br w:type="page"/></w:r></w:p>' + paragraph("Battery")
+            + paragraph("Service", 'ServiceHeading') + '<w:p><w:r><w:t>replace</w:t><w:tab/><w:t>battery</w:t></w:r></w:p>')
+    outline = []
+    pages = extract_docx_pages(docx(body, styles), outline=outline)
+    assert pages == [(0, "Intro text"), (1, "Alarms\nOcclusion alarm"), (2, "Battery"), (3, "Service\nreplace\tbattery")]
+    assert outline == [(1, "Alarms", 1), (1, "Service", 3)]
+
+
+def test_html_text_sections_and_skipped_scripts():
+    page = ('<html><head><meta charset="windows-1252"><style>p { color: red }</style>'
+            '<script>var alarm = "occlusion";</script></head><body>'
+            '<p>Intro &amp; safety</p><h2>Alarms</h2><p>Occlusion <b>alarm</b><br>Caf\xe9</p>'
+            '<h3>Battery</h3><ul><li>Replace</li><li>Test</li></ul></body></html>').encode('cp1252')
+    outline = []
+    pages = extract_html_pages(page, outline=outline)
+    assert pages == [(0, "Intro & safety"), (1, "Alarms\nOcclusion alarm\nCafé"), (2, "Battery\nReplace\nTest")]
+    assert outline == [(2, "Alarms", 1), (3, "Battery", 2)]
+
+
+def test_pptx_slides_are_pages_in_presentation_order():
+    pages = extract_pptx_pages(pptx([["Battery service"], ["Pump overview", "Occlusion alarm"]]))
+    assert pages == [(0, "Pump overview\nOcclusion alarm"), (1, "Battery service")]
+
+
+def test_xlsx_sheets_are_pages_with_shared_strings():
+    package = ooxml_package({
+        'xl/_rels/workbook.xml.rels': relationships(['worksheets/sheet1.xml']),
+        'xl/workbook.xml': f'<workbook xmlns="{SML_NS}" xmlns:r="{REL_NS}"><sheets><sheet name="Devices" r:id="rId1"/></sheets></workbook>',
+        'xl/sharedStrings.xml': f'<sst xmlns="{SML_NS}"><si><t>Infusion pump</t></si><si><t>Ward 3</t></si></sst>',
+        'xl/worksheets/sheet1.xml': f'<worksheet xmlns="{SML_NS}"><sheetData>'
+                                    '<row><c t="s"><v>0</v></c><c t="s"><v>1</v></c><c><v>42</v></c></row>'
+                                    '</sheetData></worksheet>'})
+    assert extract_xlsx_pages(package) == [(0, "Devices\nInfusion pump\tWard 3\t42")]
+
+
+def test_txt_pages_end_at_line_breaks_and_long_lines_are_cut(monkeypatch):
+    monkeypatch.setattr(bme_indexer, 'TEXT_PAGE_CHARS', 16)
+    pages = list(iter_txt_pages(b"line one\nline two\nline three\n" + b"x" * 40))
+    assert pages == [(0, "line one\nline two\n"), (1, "line three\n" + "x" * 21), (2, "x" * 19)] # 16 characters, then up to 16 more to the line end
+    pages = list(iter_txt_pages(b"a" * 16 + b"\n" + b" " * 16 + b"\n" + b"b\n"))
+    assert pages == [(0, "a" * 16 + "\n"), (2, "b\n")] # Blank pages keep their number but are not indexed
+
+
+def test_txt_encodings_are_sniffed_and_bad_bytes_replaced(monkeypatch):
+    assert list(iter_txt_pages("pump alarm\r\n".encode('utf-16'))) == [(0, "pump alarm\r\n")]
+    assert list(iter_txt_pages(b"caf\xe9 alarm")) == [(0, "caf\xe9 alarm")] # cp1252
+    monkeypatch.setattr(bme_indexer, 'TEXT_SNIFF_BYTES', 4) # Sample ends inside the UTF-8 'é'
+    assert list(iter_txt_pages("café alarm".encode() + b" \xff end")) == [(0, "café alarm \ufffd end")]
+
+def test_csv_rows_become_tab_separated_lines():
+    pages = extract_csv_pages(b'device;location;serial\r\npump;ward 3;A-17 \r\n\r\nmonitor;ICU;B-4\r\n')
+    assert pages == [(0, "device\tlocation\tserial\npump\tward 3\tA-17\nmonitor\tICU\tB-4")]
+
+
+def test_csv_is_paged_by_rows_and_long_rows_are_cut(monkeypatch):
+    monkeypatch.setattr(bme_indexer, 'TEXT_PAGE_CHARS', 100)
+    rows = [f"pump{number},ward{number},serial{number:04}" for number in range(30)]
+    pages = extract_csv_pages(("\n".join(rows) + "\n" + "x" * 250 + ",end\n").encode('utf-16'))
+    assert [page_num for page_num, text in pages] == list(range(len(pages))) and len(pages) > 5
+    lines = "\n".join(text for page_num, text in pages).split("\n")
+    assert lines[:30] == [row.replace(',', '\t') for row in rows] # No row split between pages
+    assert all(len(line) <= 100 for line in lines) and "".join(lines[30:]) == "x" * 250 + "\tend"
+
+
+def test_rtf_text_pages_and_skipped_groups():
+    rtf = (rb"{\rtf1\ansi\ansicpg1252{\fonttbl{\f0 Arial;}}{\*\generator Writer;}"
+           rb"\pard Infusion pump\par Caf\'e9 \u8364?5\tab ward\page Second page\par}")
+    assert extract_rtf_pages(rtf) == [(0, "Infusion pump\nCafé €5\tward"), (1, "Second page")]
+
+
+def test_rtf_tokens_are_not_cut_between_chunks(monkeypatch):
+    monkeypatch.setattr(bme_indexer, 'TEXT_PAGE_CHARS', 7) # Chunk ends fall inside control words and escapes
+    body = "".join(rf"{{\b pump{number}}}\par Caf\'e9\par" + "\n" for number in range(20))
+    pages = extract_rtf_pages(("{\\rtf1\\ansi{\\fonttbl{\\f0 Arial;}}" + body + "}").encode('ascii'))
+    assert pages == [(0, "\n".join(f"pump{number}\nCafé" for number in range(20)))]
+
+
+def test_pdf_dates_full_partial_and_unparseable():
+    assert parse_pdf_date("D:20230115103000+01'00'") == "2023-01-15 10:30:00"
+    assert parse_pdf_date("D:202301") == "2023-01-01 00:00:00"
+    assert parse_pdf_date("20230115") == "2023-01-15 00:00:00" # No D: prefix
+    assert parse_pdf_date("yesterday") == "yesterday"
+    assert parse_pdf_date("") is None and parse_pdf_date(None) is None
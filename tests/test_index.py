@@ -0,0 +1,250 @@
+# BME Document Navigator - Index Tests
+# Index-level behaviour: the bulk build of a new index, FTS segment merging,
+# compressed page text, the trigram code index, the thumbnail cache and recorded
+# document properties and outlines, streamed text, and the migration of an
+# original-schema index.
+import os
+import time
+import sqlite3
+import pytest
+import bme_indexer
+from bme_indexer import (TRIGRAM_ENABLED, connect_index, optimize_fts, set_page_compression, search_content_snippets,
+                         set_code_index, is_code_query, route_fts_query, open_thumbnail_cache, store_thumbnails,
+                         evict_thumbnails, get_thumbnail, generate_thumbnails, write_extraction_result,
+                         get_document_properties, get_document_outline, init_db, search_documents)
+from conftest import write_file, scan, query, found
+
+
+def index_names(db_path):
+    """Names of the secondary indexes and FTS tables in the database."""
+    return {name for (name,) in query(db_path, "SELECT name FROM sqlite_master WHERE name LIKE 'idx_%' OR name LIKE '%_fts'")}
+
+
+# --- Bulk build ---
+def test_first_scan_is_a_bulk_build(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'vent.txt', "ventilator circuit leak test")
+    names, journal_mode = index_names(db_path), query(db_path, "PRAGMA journal_mode")
+    stats = scan(folder, db_path)
+    assert stats['bulk_build'] and stats['added'] == 2
+    assert index_names(db_path) == names and 'idx_doc_filepath' in names # Dropped, then created again
+    assert ('documents_code_fts' in names) == TRIGRAM_ENABLED
+    assert query(db_path, "PRAGMA journal_mode") == journal_mode
+    assert found("occlusion", db_path) == ['pump.txt']
+
+    write_file(folder / 'monitor.txt', "patient monitor lead off")
+    stats = scan(folder, db_path)
+    assert not stats['bulk_build'] and stats['added'] == 1
+    assert found("lead", db_path) == ['monitor.txt']
+
+
+def test_bulk_build_can_be_turned_off(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    stats = scan(folder, db_path, bulk_build=False)
+    assert not stats['bulk_build']
+    assert found("occlusion", db_path) == ['pump.txt']
+
+
+# --- FTS segments ---
+def test_segments_are_merged_after_scans_and_by_optimize(library):
+    folder, db_path = library
+    for number in range(6): # One FTS segment per scan while merging is off
+        write_file(folder / f'manual{number}.txt', f"service manual number{number}")
+        stats = scan(folder, db_path, fts_merge_pages=0)
+    assert stats['fts_segments'] == 6
+
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    stats = scan(folder, db_path)
+    assert stats['fts_segments'] < 7
+    write_file(folder / 'vent.txt', "ventilator circuit leak test")
+    scan(folder, db_path, fts_merge_pages=0)
+    result = optimize_fts(db_path)
+    assert result['segments_before'] > 1 and result['segments_after'] == 1
+    assert found("number3", db_path) == ['manual3.txt'] and found("leak", db_path) == ['vent.txt']
+
+
+# --- Page compression ---
+def test_compressed_pages_are_searched_written_and_removed(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm, check the line. " * 200)
+    write_file(folder / 'vent.txt', "ventilator circuit leak test. " * 200)
+    scan(folder, db_path)
+    stats = set_page_compression(db_path, 6)
+    assert stats['pages'] == stats['converted'] == 2
+    assert query(db_path, "SELECT DISTINCT typeof(text) FROM pages") == [('blob',)]
+    [(doc_id, filename, filepath, snippet, page_number)] = search_content_snippets("occlusion", db_path)
+    assert filename == 'pump.txt' and "[occlusion]" in snippet # The snippet comes from the decompressed text
+
+    write_file(folder / 'monitor.txt', "patient monitor lead off. " * 200) # Written compressed
+    os.remove(folder / 'vent.txt') # Its index entries are deleted with the decompressed text
+    scan(folder, db_path)
+    assert query(db_path, "SELECT DISTINCT typeof(text) FROM pages") == [('blob',)]
+    assert found("lead", db_path) == ['monitor.txt'] and found("leak", db_path) == []
+    conn = connect_index(db_path)
+    conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('integrity-check')") # Raises if the index is corrupt
+    conn.close()
+
+    stats = set_page_compression(db_path, 0)
+    assert stats['converted'] == 2
+    assert query(db_path, "SELECT DISTINCT typeof(text) FROM pages") == [('text',)]
+    assert found("occlusion", db_path) == ['pump.txt']
+
+
+# --- Code index ---
+def test_code_queries_are_recognized():
+    assert is_code_query("PN-A0227-03") and is_code_query("0227")
+    assert not is_code_query("pump alarm") and not is_code_query('"pressure sensor"')
+
+
+@pytest.mark.skipif(not TRIGRAM_ENABLED, reason="SQLite has no trigram tokenizer")
+def test_part_number_substring_found_with_code_index(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "replace the filter PN-A0227-03 every year")
+    scan(folder, db_path)
+    conn = connect_index(db_path)
+    assert route_fts_query(conn.cursor(), "0227")[0] == 'documents_fts'
+    conn.close()
+    assert found("0227", db_path) == []
+    assert found("PN-A0227-03", db_path) == ['pump.txt']
+
+    set_code_index(db_path)
+    conn = connect_index(db_path)
+    assert route_fts_query(conn.cursor(), "0227")[0] == 'pages_code_fts'
+    assert route_fts_query(conn.cursor(), "pump alarm")[0] == 'documents_fts'
+    conn.close()
+    assert found("0227", db_path) == ['pump.txt']
+
+    write_file(folder / 'vent.txt', "ventilator valve PN-B0227-11")
+    scan(folder, db_path) # Pages written after the index is built are in it too
+    assert found("0227", db_path) == ['pump.txt', 'vent.txt']
+
+
+# --- Thumbnail cache ---
+def cached_thumbnails(db_path):
+    """Sorted content hashes in the thumbnail cache."""
+    cache_conn = open_thumbnail_cache(db_path)
+    try:
+        return sorted(row[0] for row in cache_conn.execute("SELECT content_hash FROM thumbnails"))
+    finally:
+        cache_conn.close()
+
+
+def test_least_recently_used_thumbnails_are_evicted(library):
+    folder, db_path = library
+    write_file(folder / 'pump.pdf', b"%PDF pump")
+    scan(folder, db_path)
+    (doc_id, pump_hash), = query(db_path, "SELECT id, content_hash FROM documents")
+    cache_conn = open_thumbnail_cache(db_path)
+    for content_hash in (pump_hash, 'older', 'newer'):
+        store_thumbnails(cache_conn, content_hash, [(0, b"x" * 100)])
+    cache_conn.executemany("UPDATE thumbnails SET last_used = ? WHERE content_hash = ?", [(1, pump_hash), (2, 'older'), (3, 'newer')])
+    cache_conn.commit(); cache_conn.close()
+    assert get_thumbnail(doc_id, db_path=db_path) == b"x" * 100 # Shown: now the most recently used
+    assert get_thumbnail(doc_id, page_number=1, db_path=db_path) is None
+    cache_conn = open_thumbnail_cache(db_path)
+    assert evict_thumbnails(cache_conn, 250) == 1
+    cache_conn.close()
+    assert cached_thumbnails(db_path) == sorted([pump_hash, 'newer'])
+
+
+def test_generate_thumbnails_skips_tried_and_quarantined_files_and_stops_slow_ones(library, monkeypatch):
+    folder, db_path = library
+    for name in ('a', 'b', 'c', 'd'): write_file(folder / f'{name}.pdf', f"%PDF {name}".encode())
+    scan(folder, db_path)
+    hashes = dict(query(db_path, "SELECT filename, content_hash FROM documents"))
+    conn = connect_index(db_path)
+    conn.execute("INSERT INTO quarantine (filepath, content_hash, file_size, reason, duration, quarantined) "
+                 "VALUES (?, NULL, 6, 'timed out', 300, 0)", (str(folder / 'c.pdf'),))
+    conn.commit(); conn.close()
+    rendered = []
+
+    def fake_render(source, all_pages=False, progress=None):
+        rendered.append(os.path.basename(source))
+        if source.endswith('d.pdf'): time.sleep(0.3)
+        progress(0)
+        return [(0, b"png")]
+    monkeypatch.setattr(bme_indexer, 'FITZ_ENABLED', True)
+    monkeypatch.setattr(bme_indexer, 'render_pdf_thumbnails', fake_render)
+    stats = generate_thumbnails(db_path, page_timeout=0.1, skip_hashes={hashes['b.pdf']})
+    assert sorted(rendered) == ['a.pdf', 'd.pdf']
+    assert (stats['rendered'], stats['errors']) == (1, 1)
+    assert cached_thumbnails(db_path) == [hashes['a.pdf']]
+
+
+# --- Properties and outline ---
+def test_properties_and_outline_are_stored_and_read_back(library, monkeypatch):
+    folder, db_path = library
+    write_file(folder / 'pump.pdf', b"%PDF pump")
+    scan(folder, db_path) # No PDF extractor here: indexed without text
+    (doc_id,), = query(db_path, "SELECT id FROM documents")
+    properties = {'page_count': 2, 'title': "Pump manual", 'author': "BME", 'producer': None, 'created': "2023-01-15 10:30:00"}
+    outline = [(1, "Alarms", 0), (2, "Occlusion", 1), (1, "Appendix", -1)]
+    conn = connect_index(db_path)
+    write_extraction_result(conn.cursor(), {'doc_id': doc_id, 'pages': [(0, "alarms"), (1, "occlusion")],
+                                            'outline': outline, 'properties': properties}, False)
+    conn.commit(); conn.close()
+    assert get_document_properties(doc_id, db_path) == properties
+    assert get_document_outline(doc_id, db_path) == outline
+    navigator = pytest.importorskip('bme_navigator') # Needs tkinter and PyMuPDF
+    monkeypatch.setattr(bme_indexer, 'DATABASE_FILE', db_path)
+    assert navigator.load_document_outline(doc_id, str(folder / 'pump.pdf')) == outline # Not read from the file
+
+
+# --- Streamed text ---
+def test_text_that_fails_part_way_is_not_kept(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'log.txt', "ventilator log")
+    scan(folder, db_path)
+    ids = dict(query(db_path, "SELECT filename, id FROM documents"))
+
+    def unreadable_after(count):
+        for page_number in range(count): yield page_number, f"leak page{page_number}"
+        raise OSError("file went away")
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+    page_buffer = [(ids['pump.txt'], 9, "buffered pressures")]
+    result = {'doc_id': ids['log.txt'], 'pages': unreadable_after(3), 'outline': [(1, "Log", 0)], 'properties': {'title': "Log"}, 'error': None}
+    assert write_extraction_result(cursor, result, False, page_buffer, batch_rows=3) == 0 # Two pages were already flushed
+    assert result['error'] == "file went away" and page_buffer == []
+    result = {'doc_id': ids['log.txt'], 'pages': unreadable_after(2), 'outline': [], 'properties': {}, 'error': None}
+    page_buffer = [(ids['pump.txt'], 10, "buffered")]
+    assert write_extraction_result(cursor, result, False, page_buffer) == 0
+    assert page_buffer == [(ids['pump.txt'], 10, "buffered")] # Other documents' pages stay queued
+    conn.commit(); conn.close()
+    for table in ('pages', 'document_outline', 'document_properties'):
+        assert query(db_path, f"SELECT COUNT(*) FROM {table} WHERE doc_id = ?", (ids['log.txt'],)) == [(0,)]
+    assert found("leak", db_path) == [] and found("pressures", db_path) == ['pump.txt']
+
+
+# --- Schema migration ---
+def test_original_fts_table_is_migrated_to_pages(tmp_path):
+    db_path = str(tmp_path / 'index.db')
+    conn = sqlite3.connect(db_path) # The schema of the first releases: page text stored in the FTS table
+    conn.executescript("""
+        CREATE TABLE scan_paths (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL UNIQUE);
+        CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, filepath TEXT NOT NULL UNIQUE,
+            manufacturer TEXT, device_model TEXT, document_type TEXT, keywords TEXT, last_modified REAL NOT NULL,
+            revision_number TEXT, revision_date TEXT, status TEXT, applicable_models TEXT, associated_test_equipment TEXT);
+        CREATE VIRTUAL TABLE documents_fts USING fts5(doc_id UNINDEXED, page_number UNINDEXED, content);
+        CREATE TRIGGER documents_ad_trigger AFTER DELETE ON documents BEGIN DELETE FROM documents_fts WHERE doc_id=old.id; END;
+    """)
+    conn.executemany("INSERT INTO documents (id, filename, filepath, last_modified) VALUES (?, ?, ?, 1)",
+                     [(1, 'pump.pdf', '/lib/pump.pdf'), (2, 'vent.pdf', '/lib/vent.pdf')])
+    conn.executemany("INSERT INTO documents_fts (doc_id, page_number, content) VALUES (?, ?, ?)",
+                     [(1, 0, "infusion pump"), (1, 3, "occlusion alarm"), (2, 0, "ventilator circuit leak test"), (2, 1, "occlusion of the circuit")])
+    conn.commit()
+    before = sorted(conn.execute("SELECT doc_id, page_number FROM documents_fts WHERE documents_fts MATCH 'occlusion'"))
+    conn.close()
+    init_db(db_path)
+    assert query(db_path, "SELECT doc_id, page_number, text FROM pages ORDER BY id") == [
+        (1, 0, "infusion pump"), (1, 3, "occlusion alarm"), (2, 0, "ventilator circuit leak test"), (2, 1, "occlusion of the circuit")]
+    conn = connect_index(db_path) # Registers page_text(), which the index reads through
+    assert sorted(conn.execute("SELECT doc_id, page_number FROM documents_fts WHERE documents_fts MATCH 'occlusion'")) == before
+    conn.close()
+    assert sorted((row[0], row[4]) for row in search_content_snippets("occlusion", db_path)) == [(1, 3), (2, 1)]
+    assert [row[1] for row in search_documents("leak", db_path=db_path)] == ['vent.pdf']
+    init_db(db_path) # Migrated once: nothing is copied again
+    assert query(db_path, "SELECT COUNT(*) FROM pages") == [(4,)]
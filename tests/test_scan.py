@@ -0,0 +1,311 @@
+# BME Document Navigator - Scan Tests
+# Incremental scans, extracted in-thread: change detection, resuming, shared text of
+# copies, removal, the text cache, archive members and the folder cache.
+import io
+import os
+import gzip
+import sqlite3
+import tarfile
+import zipfile
+import pytest
+import bme_indexer
+from bme_indexer import (connect_index, remove_documents, search_content_snippets, rebuild_fts,
+                         get_document_properties, get_document_outline)
+from conftest import write_file, scan, query, documents, found
+
+
+# --- Change detection ---
+def test_new_files_are_added(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'vent.txt', "ventilator circuit leak test")
+    stats = scan(folder, db_path)
+    assert stats['added'] == 2 and stats['errors'] == 0
+    assert found("occlusion", db_path) == ['pump.txt']
+    assert all(text_doc_id == doc_id for doc_id, text_doc_id in documents(db_path).values())
+
+
+def test_unchanged_files_are_skipped(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    stats = scan(folder, db_path)
+    assert (stats['added'], stats['updated'], stats['touched'], stats['removed']) == (0, 0, 0, 0)
+
+
+def test_touched_file_is_not_reextracted(library):
+    folder, db_path = library
+    path = folder / 'pump.txt'
+    write_file(path, "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    os.utime(path, (os.path.getmtime(path) + 60,) * 2)
+    stats = scan(folder, db_path)
+    assert stats['touched'] == 1 and stats['updated'] == 0 and stats['reindexed'] == 0
+    assert found("occlusion", db_path) == ['pump.txt']
+
+
+def test_in_place_edit_is_reindexed(library):
+    folder, db_path = library
+    path = folder / 'pump.txt'
+    write_file(path, "infusion pump occlusion alarm, replace the battery")
+    scan(folder, db_path)
+    write_file(path, "infusion pump pressures alarm, replace the battery") # Same size, middle changed
+    stats = scan(folder, db_path)
+    assert stats['updated'] == 1 and stats['reindexed'] == 1
+    assert found("occlusion", db_path) == []
+    assert found("pressures", db_path) == ['pump.txt']
+
+
+def test_size_change_with_same_mtime_is_reindexed(library):
+    folder, db_path = library
+    path = folder / 'pump.txt'
+    write_file(path, "infusion pump occlusion alarm", mtime=1_600_000_000)
+    scan(folder, db_path)
+    write_file(path, "infusion pump occlusion alarm and a flow sensor", mtime=1_600_000_000)
+    stats = scan(folder, db_path)
+    assert stats['updated'] == 1
+    assert found("sensor", db_path) == ['pump.txt']
+
+
+def test_hashed_files_keep_walk_order(library):
+    folder, db_path = library
+    names = [f'doc{number:03}.txt' for number in range(60)]
+    for number, name in enumerate(names): # Big and small files, so hashes finish out of order
+        write_file(folder / name, f"manual{number} " * (20000 if number % 7 == 0 else 5))
+    stats = scan(folder, db_path)
+    assert stats['added'] == 60 and stats['errors'] == 0
+    assert [row[0] for row in query(db_path, "SELECT filename FROM documents ORDER BY id")] == names
+    assert all(content_hash for (content_hash,) in query(db_path, "SELECT content_hash FROM documents"))
+
+
+# --- Resume from a checkpoint ---
+def test_interrupted_scan_resumes_after_last_committed_folder(library, monkeypatch):
+    folder, db_path = library
+    for name in ('a', 'b', 'c'):
+        write_file(folder / name / f'{name}.txt', f"manual {name}{name}{name} service")
+    write_extraction_result = bme_indexer.write_extraction_result
+
+    def interrupt_in_c(cursor, result, *args, **kwargs):
+        if os.path.basename(result['filepath']) == 'c.txt': raise sqlite3.OperationalError("disk I/O error")
+        return write_extraction_result(cursor, result, *args, **kwargs)
+    monkeypatch.setattr(bme_indexer, 'write_extraction_result', interrupt_in_c)
+    with pytest.raises(sqlite3.OperationalError):
+        scan(folder, db_path, checkpoint_files=1)
+    monkeypatch.undo()
+    assert query(db_path, "SELECT status, resume_dir FROM scan_journal") == [('interrupted', str(folder / 'b'))]
+
+    stats = scan(folder, db_path)
+    assert stats['resumed']
+    # Only c.txt is extracted (its row may already be reserved, with last_modified 0: 'updated')
+    assert stats['added'] + stats['updated'] == 1 and stats['removed'] == 0
+    assert sorted(documents(db_path)) == ['a.txt', 'b.txt', 'c.txt']
+    assert found("ccc", db_path) == ['c.txt']
+    assert query(db_path, "SELECT status FROM scan_journal ORDER BY scan_id DESC LIMIT 1") == [('completed',)]
+
+
+# --- Shared text of copies ---
+def test_copy_shares_text_of_original(library):
+    folder, db_path = library
+    write_file(folder / 'a' / 'pump.txt', "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    write_file(folder / 'b' / 'pump.txt', "infusion pump occlusion alarm")
+    stats = scan(folder, db_path)
+    assert stats['added'] == 1 and stats['duplicates'] == 1
+    (owner_id, owner_text), (copy_id, copy_text) = query(db_path, "SELECT id, text_doc_id FROM documents ORDER BY id")
+    assert owner_text == owner_id and copy_text == owner_id
+    assert query(db_path, "SELECT DISTINCT doc_id FROM pages") == [(owner_id,)]
+    assert found("occlusion", db_path) == ['pump.txt'] # Copies share one hit
+
+
+def test_files_sharing_size_head_and_tail_keep_their_own_text(library):
+    folder, db_path = library
+    padding = "x " * 40000 # Same size, first and last bytes; only the middle differs
+    write_file(folder / 'a.txt', padding + "occlusion " + padding)
+    write_file(folder / 'b.txt', padding + "calibrate " + padding)
+    stats = scan(folder, db_path)
+    assert stats['duplicates'] == 0 and stats['reindexed'] == 2
+    assert all(text_doc_id == doc_id for doc_id, text_doc_id in documents(db_path).values())
+    assert found("occlusion", db_path) == ['a.txt']
+    assert found("calibrate", db_path) == ['b.txt']
+
+
+def test_removed_owner_hands_text_to_copy(library):
+    folder, db_path = library
+    write_file(folder / 'a' / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'b' / 'pump.txt', "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    os.remove(folder / 'a' / 'pump.txt')
+    stats = scan(folder, db_path)
+    assert stats['removed'] == 1
+    [(doc_id, text_doc_id)] = query(db_path, "SELECT id, text_doc_id FROM documents")
+    assert text_doc_id == doc_id and query(db_path, "SELECT DISTINCT doc_id FROM pages") == [(doc_id,)]
+    assert found("occlusion", db_path) == ['pump.txt']
+
+
+def test_edited_owner_keeps_copy_text(library):
+    folder, db_path = library
+    write_file(folder / 'a' / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'b' / 'pump.txt', "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    write_file(folder / 'a' / 'pump.txt', "infusion pump pressures alarm")
+    scan(folder, db_path)
+    assert all(text_doc_id == doc_id for doc_id, text_doc_id in documents(db_path).values())
+    folder_of = lambda text: [os.path.basename(os.path.dirname(row[2])) for row in search_content_snippets(text, db_path)]
+    assert folder_of("occlusion") == ['b']
+    assert folder_of("pressures") == ['a']
+
+
+# --- Removal ---
+def test_deleted_files_and_folders_are_removed(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    for number in range(5):
+        write_file(folder / 'old' / f'vent{number}.txt', f"ventilator circuit leak test {number}")
+    scan(folder, db_path)
+    for number in range(5): os.remove(folder / 'old' / f'vent{number}.txt')
+    os.rmdir(folder / 'old')
+    stats = scan(folder, db_path)
+    assert stats['removed'] == 5
+    assert list(documents(db_path)) == ['pump.txt']
+    assert found("leak", db_path) == [] and query(db_path, "SELECT COUNT(*) FROM pages") == [(1,)]
+
+
+def test_remove_documents_leaves_no_orphans(library):
+    folder, db_path = library
+    for name in ('a', 'b', 'c'):
+        write_file(folder / 'shared' / f'{name}.txt', "infusion pump occlusion alarm")
+        write_file(folder / 'own' / f'{name}.txt', f"ventilator {name}{name}{name} leak test")
+    scan(folder, db_path)
+    conn = connect_index(db_path)
+    cursor = conn.cursor()
+    doc_ids = [row[0] for row in cursor.execute( # All but shared/c.txt, a copy of the text owner shared/a.txt
+        "SELECT id FROM documents WHERE filename != 'c.txt' OR filepath LIKE '%own%'")]
+    assert remove_documents(cursor, doc_ids) == 5
+    conn.commit()
+    conn.close()
+    [(doc_id, text_doc_id)] = query(db_path, "SELECT id, text_doc_id FROM documents")
+    assert text_doc_id == doc_id
+    assert query(db_path, "SELECT COUNT(*) FROM pages WHERE doc_id NOT IN (SELECT id FROM documents)") == [(0,)]
+    assert found("occlusion", db_path) == ['c.txt']
+    assert found("leak", db_path) == []
+
+
+# --- Text cache ---
+def test_moved_file_is_read_from_the_text_cache(library):
+    folder, db_path = library
+    write_file(folder / 'a' / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'a' / 'vent.txt', "ventilator circuit leak test")
+    stats = scan(folder, db_path, text_cache=True)
+    assert stats['text_cache_hits'] == 0 and stats['text_cache_lookups'] == 2
+    os.renames(folder / 'a' / 'pump.txt', folder / 'b' / 'pump.txt')
+    stats = scan(folder, db_path, text_cache=True)
+    assert stats['added'] == 1 and stats['removed'] == 1 and stats['text_cache_hits'] == 1
+    assert found("occlusion", db_path) == ['pump.txt']
+    assert query(db_path, "SELECT filepath FROM documents WHERE filename = 'pump.txt'") == [(str(folder / 'b' / 'pump.txt'),)]
+
+
+def test_rebuild_fts_reads_text_from_the_cache(library):
+    folder, db_path = library
+    write_file(folder / 'a' / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'b' / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'vent.txt', "ventilator circuit leak test")
+    scan(folder, db_path, text_cache=True)
+    stats = rebuild_fts(db_path)
+    assert (stats['documents'], stats['cache_hits'], stats['extracted'], stats['duplicates'], stats['errors']) == (2, 2, 0, 1, 0)
+    assert found("occlusion", db_path) == ['pump.txt'] and found("leak", db_path) == ['vent.txt']
+    assert query(db_path, "SELECT COUNT(*) FROM pages") == [(2,)]
+
+
+def test_rebuild_fts_drops_properties_of_files_it_cannot_read(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    (doc_id,), = query(db_path, "SELECT id FROM documents")
+    conn = connect_index(db_path) # As recorded by an earlier extraction of the file
+    conn.execute("INSERT INTO document_properties (doc_id, page_count, title) VALUES (?, 1, 'Pump manual')", (doc_id,))
+    conn.execute("INSERT INTO document_outline (doc_id, position, level, title, page_number) VALUES (?, 0, 1, 'Alarms', 0)", (doc_id,))
+    conn.commit(); conn.close()
+    os.remove(folder / 'pump.txt')
+    stats = rebuild_fts(db_path)
+    assert stats['errors'] == 1
+    assert get_document_properties(doc_id, db_path) is None and get_document_outline(doc_id, db_path) == []
+
+
+def test_rebuild_fts_ignores_quarantine_rows_without_a_hash(library):
+    folder, db_path = library
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    scan(folder, db_path)
+    conn = connect_index(db_path) # Not hashed yet (migrated index), and an unrelated file quarantined before hashing
+    conn.execute("UPDATE documents SET content_hash = NULL")
+    conn.execute("INSERT INTO quarantine (filepath, content_hash, file_size, reason, duration, quarantined) "
+                 "VALUES (?, NULL, 1, 'timed out', 300, 0)", (str(folder / 'huge.pdf'),))
+    conn.commit(); conn.close()
+    stats = rebuild_fts(db_path)
+    assert stats['documents'] == 1 and found("occlusion", db_path) == ['pump.txt']
+
+
+
+# --- Archives ---
+def write_zip(path, members):
+    """Writes a zip archive of {member_name: text} to path."""
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as archive:
+        for name, text in members.items(): archive.writestr(name, text)
+    write_file(path, data.getvalue())
+
+
+def test_archive_members_are_indexed_without_unpacking(library, tmp_path):
+    folder, db_path = library
+    write_zip(folder / 'manuals.zip', {'docs/pump.txt': "infusion pump occlusion alarm", 'logo.bin': "not indexed"})
+    (tmp_path / 'vent.txt').write_text("ventilator circuit leak test")
+    with tarfile.open(folder / 'service.tar.gz', 'w:gz') as archive: archive.add(tmp_path / 'vent.txt', 'vent.txt')
+    with gzip.open(folder / 'monitor.txt.gz', 'wt') as member: member.write("patient monitor lead off")
+    stats = scan(folder, db_path)
+    assert stats['errors'] == 0
+    filepaths = {filepath for (filepath,) in query(db_path, "SELECT filepath FROM documents")}
+    assert {str(folder / 'manuals.zip') + '!docs/pump.txt', str(folder / 'service.tar.gz') + '!vent.txt',
+            str(folder / 'monitor.txt.gz') + '!monitor.txt'} <= filepaths
+    assert not any(filepath.endswith('logo.bin') for filepath in filepaths)
+    hit_path = lambda text: [row[2] for row in search_content_snippets(text, db_path)]
+    assert hit_path("occlusion") == [str(folder / 'manuals.zip') + '!docs/pump.txt']
+    assert hit_path("leak") == [str(folder / 'service.tar.gz') + '!vent.txt']
+    assert hit_path("lead") == [str(folder / 'monitor.txt.gz') + '!monitor.txt']
+    assert not list(tmp_path.glob('library/**/pump.txt')) # Nothing unpacked next to the archive
+
+
+def test_changed_archive_keeps_unchanged_members_and_drops_removed_ones(library):
+    folder, db_path = library
+    write_zip(folder / 'manuals.zip', {'pump.txt': "infusion pump occlusion alarm", 'vent.txt': "ventilator circuit leak test"})
+    scan(folder, db_path)
+    pump_id = query(db_path, "SELECT id FROM documents WHERE filename = 'pump.txt'")
+    write_zip(folder / 'manuals.zip', {'pump.txt': "infusion pump occlusion alarm", 'monitor.txt': "patient monitor lead off"})
+    stats = scan(folder, db_path)
+    assert stats['removed'] == 1
+    assert query(db_path, "SELECT id FROM documents WHERE filename = 'pump.txt'") == pump_id
+    assert found("leak", db_path) == [] and found("lead", db_path) == ['monitor.txt']
+    assert found("occlusion", db_path) == ['pump.txt']
+
+
+# --- Directory cache ---
+def test_unchanged_folders_are_skipped_and_changed_ones_listed(library):
+    folder, db_path = library
+    write_file(folder / 'a' / 'pump.txt', "infusion pump occlusion alarm")
+    write_file(folder / 'b' / 'vent.txt', "ventilator circuit leak test")
+    for directory in (folder / 'a', folder / 'b', folder): # Older than the race window
+        os.utime(directory, (os.path.getmtime(directory) - 60,) * 2)
+    stats = scan(folder, db_path, use_dir_cache=True)
+    assert stats['dirs_listed'] == 3 and stats['added'] == 2
+
+    stats = scan(folder, db_path, use_dir_cache=True)
+    assert (stats['dirs_listed'], stats['dirs_skipped']) == (0, 3)
+    write_file(folder / 'a' / 'pump.txt', "infusion pump pressures alarm") # In-place edit: missed with the cache on
+    stats = scan(folder, db_path, use_dir_cache=True)
+    assert stats['dirs_skipped'] == 3 and stats['updated'] == 0
+    assert found("pressures", db_path) == []
+
+    write_file(folder / 'b' / 'monitor.txt', "patient monitor lead off") # Changes b's mtime
+    os.remove(folder / 'a' / 'pump.txt')
+    stats = scan(folder, db_path, use_dir_cache=True)
+    assert (stats['dirs_listed'], stats['dirs_skipped']) == (2, 1) # a and b listed again; the root is unchanged
+    assert stats['added'] == 1 and stats['removed'] == 1
+    assert sorted(documents(db_path)) == ['monitor.txt', 'vent.txt']
@@ -0,0 +1,113 @@
+# BME Document Navigator - Watch Mode Tests
+# watch_and_index on a background thread with the polling backend and short intervals.
+import time
+import sqlite3
+import threading
+import pytest
+import bme_indexer
+from bme_indexer import watch_and_index
+from conftest import write_file, query, found, hold_scan_lock
+from test_extraction_pool import worker_crashing_on
+
+
+def wait_for(condition, timeout=20):
+    """Polls condition() until it is true; fails the test after timeout seconds."""
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline: pytest.fail("timed out waiting for watch mode")
+        time.sleep(0.1)
+
+
+@pytest.fixture
+def watching(library):
+    """Starts watch mode on the library: (folder, db_path, reports). Stopped at the end of the test."""
+    folder, db_path = library
+    stop_event, reports = threading.Event(), []
+    started = {}
+
+    def start(**options):
+        options = dict({'backend': 'poll', 'poll_interval': 0.2, 'debounce_seconds': 0.2, 'text_cache': False}, **options)
+        thread = threading.Thread(target=watch_and_index, args=([str(folder)], stop_event),
+                                  kwargs=dict(options, status_callback=reports.append, db_path=db_path))
+        thread.start()
+        started['thread'] = thread
+        time.sleep(0.5) # First snapshot of the folders
+    yield folder, db_path, reports, start
+    stop_event.set()
+    if 'thread' in started: started['thread'].join(10)
+
+
+def test_watch_indexes_new_edited_and_deleted_files(watching):
+    folder, db_path, reports, start = watching
+    (folder / 'acme').mkdir()
+    start(folder_manufacturers={str(folder): 'Acme'})
+    write_file(folder / 'acme' / 'pump.txt', "infusion pump occlusion alarm")
+    wait_for(lambda: found("occlusion", db_path) == ['pump.txt'])
+    assert query(db_path, "SELECT manufacturer FROM documents") == [('Acme',)]
+
+    write_file(folder / 'acme' / 'pump.txt', "infusion pump pressures alarm")
+    wait_for(lambda: found("pressures", db_path) == ['pump.txt'])
+    assert found("occlusion", db_path) == []
+
+    (folder / 'acme' / 'pump.txt').unlink()
+    wait_for(lambda: query(db_path, "SELECT COUNT(*) FROM documents") == [(0,)])
+    assert any(report.get('removed') for report in reports)
+
+
+def test_watch_retries_a_path_after_a_database_error(watching, monkeypatch):
+    folder, db_path, reports, start = watching
+    monkeypatch.setattr(bme_indexer, 'WATCH_RETRY_SECONDS', 0.3)
+    index_path, calls = bme_indexer.index_path, []
+
+    def locked_once(cursor, path, *args):
+        calls.append(path)
+        if len(calls) == 1: raise sqlite3.OperationalError("database is locked")
+        return index_path(cursor, path, *args)
+    monkeypatch.setattr(bme_indexer, 'index_path', locked_once)
+    start()
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    wait_for(lambda: found("occlusion", db_path) == ['pump.txt'])
+    assert len(calls) == 2
+
+
+def test_watch_gives_up_after_the_retry_limit(watching, monkeypatch):
+    folder, db_path, reports, start = watching
+    monkeypatch.setattr(bme_indexer, 'WATCH_RETRY_SECONDS', 0.1)
+    monkeypatch.setattr(bme_indexer, 'WATCH_RETRY_ATTEMPTS', 3)
+    calls = []
+
+    def always_locked(cursor, path, *args):
+        calls.append(path)
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(bme_indexer, 'index_path', always_locked)
+    start()
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+    wait_for(lambda: any(report.get('errors') for report in reports))
+    time.sleep(1)
+    assert len(calls) == 3
+
+
+def test_watch_waits_while_another_process_scans(watching, monkeypatch):
+    folder, db_path, reports, start = watching
+    monkeypatch.setattr(bme_indexer, 'WATCH_RETRY_SECONDS', 0.3)
+    start()
+    holder = hold_scan_lock(db_path)
+    try:
+        write_file(folder / 'pump.txt', "infusion pump occlusion alarm")
+        time.sleep(1.5)
+        assert query(db_path, "SELECT COUNT(*) FROM documents") == [(0,)]
+    finally:
+        holder.stdin.close()
+        holder.wait(10)
+    wait_for(lambda: found("occlusion", db_path) == ['pump.txt'])
+    assert not any(report.get('errors') for report in reports)
+
+
+def test_watch_kills_and_quarantines_a_hung_extraction(watching, monkeypatch):
+    folder, db_path, reports, start = watching
+    monkeypatch.setattr(bme_indexer, 'extraction_worker_main', worker_crashing_on) # Hangs on 'slow' files
+    start(extract_file_timeout=2, extract_page_timeout=2)
+    write_file(folder / 'slow.txt', "never extracted")
+    wait_for(lambda: query(db_path, "SELECT filepath FROM quarantine") == [(str(folder / 'slow.txt'),)])
+    write_file(folder / 'pump.txt', "infusion pump occlusion alarm") # The watcher carries on
+    wait_for(lambda: found("occlusion", db_path) == ['pump.txt'])